@@ -10,19 +10,50 @@ import contextlib
 import logging
 import os
 import json
+import pipes
+import tarfile
 import time
+import gevent.pool
 
 from ceph_manager import CephManager
 from teuthology import misc as teuthology
 from teuthology import contextutil
 from teuthology.orchestra import run
+from teuthology.parallel import parallel
 import ceph_client as cclient
 from teuthology.orchestra.run import CommandFailedError
 from teuthology.orchestra.daemon import DaemonGroup
+from util.phases import get_phase_timer
+from util.cluster_log import ClusterLogScanner
+from util import valgrind
+from util import cpu_profile
+from util import snapshot
 
 DEFAULT_CONF_PATH = '/etc/ceph/ceph.conf'
 CEPH_ROLE_TYPES = ['mon', 'osd', 'mds', 'rgw']
 
+# Touched when the logs are set up, so that archiving can skip files
+# that were not written during the job
+ARCHIVE_STAMP = '/var/log/ceph/job-start.stamp'
+
+# Shell snippets for each archive compression: 'files' compresses the
+# files given as arguments in place, 'stream' compresses stdin to stdout.
+# gzip output is multi-threaded when pigz is installed.
+ARCHIVE_COMPRESSION = {
+    'gzip': {
+        'ext': '.tgz',
+        'files': 'if command -v pigz >/dev/null; then exec pigz -- "$@"; '
+                 'else exec gzip -- "$@"; fi',
+        'stream': 'if command -v pigz >/dev/null; then exec pigz -c; '
+                  'else exec gzip -c; fi',
+        },
+    'zstd': {
+        'ext': '.tar.zst',
+        'files': 'exec zstd -q --rm -T0 -- "$@"',
+        'stream': 'exec zstd -q -c -T0',
+        },
+    }
+
 log = logging.getLogger(__name__)
 
 
@@ -66,6 +97,8 @@ def ceph_log(ctx, config):
                 'install', '-d', '-m0755', '--',
                 '/var/log/ceph/valgrind',
                 '/var/log/ceph/profiling-logger',
+                run.Raw('&&'),
+                'touch', ARCHIVE_STAMP,
                 ],
             wait=False,
             )
@@ -91,9 +124,11 @@ def assign_devs(roles, devs):
 @contextlib.contextmanager
 def valgrind_post(ctx, config):
     """
-    After the tests run, look throught all the valgrind logs.  Exceptions are raised
-    if textual errors occured in the logs, or if valgrind exceptions were detected in
-    the logs.
+    After the tests run, look through all the valgrind logs.  Each host
+    summarizes its own logs, deduplicating errors by their stacks (see
+    util.valgrind), and an exception is raised if any error is not covered
+    by valgrind.SUPPRESSIONS.  The summaries are saved as valgrind.json in
+    the archive.
 
     :param ctx: Context
     :param config: Configuration
@@ -101,48 +136,81 @@ def valgrind_post(ctx, config):
     try:
         yield
     finally:
-        lookup_procs = list()
-        log.info('Checking for errors in any valgrind logs...');
-        for remote in ctx.cluster.remotes.iterkeys():
-            #look at valgrind logs for each node
-            proc = remote.run(
-                args=[
-                    'sudo',
-                    'zgrep',
-                    '<kind>',
-                    run.Raw('/var/log/ceph/valgrind/*'),
-                    '/dev/null', # include a second file so that we always get a filename prefix on the output
-                    run.Raw('|'),
-                    'sort',
-                    run.Raw('|'),
-                    'uniq',
-                    ],
-                wait=False,
-                check_status=False,
-                stdout=StringIO(),
-                )
-            lookup_procs.append((proc, remote))
-
-        valgrind_exception = None
-        for (proc, remote) in lookup_procs:
-            proc.wait()
-            out = proc.stdout.getvalue()
-            for line in out.split('\n'):
-                if line == '':
-                    continue
-                try:
-                    (file, kind) = line.split(':')
-                except Exception:
-                    log.error('failed to split line %s', line)
-                    raise
-                log.debug('file %s kind %s', file, kind)
-                if (file.find('mds') >= 0) and kind.find('Lost') > 0:
-                    continue
-                log.error('saw valgrind issue %s in %s', kind, file)
-                valgrind_exception = Exception('saw valgrind issues')
+        log.info('Checking for errors in any valgrind logs...')
+        procs = [(remote, valgrind.start_triage(remote))
+                 for remote in ctx.cluster.remotes.iterkeys()]
+        reports = {}
+        failures = []
+        for remote, proc in procs:
+            report = valgrind.finish_triage(proc)
+            reports[remote.shortname] = report
+            for daemon, entry in report.iteritems():
+                if 'truncated' in entry:
+                    log.debug('valgrind log for %s on %s is truncated: %s',
+                              daemon, remote.shortname, entry['truncated'])
+            for daemon, error in valgrind.apply_suppressions(report):
+                log.error('saw valgrind issue on %s in %s: %s',
+                          remote.shortname, daemon, valgrind.describe(error))
+                failures.append(error)
+
+        if ctx.archive is not None and any(reports.values()):
+            with file(os.path.join(ctx.archive, 'valgrind.json'), 'w') as f:
+                json.dump(reports, f, indent=2, sort_keys=True)
+
+        if failures:
+            raise Exception(
+                'saw valgrind issues: {n} distinct errors ({kinds})'.format(
+                    n=len(failures),
+                    kinds=', '.join(sorted(set(e['kind'] for e in failures)))))
+
 
-        if valgrind_exception is not None:
-            raise valgrind_exception
+@contextlib.contextmanager
+def cpu_profile_post(ctx, config):
+    """
+    Once the profiled daemons (see the cpu_profile option) have stopped
+    and written their profiles, symbolize the profiles on each host and
+    merge their folded stacks per daemon type.  The merged stacks are
+    saved as cpu_profile/<type>.collapsed in the archive, ready for
+    flamegraph.pl, and the hottest functions of each type are put in
+    ctx.summary['cpu_profile'].
+
+    :param ctx: Context
+    :param config: Configuration
+    """
+    types = set(config.get('cpu_profile', []))
+    try:
+        yield
+    finally:
+        if types:
+            log.info('Collecting CPU profiles...')
+            with parallel() as p:
+                for remote, roles in ctx.cluster.remotes.iteritems():
+                    if any(teuthology.is_type(t)(role)
+                           for role in roles for t in types):
+                        p.spawn(cpu_profile.collect, remote)
+                by_type = {}
+                for profiles in p:
+                    for name, text in profiles.iteritems():
+                        by_type.setdefault(name.split('.')[0], []).append(
+                            cpu_profile.parse_collapsed(text))
+
+            summary = {}
+            for type_, stack_dicts in sorted(by_type.iteritems()):
+                stacks = cpu_profile.merge(stack_dicts)
+                if not stacks:
+                    continue
+                summary[type_] = cpu_profile.top_functions(
+                    stacks, config.get('cpu_profile_top', 10))
+                log.info('Hottest functions in %s daemons: %s', type_,
+                         ', '.join('%s (%.1f%%)' % (f['function'], f['percent'])
+                                   for f in summary[type_]))
+                if ctx.archive is not None:
+                    path = os.path.join(ctx.archive, 'cpu_profile')
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                    with file(os.path.join(path, type_ + '.collapsed'), 'w') as f:
+                        f.write(cpu_profile.format_collapsed(stacks))
+            ctx.summary['cpu_profile'] = summary
 
 
 def write_conf(ctx, conf_path=DEFAULT_CONF_PATH):
@@ -218,6 +286,301 @@ def cephfs_setup(ctx, config):
     yield
 
 
+def get_files_tarball(remote, paths):
+    """
+    Read several files from a remote with a single tar stream, rather than
+    one round trip per file.
+
+    :param remote: Remote to read from
+    :param paths: list of absolute paths
+    :returns: tuple of (remote, dict of path to file contents)
+    """
+    proc = remote.run(
+        args=[
+            'sudo', 'tar', '-C', '/', '-c', '-f', '-', '--',
+            ] + [path.lstrip('/') for path in paths],
+        stdout=StringIO(),
+        )
+    tar = tarfile.open(mode='r', fileobj=StringIO(proc.stdout.getvalue()))
+    files = {}
+    for member in tar.getmembers():
+        if member.isfile():
+            files['/' + member.name] = tar.extractfile(member).read()
+    tar.close()
+    return remote, files
+
+
+def authtool_import_script(keyring_path, coverage_dir, keys):
+    """
+    Generate a shell script which appends the given keys to a monitor's
+    keyring and sets their caps, so that each monitor needs a single remote
+    command however many daemons there are.
+
+    :param keyring_path: Path of the monitor keyring
+    :param coverage_dir: Coverage directory for ceph-coverage
+    :param keys: list of (type, id, keyring data)
+    :returns: script text, for sh
+    """
+    lines = ['cat >> {path} <<"EOF_KEYRING"'.format(path=pipes.quote(keyring_path))]
+    for _, _, data in keys:
+        lines.append(data.rstrip('\n'))
+    lines.append('EOF_KEYRING')
+    for type_, id_, _ in keys:
+        args = [
+            'adjust-ulimits',
+            'ceph-coverage',
+            coverage_dir,
+            'ceph-authtool',
+            keyring_path,
+            '--name={type}.{id}'.format(
+                type=type_,
+                id=id_,
+                ),
+            ] + list(teuthology.generate_caps(type_))
+        lines.append(' '.join(pipes.quote(arg) for arg in args))
+    return '\n'.join(lines) + '\n'
+
+
+def compress_logs(remote, compression, changed_only=False):
+    """
+    Compress the logs in /var/log/ceph in place, one file per process and
+    as many processes as the remote has CPUs.
+
+    :param remote: Remote to compress logs on
+    :param compression: key of ARCHIVE_COMPRESSION
+    :param changed_only: only compress logs written since ARCHIVE_STAMP
+    """
+    args = ['sudo', 'find', '/var/log/ceph', '-name', '*.log']
+    if changed_only:
+        args.extend(['-newer', ARCHIVE_STAMP])
+    args.extend([
+        '-print0',
+        run.Raw('|'),
+        'sudo', 'xargs', '-0', '--no-run-if-empty', '-n', '1',
+        '-P', run.Raw('$(nproc)'),
+        '--',
+        'sh', '-c', ARCHIVE_COMPRESSION[compression]['files'], 'compress',
+        ])
+    remote.run(args=args)
+
+
+def pull_logs(remote, localdir, changed_only=False):
+    """
+    Copy the (already compressed) contents of /var/log/ceph into
+    ``localdir`` with a single uncompressed tar stream.
+
+    :param remote: Remote to pull logs from
+    :param localdir: local directory to create and fill
+    :param changed_only: only pull files written since ARCHIVE_STAMP
+    """
+    find = ['sudo', 'find', '.', '-type', 'f']
+    if changed_only:
+        find.extend(['-newer', ARCHIVE_STAMP])
+    os.makedirs(localdir)
+    proc = remote.run(
+        args=['cd', '/var/log/ceph', run.Raw('&&')] + find + [
+            '-print0',
+            run.Raw('|'),
+            'sudo', 'tar', '-c', '-f', '-', '--null', '-T', '-',
+            ],
+        stdout=run.PIPE,
+        wait=False,
+        )
+    tar = tarfile.open(mode='r|', fileobj=proc.stdout)
+    for member in tar:
+        name = os.path.normpath(member.name)
+        if not member.isfile() or name.startswith('..') or os.path.isabs(name):
+            log.debug('Not archiving %s from %s', member.name, remote)
+            continue
+        dest = os.path.join(localdir, name)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        tar.makefile(member, dest)
+    tar.close()
+    proc.wait()
+
+
+def pull_mon_data(remote, id_, path, compression):
+    """
+    Stream a tarball of a monitor's data directory, compressed on the
+    remote, straight into a local file.
+
+    :param remote: Remote running the monitor
+    :param id_: monitor id
+    :param path: local file to write
+    :param compression: key of ARCHIVE_COMPRESSION
+    """
+    with file(path, 'wb') as f:
+        remote.run(
+            args=[
+                'sudo', 'tar', '-c', '-f', '-', '-C', '/var/lib/ceph/mon',
+                '--', 'ceph-{id}'.format(id=id_),
+                run.Raw('|'),
+                'sh', '-c', ARCHIVE_COMPRESSION[compression]['stream'],
+                ],
+            stdout=f,
+            )
+
+
+def archive_host(ctx, remote, roles, compression, changed_only=False):
+    """
+    Archive one host's mon data and logs.
+
+    :param ctx: Context
+    :param remote: Remote to archive
+    :param roles: the remote's roles
+    :param compression: key of ARCHIVE_COMPRESSION
+    :param changed_only: only archive logs written during the job
+    """
+    ext = ARCHIVE_COMPRESSION[compression]['ext']
+    for id_ in teuthology.roles_of_type(roles, 'mon'):
+        pull_mon_data(
+            remote, id_,
+            os.path.join(ctx.archive, 'data', 'mon.' + id_ + ext),
+            compression)
+    compress_logs(remote, compression, changed_only)
+    pull_logs(
+        remote,
+        os.path.join(ctx.archive, 'remote', remote.shortname, 'log'),
+        changed_only)
+
+
+def osd_fs_options(config):
+    """
+    Work out the filesystem, mkfs options and mount options to use for
+    OSD data devices, filling in defaults for the chosen filesystem.
+
+    :param config: Configuration of the cluster task
+    :returns: tuple of (fs, mkfs options, mount options)
+    """
+    fs = config.get('fs')
+    mkfs_options = config.get('mkfs_options')
+    mount_options = config.get('mount_options')
+    if fs == 'btrfs':
+        if mount_options is None:
+            mount_options = ['noatime','user_subvol_rm_allowed']
+        if mkfs_options is None:
+            mkfs_options = ['-m', 'single',
+                            '-l', '32768',
+                            '-n', '32768']
+    if fs == 'xfs':
+        if mount_options is None:
+            mount_options = ['noatime']
+        if mkfs_options is None:
+            mkfs_options = ['-f', '-i', 'size=2048']
+    if fs == 'ext4' or fs == 'ext3':
+        if mount_options is None:
+            mount_options = ['noatime','user_xattr']
+
+    if mount_options is None:
+        mount_options = []
+    if mkfs_options is None:
+        mkfs_options = []
+    # copies, as they may be modified per OSD
+    return fs, list(mkfs_options), list(mount_options)
+
+
+def mkfs_osd(ctx, config, remote, id_, dev, devs_to_clean, ceph_mkfs=True):
+    """
+    Create the data directory for one OSD, make and mount a filesystem
+    on its device if it has one, and run ceph-osd --mkfs.
+
+    :param ctx: Context
+    :param config: Configuration of the cluster task
+    :param remote: Remote hosting the OSD
+    :param id_: OSD id
+    :param dev: Device for the OSD data, or None
+    :param devs_to_clean: dict of remote to mountpoints to unmount at teardown
+    :param ceph_mkfs: whether to run ceph-osd --mkfs; not needed when the
+                      OSD data is restored from a snapshot
+    """
+    testdir = teuthology.get_testdir(ctx)
+    coverage_dir = '{tdir}/archive/coverage'.format(tdir=testdir)
+    data_dir = os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_))
+
+    remote.run(
+        args=[
+            'sudo',
+            'mkdir',
+            '-p',
+            data_dir,
+            ])
+    if dev:
+        fs, mkfs_options, mount_options = osd_fs_options(config)
+        mkfs = ['mkfs.%s' % fs] + mkfs_options
+        log.info('%s on %s on %s' % (mkfs, dev, remote))
+
+        try:
+            remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
+        except run.CommandFailedError:
+            # Newer btfs-tools doesn't prompt for overwrite, use -f
+            if '-f' not in mkfs_options:
+                mkfs_options.append('-f')
+                mkfs = ['mkfs.%s' % fs] + mkfs_options
+                log.info('%s on %s on %s' % (mkfs, dev, remote))
+            remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
+
+        log.info('mount %s on %s -o %s' % (dev, remote,
+                                           ','.join(mount_options)))
+        remote.run(
+            args=[
+                'sudo',
+                'mount',
+                '-t', fs,
+                '-o', ','.join(mount_options),
+                dev,
+                data_dir,
+                ]
+            )
+        ctx.disk_config.remote_to_roles_to_dev_mount_options.setdefault(
+            remote, {})[id_] = mount_options
+        ctx.disk_config.remote_to_roles_to_dev_fstype.setdefault(
+            remote, {})[id_] = fs
+        devs_to_clean[remote].append(data_dir)
+
+    if ceph_mkfs:
+        remote.run(
+            args=[
+                'sudo',
+                'MALLOC_CHECK_=3',
+                'adjust-ulimits',
+                'ceph-coverage',
+                coverage_dir,
+                'ceph-osd',
+                '--mkfs',
+                '--mkkey',
+                '-i', id_,
+                '--monmap', '{tdir}/monmap'.format(tdir=testdir),
+                ],
+            )
+
+
+def mkfs_osds_on_host(ctx, config, remote, ids, roles_to_devs, devs_to_clean,
+                      ceph_mkfs=True):
+    """
+    Run mkfs_osd for all the OSDs on one host, at most
+    config['mkfs_concurrency'] at a time.  A failing OSD does not stop the
+    others.
+
+    :returns: list of (remote, id, exception) for the OSDs that failed
+    """
+    limit = config.get('mkfs_concurrency') or len(ids) or 1
+    pool = gevent.pool.Pool(limit)
+    greenlets = [(id_, pool.spawn(mkfs_osd, ctx, config, remote, id_,
+                                  roles_to_devs.get(id_), devs_to_clean,
+                                  ceph_mkfs))
+                 for id_ in ids]
+    pool.join()
+
+    failures = []
+    for id_, greenlet in greenlets:
+        if not greenlet.successful():
+            log.error('mkfs of osd.%s on %s failed: %s', id_, remote.shortname,
+                      greenlet.exception)
+            failures.append((remote, id_, greenlet.exception))
+    return failures
+
+
 @contextlib.contextmanager
 def cluster(ctx, config):
     """
@@ -247,6 +610,7 @@ def cluster(ctx, config):
         log.info("'use_existing_cluster' is true; skipping cluster creation")
         yield
 
+    timer = get_phase_timer(ctx)
     testdir = teuthology.get_testdir(ctx)
     log.info('Creating ceph cluster...')
     run.wait(
@@ -338,48 +702,68 @@ def cluster(ctx, config):
 
     keyring_path = config.get('keyring_path', '/etc/ceph/ceph.keyring')
 
+    snapshot_config = config.get('snapshot') or {}
+    snapshot_store = None
+    restoring = False
+    if snapshot_config:
+        if any(remote_to_roles_to_journals.values()):
+            log.warning('Cluster snapshots do not support external journals, not using them')
+        else:
+            snapshot_store = snapshot.LocalSnapshotStore(
+                snapshot_config.get('path', snapshot.DEFAULT_SNAPSHOT_PATH))
+            snapshot_id = snapshot.snapshot_key(ctx, conf, config)
+            restoring = snapshot_config.get('restore', True) and \
+                snapshot_store.exists(snapshot_id)
+            log.info('Cluster snapshot %s %s', snapshot_id,
+                     'found, restoring it' if restoring else 'not found')
+
     coverage_dir = '{tdir}/archive/coverage'.format(tdir=testdir)
 
     firstmon = teuthology.get_first_mon(ctx, config)
 
-    log.info('Setting up %s...' % firstmon)
-    ctx.cluster.only(firstmon).run(
-        args=[
-            'sudo',
-            'adjust-ulimits',
-            'ceph-coverage',
-            coverage_dir,
-            'ceph-authtool',
-            '--create-keyring',
-            keyring_path,
-            ],
-        )
-    ctx.cluster.only(firstmon).run(
-        args=[
-            'sudo',
-            'adjust-ulimits',
-            'ceph-coverage',
-            coverage_dir,
-            'ceph-authtool',
-            '--gen-key',
-            '--name=mon.',
-            keyring_path,
-            ],
-        )
-    ctx.cluster.only(firstmon).run(
-        args=[
-            'sudo',
-            'chmod',
-            '0644',
-            keyring_path,
-            ],
-        )
+    if not restoring:
+        log.info('Setting up %s...' % firstmon)
+        ctx.cluster.only(firstmon).run(
+            args=[
+                'sudo',
+                'adjust-ulimits',
+                'ceph-coverage',
+                coverage_dir,
+                'ceph-authtool',
+                '--create-keyring',
+                keyring_path,
+                ],
+            )
+        ctx.cluster.only(firstmon).run(
+            args=[
+                'sudo',
+                'adjust-ulimits',
+                'ceph-coverage',
+                coverage_dir,
+                'ceph-authtool',
+                '--gen-key',
+                '--name=mon.',
+                keyring_path,
+                ],
+            )
+        ctx.cluster.only(firstmon).run(
+            args=[
+                'sudo',
+                'chmod',
+                '0644',
+                keyring_path,
+                ],
+            )
     (mon0_remote,) = ctx.cluster.only(firstmon).remotes.keys()
-    fsid = teuthology.create_simple_monmap(
-        ctx,
-        remote=mon0_remote,
-        conf=conf,
-        )
+    if restoring:
+        fsid = snapshot_store.metadata(snapshot_id)['fsid']
+        snapshot.create_monmap(ctx, mon0_remote, conf, fsid)
+    else:
+        fsid = teuthology.create_simple_monmap(
+            ctx,
+            remote=mon0_remote,
+            conf=conf,
+            )
     if not 'global' in conf:
         conf['global'] = {}
     conf['global']['fsid'] = fsid
@@ -388,95 +772,102 @@ def cluster(ctx, config):
     conf_path = config.get('conf_path', DEFAULT_CONF_PATH)
     write_conf(ctx, conf_path)
 
-    log.info('Creating admin key on %s...' % firstmon)
-    ctx.cluster.only(firstmon).run(
-        args=[
-            'sudo',
-            'adjust-ulimits',
-            'ceph-coverage',
-            coverage_dir,
-            'ceph-authtool',
-            '--gen-key',
-            '--name=client.admin',
-            '--set-uid=0',
-            '--cap', 'mon', 'allow *',
-            '--cap', 'osd', 'allow *',
-            '--cap', 'mds', 'allow',
-            keyring_path,
-            ],
-        )
-
-    log.info('Copying monmap to all nodes...')
-    keyring = teuthology.get_file(
-        remote=mon0_remote,
-        path=keyring_path,
-        )
-    monmap = teuthology.get_file(
-        remote=mon0_remote,
-        path='{tdir}/monmap'.format(tdir=testdir),
-        )
-
-    for rem in ctx.cluster.remotes.iterkeys():
-        # copy mon key and initial monmap
-        log.info('Sending monmap to node {remote}'.format(remote=rem))
-        teuthology.sudo_write_file(
-            remote=rem,
-            path=keyring_path,
-            data=keyring,
-            perms='0644'
-            )
-        teuthology.write_file(
-            remote=rem,
-            path='{tdir}/monmap'.format(tdir=testdir),
-            data=monmap,
-            )
-
-    log.info('Setting up mon nodes...')
-    mons = ctx.cluster.only(teuthology.is_type('mon'))
-    run.wait(
-        mons.run(
+    if not restoring:
+        log.info('Creating admin key on %s...' % firstmon)
+        ctx.cluster.only(firstmon).run(
             args=[
+                'sudo',
                 'adjust-ulimits',
                 'ceph-coverage',
                 coverage_dir,
-                'osdmaptool',
-                '-c', conf_path,
-                '--clobber',
-                '--createsimple', '{num:d}'.format(
-                    num=teuthology.num_instances_of_type(ctx.cluster, 'osd'),
-                    ),
-                '{tdir}/osdmap'.format(tdir=testdir),
-                '--pg_bits', '2',
-                '--pgp_bits', '4',
+                'ceph-authtool',
+                '--gen-key',
+                '--name=client.admin',
+                '--set-uid=0',
+                '--cap', 'mon', 'allow *',
+                '--cap', 'osd', 'allow *',
+                '--cap', 'mds', 'allow',
+                keyring_path,
                 ],
-            wait=False,
-            ),
-        )
+            )
 
-    log.info('Setting up mds nodes...')
-    mdss = ctx.cluster.only(teuthology.is_type('mds'))
-    for remote, roles_for_host in mdss.remotes.iteritems():
-        for id_ in teuthology.roles_of_type(roles_for_host, 'mds'):
-            remote.run(
+    log.info('Copying monmap to all nodes...')
+    with timer.phase('monmap distribution'):
+        # a restored snapshot brings its own keyring
+        if not restoring:
+            keyring = teuthology.get_file(
+                remote=mon0_remote,
+                path=keyring_path,
+                )
+        monmap = teuthology.get_file(
+            remote=mon0_remote,
+            path='{tdir}/monmap'.format(tdir=testdir),
+            )
+
+        for rem in ctx.cluster.remotes.iterkeys():
+            # copy mon key and initial monmap
+            log.info('Sending monmap to node {remote}'.format(remote=rem))
+            if not restoring:
+                teuthology.sudo_write_file(
+                    remote=rem,
+                    path=keyring_path,
+                    data=keyring,
+                    perms='0644'
+                    )
+            teuthology.write_file(
+                remote=rem,
+                path='{tdir}/monmap'.format(tdir=testdir),
+                data=monmap,
+                )
+
+    mons = ctx.cluster.only(teuthology.is_type('mon'))
+    if not restoring:
+        log.info('Setting up mon nodes...')
+        run.wait(
+            mons.run(
                 args=[
-                    'sudo',
-                    'mkdir',
-                    '-p',
-                    '/var/lib/ceph/mds/ceph-{id}'.format(id=id_),
-                    run.Raw('&&'),
-                    'sudo',
                     'adjust-ulimits',
                     'ceph-coverage',
                     coverage_dir,
-                    'ceph-authtool',
-                    '--create-keyring',
-                    '--gen-key',
-                    '--name=mds.{id}'.format(id=id_),
-                    '/var/lib/ceph/mds/ceph-{id}/keyring'.format(id=id_),
+                    'osdmaptool',
+                    '-c', conf_path,
+                    '--clobber',
+                    '--createsimple', '{num:d}'.format(
+                        num=teuthology.num_instances_of_type(ctx.cluster, 'osd'),
+                        ),
+                    '{tdir}/osdmap'.format(tdir=testdir),
+                    '--pg_bits', '2',
+                    '--pgp_bits', '4',
                     ],
-                )
+                wait=False,
+                ),
+            )
+
+        log.info('Setting up mds nodes...')
+        mdss = ctx.cluster.only(teuthology.is_type('mds'))
+        for remote, roles_for_host in mdss.remotes.iteritems():
+            for id_ in teuthology.roles_of_type(roles_for_host, 'mds'):
+                remote.run(
+                    args=[
+                        'sudo',
+                        'mkdir',
+                        '-p',
+                        '/var/lib/ceph/mds/ceph-{id}'.format(id=id_),
+                        run.Raw('&&'),
+                        'sudo',
+                        'adjust-ulimits',
+                        'ceph-coverage',
+                        coverage_dir,
+                        'ceph-authtool',
+                        '--create-keyring',
+                        '--gen-key',
+                        '--name=mds.{id}'.format(id=id_),
+                        '/var/lib/ceph/mds/ceph-{id}/keyring'.format(id=id_),
+                        ],
+                    )
+
+        cclient.create_keyring(ctx)
 
-    cclient.create_keyring(ctx)
     log.info('Running mkfs on osd nodes...')
 
     ctx.disk_config = argparse.Namespace()
@@ -486,207 +877,106 @@ def cluster(ctx, config):
     ctx.disk_config.remote_to_roles_to_dev_fstype = {}
 
     log.info("ctx.disk_config.remote_to_roles_to_dev: {r}".format(r=str(ctx.disk_config.remote_to_roles_to_dev)))
-    for remote, roles_for_host in osds.remotes.iteritems():
-        roles_to_devs = remote_to_roles_to_devs[remote]
-        roles_to_journals = remote_to_roles_to_journals[remote]
-
-
-        for id_ in teuthology.roles_of_type(roles_for_host, 'osd'):
-            remote.run(
+    with timer.phase('osd mkfs'):
+        mkfs_failures = []
+        with parallel() as p:
+            for remote, roles_for_host in osds.remotes.iteritems():
+                p.spawn(mkfs_osds_on_host, ctx, config, remote,
+                        list(teuthology.roles_of_type(roles_for_host, 'osd')),
+                        remote_to_roles_to_devs[remote], devs_to_clean,
+                        not restoring)
+            for failures in p:
+                mkfs_failures.extend(failures)
+        if mkfs_failures:
+            raise RuntimeError('OSD mkfs failed for {osds}'.format(
+                osds=', '.join('osd.{id} on {remote}'.format(id=id_, remote=remote.shortname)
+                               for (remote, id_, _) in mkfs_failures)))
+
+    if restoring:
+        with timer.phase('snapshot restore'):
+            snapshot.restore(ctx, snapshot_store, snapshot_id)
+    else:
+        log.info('Reading keys from all nodes...')
+        with timer.phase('key import'):
+            keyring_paths = {}
+            for remote, roles_for_host in ctx.cluster.remotes.iteritems():
+                paths = []
+                for type_ in ['mds','osd']:
+                    for id_ in teuthology.roles_of_type(roles_for_host, type_):
+                        paths.append((type_, id_, '/var/lib/ceph/{type}/ceph-{id}/keyring'.format(
+                            type=type_,
+                            id=id_,
+                            )))
+                for id_ in teuthology.roles_of_type(roles_for_host, 'client'):
+                    paths.append(('client', id_, '/etc/ceph/ceph.client.{id}.keyring'.format(id=id_)))
+                if paths:
+                    keyring_paths[remote] = paths
+
+            keys = []
+            with parallel() as p:
+                for remote, paths in keyring_paths.iteritems():
+                    p.spawn(get_files_tarball, remote, [path for (_, _, path) in paths])
+                files_by_remote = dict(p)
+            for remote, paths in keyring_paths.iteritems():
+                for type_, id_, path in paths:
+                    keys.append((type_, id_, files_by_remote[remote][path]))
+
+            log.info('Adding keys to all mons...')
+            script = authtool_import_script(keyring_path, coverage_dir, keys)
+            writes = mons.run(
                 args=[
-                    'sudo',
-                    'mkdir',
-                    '-p',
-                    '/var/lib/ceph/osd/ceph-{id}'.format(id=id_),
-                    ])
-            log.info(str(roles_to_journals))
-            log.info(id_)
-            if roles_to_devs.get(id_):
-                dev = roles_to_devs[id_]
-                fs = config.get('fs')
-                package = None
-                mkfs_options = config.get('mkfs_options')
-                mount_options = config.get('mount_options')
-                if fs == 'btrfs':
-                    #package = 'btrfs-tools'
-                    if mount_options is None:
-                        mount_options = ['noatime','user_subvol_rm_allowed']
-                    if mkfs_options is None:
-                        mkfs_options = ['-m', 'single',
-                                        '-l', '32768',
-                                        '-n', '32768']
-                if fs == 'xfs':
-                    #package = 'xfsprogs'
-                    if mount_options is None:
-                        mount_options = ['noatime']
-                    if mkfs_options is None:
-                        mkfs_options = ['-f', '-i', 'size=2048']
-                if fs == 'ext4' or fs == 'ext3':
-                    if mount_options is None:
-                        mount_options = ['noatime','user_xattr']
-
-                if mount_options is None:
-                    mount_options = []
-                if mkfs_options is None:
-                    mkfs_options = []
-                mkfs = ['mkfs.%s' % fs] + mkfs_options
-                log.info('%s on %s on %s' % (mkfs, dev, remote))
-                if package is not None:
+                    'sudo', 'sh', '-e', '-s',
+                    ],
+                stdin=run.PIPE,
+                wait=False,
+                stdout=StringIO(),
+                )
+            teuthology.feed_many_stdins_and_close(StringIO(script), writes)
+            run.wait(writes)
+
+    if restoring:
+        log.info('Injecting monmap into restored mon stores...')
+        snapshot.inject_monmap(ctx, mons)
+    else:
+        log.info('Running mkfs on mon nodes...')
+        with timer.phase('mon mkfs'):
+            for remote, roles_for_host in mons.remotes.iteritems():
+                for id_ in teuthology.roles_of_type(roles_for_host, 'mon'):
+                    remote.run(
+                        args=[
+                          'sudo',
+                          'mkdir',
+                          '-p',
+                          '/var/lib/ceph/mon/ceph-{id}'.format(id=id_),
+                          ],
+                        )
                     remote.run(
                         args=[
                             'sudo',
-                            'apt-get', 'install', '-y', package
+                            'adjust-ulimits',
+                            'ceph-coverage',
+                            coverage_dir,
+                            'ceph-mon',
+                            '--mkfs',
+                            '-i', id_,
+                            '--monmap={tdir}/monmap'.format(tdir=testdir),
+                            '--osdmap={tdir}/osdmap'.format(tdir=testdir),
+                            '--keyring={kpath}'.format(kpath=keyring_path),
                             ],
-                        stdout=StringIO(),
-                        )
-
-                try:
-                    remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
-                except run.CommandFailedError:
-                    # Newer btfs-tools doesn't prompt for overwrite, use -f
-                    if '-f' not in mount_options:
-                        mkfs_options.append('-f')
-                        mkfs = ['mkfs.%s' % fs] + mkfs_options
-                        log.info('%s on %s on %s' % (mkfs, dev, remote))
-                    remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
-
-                log.info('mount %s on %s -o %s' % (dev, remote,
-                                                   ','.join(mount_options)))
-                remote.run(
-                    args=[
-                        'sudo',
-                        'mount',
-                        '-t', fs,
-                        '-o', ','.join(mount_options),
-                        dev,
-                        os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_)),
-                        ]
-                    )
-                if not remote in ctx.disk_config.remote_to_roles_to_dev_mount_options:
-                    ctx.disk_config.remote_to_roles_to_dev_mount_options[remote] = {}
-                ctx.disk_config.remote_to_roles_to_dev_mount_options[remote][id_] = mount_options
-                if not remote in ctx.disk_config.remote_to_roles_to_dev_fstype:
-                    ctx.disk_config.remote_to_roles_to_dev_fstype[remote] = {}
-                ctx.disk_config.remote_to_roles_to_dev_fstype[remote][id_] = fs
-                devs_to_clean[remote].append(
-                    os.path.join(
-                        os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_)),
                         )
-                    )
-
-        for id_ in teuthology.roles_of_type(roles_for_host, 'osd'):
-            remote.run(
-                args=[
-                    'sudo',
-                    'MALLOC_CHECK_=3',
-                    'adjust-ulimits',
-                    'ceph-coverage',
-                    coverage_dir,
-                    'ceph-osd',
-                    '--mkfs',
-                    '--mkkey',
-                    '-i', id_,
-                    '--monmap', '{tdir}/monmap'.format(tdir=testdir),
-                    ],
-                )
-
 
-    log.info('Reading keys from all nodes...')
-    keys_fp = StringIO()
-    keys = []
-    for remote, roles_for_host in ctx.cluster.remotes.iteritems():
-        for type_ in ['mds','osd']:
-            for id_ in teuthology.roles_of_type(roles_for_host, type_):
-                data = teuthology.get_file(
-                    remote=remote,
-                    path='/var/lib/ceph/{type}/ceph-{id}/keyring'.format(
-                        type=type_,
-                        id=id_,
-                        ),
-                    sudo=True,
-                    )
-                keys.append((type_, id_, data))
-                keys_fp.write(data)
-    for remote, roles_for_host in ctx.cluster.remotes.iteritems():
-        for type_ in ['client']:
-            for id_ in teuthology.roles_of_type(roles_for_host, type_):
-                data = teuthology.get_file(
-                    remote=remote,
-                    path='/etc/ceph/ceph.client.{id}.keyring'.format(id=id_)
-                    )
-                keys.append((type_, id_, data))
-                keys_fp.write(data)
+    snapshot.remove_maps(ctx, mons, restoring)
 
-    log.info('Adding keys to all mons...')
-    writes = mons.run(
-        args=[
-            'sudo', 'tee', '-a',
-            keyring_path,
-            ],
-        stdin=run.PIPE,
-        wait=False,
-        stdout=StringIO(),
-        )
-    keys_fp.seek(0)
-    teuthology.feed_many_stdins_and_close(keys_fp, writes)
-    run.wait(writes)
-    for type_, id_, data in keys:
-        run.wait(
-            mons.run(
-                args=[
-                    'sudo',
-                    'adjust-ulimits',
-                    'ceph-coverage',
-                    coverage_dir,
-                    'ceph-authtool',
-                    keyring_path,
-                    '--name={type}.{id}'.format(
-                        type=type_,
-                        id=id_,
-                        ),
-                    ] + list(teuthology.generate_caps(type_)),
-                wait=False,
-                ),
-            )
+    if snapshot_store is not None and not restoring and \
+            snapshot_config.get('save', True):
+        with timer.phase('snapshot save'):
+            snapshot.save(ctx, snapshot_store, snapshot_id, fsid, keyring_path)
 
-    log.info('Running mkfs on mon nodes...')
-    for remote, roles_for_host in mons.remotes.iteritems():
-        for id_ in teuthology.roles_of_type(roles_for_host, 'mon'):
-            remote.run(
-                args=[
-                  'sudo',
-                  'mkdir',
-                  '-p',
-                  '/var/lib/ceph/mon/ceph-{id}'.format(id=id_),
-                  ],
-                )
-            remote.run(
-                args=[
-                    'sudo',
-                    'adjust-ulimits',
-                    'ceph-coverage',
-                    coverage_dir,
-                    'ceph-mon',
-                    '--mkfs',
-                    '-i', id_,
-                    '--monmap={tdir}/monmap'.format(tdir=testdir),
-                    '--osdmap={tdir}/osdmap'.format(tdir=testdir),
-                    '--keyring={kpath}'.format(kpath=keyring_path),
-                    ],
-                )
-
-
-    run.wait(
-        mons.run(
-            args=[
-                'rm',
-                '--',
-                '{tdir}/monmap'.format(tdir=testdir),
-                '{tdir}/osdmap'.format(tdir=testdir),
-                ],
-            wait=False,
-            ),
-        )
+    # scan the cluster log as it grows, so that only the tail is left to
+    # read at teardown; other tasks may call ctx.cluster_log.scan() too
+    ctx.cluster_log = ClusterLogScanner(mon0_remote, config['log_whitelist'])
+    if config.get('log_scan_interval'):
+        ctx.cluster_log.start(config['log_scan_interval'])
 
     try:
         yield
@@ -695,51 +985,26 @@ def cluster(ctx, config):
         ctx.summary['success'] = False
         raise
     finally:
-        (mon0_remote,) = ctx.cluster.only(firstmon).remotes.keys()
-
         log.info('Checking cluster log for badness...')
-        def first_in_ceph_log(pattern, excludes):
-            """
-            Find the first occurence of the pattern specified in the Ceph log,
-            Returns None if none found.
-
-            :param pattern: Pattern scanned for.
-            :param excludes: Patterns to ignore.
-            :return: First line of text (or None if not found)
-            """
-            args = [
-                'sudo',
-                'egrep', pattern,
-                '/var/log/ceph/ceph.log',
-                ]
-            for exclude in excludes:
-                args.extend([run.Raw('|'), 'egrep', '-v', exclude])
-            args.extend([
-                    run.Raw('|'), 'head', '-n', '1',
-                    ])
-            r = mon0_remote.run(
-                stdout=StringIO(),
-                args=args,
-                )
-            stdout = r.stdout.getvalue()
-            if stdout != '':
-                return stdout
-            return None
-
-        if first_in_ceph_log('\[ERR\]|\[WRN\]|\[SEC\]',
-                             config['log_whitelist']) is not None:
-            log.warning('Found errors (ERR|WRN|SEC) in cluster log')
-            ctx.summary['success'] = False
-            # use the most severe problem as the failure reason
-            if 'failure_reason' not in ctx.summary:
-                for pattern in ['\[SEC\]', '\[ERR\]', '\[WRN\]']:
-                    match = first_in_ceph_log(pattern, config['log_whitelist'])
-                    if match is not None:
-                        ctx.summary['failure_reason'] = \
-                            '"{match}" in cluster log'.format(
-                            match=match.rstrip('\n'),
-                            )
-                        break
+        with timer.phase('cluster log scan'):
+            ctx.cluster_log.stop()
+            ctx.cluster_log.scan()
+            counts = ctx.cluster_log.counts
+            ctx.summary['cluster_log'] = dict(counts)
+            if any(counts.values()):
+                log.warning('Found errors (ERR|WRN|SEC) in cluster log: %s',
+                            ', '.join('%d %s' % (counts[sev], sev)
+                                      for sev in ['SEC', 'ERR', 'WRN']))
+                for sev, lines in ctx.cluster_log.matches.iteritems():
+                    for line in lines:
+                        log.warning('cluster log %s: %s', sev, line)
+                ctx.summary['success'] = False
+                # use the most severe problem as the failure reason
+                if 'failure_reason' not in ctx.summary:
+                    ctx.summary['failure_reason'] = \
+                        '"{match}" in cluster log'.format(
+                        match=ctx.cluster_log.first(),
+                        )
 
         for remote, dirs in devs_to_clean.iteritems():
             for dir_ in dirs:
@@ -763,53 +1028,19 @@ def cluster(ctx, config):
                     check_status=False,
                 )
 
-        if ctx.archive is not None and \
-                not (ctx.config.get('archive-on-error') and ctx.summary['success']):
-            # archive mon data, too
-            log.info('Archiving mon data...')
-            path = os.path.join(ctx.archive, 'data')
-            os.makedirs(path)
-            for remote, roles in mons.remotes.iteritems():
-                for role in roles:
-                    if role.startswith('mon.'):
-                        teuthology.pull_directory_tarball(
-                            remote,
-                            '/var/lib/ceph/mon',
-                            path + '/' + role + '.tgz')
-
-            # and logs
-            log.info('Compressing logs...')
-            run.wait(
-                ctx.cluster.run(
-                    args=[
-                        'sudo',
-                        'find',
-                        '/var/log/ceph',
-                        '-name',
-                        '*.log',
-                        '-print0',
-                        run.Raw('|'),
-                        'sudo',
-                        'xargs',
-                        '-0',
-                        '--no-run-if-empty',
-                        '--',
-                        'gzip',
-                        '--',
-                        ],
-                    wait=False,
-                    ),
-                )
-
-            log.info('Archiving logs...')
-            path = os.path.join(ctx.archive, 'remote')
-            os.makedirs(path)
-            for remote in ctx.cluster.remotes.iterkeys():
-                sub = os.path.join(path, remote.shortname)
-                os.makedirs(sub)
-                teuthology.pull_directory(remote, '/var/log/ceph',
-                                          os.path.join(sub, 'log'))
-
+        with timer.phase('archive'):
+            if ctx.archive is not None and \
+                    not (ctx.config.get('archive-on-error') and ctx.summary['success']):
+                compression = config.get('archive_compression', 'gzip')
+                assert compression in ARCHIVE_COMPRESSION, \
+                    'unknown archive_compression %s' % compression
+                os.makedirs(os.path.join(ctx.archive, 'data'))
+                os.makedirs(os.path.join(ctx.archive, 'remote'))
+                log.info('Archiving mon data and logs...')
+                with parallel() as p:
+                    for remote, roles in ctx.cluster.remotes.iteritems():
+                        p.spawn(archive_host, ctx, remote, roles, compression,
+                                config.get('archive_changed_only', False))
 
         log.info('Cleaning ceph cluster...')
         run.wait(
@@ -929,6 +1160,9 @@ def run_daemon(ctx, config, type_):
     daemon_signal = 'kill'
     if config.get('coverage') or config.get('valgrind') is not None:
         daemon_signal = 'term'
+    # gperftools only writes CPUPROFILE when the daemon exits cleanly
+    if type_ in config.get('cpu_profile', []):
+        daemon_signal = 'term'
 
     for remote, roles_for_host in daemons.remotes.iteritems():
         for id_ in teuthology.roles_of_type(roles_for_host, type_):
@@ -1176,6 +1410,27 @@ def task(ctx, config):
     Note, this will cause the task to check the /scratch_devs file on each node
     for available devices.  If no such file is found, /dev/sdb will be used.
 
+    To save the state of a freshly created cluster, and to restore it
+    instead of creating the cluster from scratch when a later job has the
+    same roles, ceph version and (non-debug) configuration, use::
+
+        tasks:
+        - ceph:
+            snapshot:
+              path: /path/to/snapshots  # on this machine, defaults to
+                                        # ~/.cache/ceph-qa-snapshots
+              save: true                # default true
+              restore: true             # default true
+
+    Snapshots are not used with block_journal or tmpfs_journal.
+
+    OSDs are created on all hosts at once.  To limit how many OSDs on each
+    host run mkfs at the same time (default 4), use::
+
+        tasks:
+        - ceph:
+            mkfs_concurrency: 2
+
     To run some daemons under valgrind, include their names
     and the tool/args to use in a valgrind section::
 
@@ -1188,6 +1443,15 @@ def task(ctx, config):
     Those nodes which are using memcheck or valgrind will get
     checked for bad results.
 
+    To profile daemons with gperftools, list their types. Profiles are
+    symbolized on each host and merged per type at teardown (see
+    cpu_profile_post); cpu_profile_top sets how many of the hottest
+    functions go in the summary (default 10)::
+
+        tasks:
+        - ceph:
+            cpu_profile: [osd, mds]
+
     To adjust or modify config options, use::
 
         tasks:
@@ -1208,6 +1472,10 @@ def task(ctx, config):
                 debug client: 10
                 debug ms: 1
 
+    The time taken by each stage of bringing up and tearing down the
+    cluster is written to ``ceph_phases.yaml`` in the archive and to
+    ``ctx.summary['ceph_phases']``.
+
     By default, the cluster log is checked for errors and warnings,
     and the run marked failed if any appear. You can ignore log
     entries by giving a list of egrep compatible regexes, i.e.:
@@ -1216,6 +1484,22 @@ def task(ctx, config):
         - ceph:
             log-whitelist: ['foo.*bar', 'bad message']
 
+    The log is read once, incrementally: every ``log-scan-interval``
+    seconds (default 300, 0 to only scan at the end) whatever was
+    appended since the last scan is checked. Counts of offending
+    entries by severity are left in ``ctx.summary['cluster_log']``.
+
+    At teardown, mon data and logs are archived from all hosts at once.
+    Logs are compressed in place on each host (``archive_compression``
+    is ``gzip``, the default, using pigz when installed, or ``zstd``),
+    and the mon data tarballs are compressed as they are streamed into
+    the archive. To skip log files not written during the job, use::
+
+        tasks:
+        - ceph:
+            archive_changed_only: true
+            archive_compression: zstd
+
     :param ctx: Context
     :param config: Configuration
     """
@@ -1243,35 +1527,48 @@ def task(ctx, config):
                 )
             )
 
-    with contextutil.nested(
-        lambda: ceph_log(ctx=ctx, config=None),
-        lambda: valgrind_post(ctx=ctx, config=config),
-        lambda: cluster(ctx=ctx, config=dict(
-                conf=config.get('conf', {}),
-                fs=config.get('fs', None),
-                mkfs_options=config.get('mkfs_options', None),
-                mount_options=config.get('mount_options',None),
-                block_journal=config.get('block_journal', None),
-                tmpfs_journal=config.get('tmpfs_journal', None),
-                log_whitelist=config.get('log-whitelist', []),
-                cpu_profile=set(config.get('cpu_profile', [])),
-                )),
-        lambda: run_daemon(ctx=ctx, config=config, type_='mon'),
-        lambda: run_daemon(ctx=ctx, config=config, type_='osd'),
-        lambda: cephfs_setup(ctx=ctx, config=config),
-        lambda: run_daemon(ctx=ctx, config=config, type_='mds'),
-        ):
-        try:
-            if config.get('wait-for-healthy', True):
-                healthy(ctx=ctx, config=None)
-            first_mon = teuthology.get_first_mon(ctx, config)
-            (mon,) = ctx.cluster.only(first_mon).remotes.iterkeys()
-            ctx.manager = CephManager(
-                mon,
-                ctx=ctx,
-                logger=log.getChild('ceph_manager'),
-            )
-            yield
-        finally:
-            if config.get('wait-for-scrub', True):
-                osd_scrub_pgs(ctx, config)
+    timer = get_phase_timer(ctx)
+    try:
+        with contextutil.nested(
+            lambda: timer.stage('ceph_log', ceph_log(ctx=ctx, config=None)),
+            lambda: timer.stage('valgrind_post', valgrind_post(ctx=ctx, config=config)),
+            lambda: timer.stage('cluster', cluster(ctx=ctx, config=dict(
+                    conf=config.get('conf', {}),
+                    fs=config.get('fs', None),
+                    mkfs_options=config.get('mkfs_options', None),
+                    mount_options=config.get('mount_options',None),
+                    block_journal=config.get('block_journal', None),
+                    tmpfs_journal=config.get('tmpfs_journal', None),
+                    mkfs_concurrency=config.get('mkfs_concurrency', 4),
+                    snapshot=config.get('snapshot', None),
+                    log_whitelist=config.get('log-whitelist', []),
+                    log_scan_interval=config.get('log-scan-interval', 300),
+                    archive_compression=config.get('archive_compression', 'gzip'),
+                    archive_changed_only=config.get('archive_changed_only', False),
+                    cpu_profile=set(config.get('cpu_profile', [])),
+                    ))),
+            lambda: timer.stage('cpu_profile_post', cpu_profile_post(ctx=ctx, config=config)),
+            lambda: timer.stage('mon daemons', run_daemon(ctx=ctx, config=config, type_='mon')),
+            lambda: timer.stage('osd daemons', run_daemon(ctx=ctx, config=config, type_='osd')),
+            lambda: timer.stage('cephfs_setup', cephfs_setup(ctx=ctx, config=config)),
+            lambda: timer.stage('mds daemons', run_daemon(ctx=ctx, config=config, type_='mds')),
+            ):
+            try:
+                if config.get('wait-for-healthy', True):
+                    with timer.phase('healthy'):
+                        healthy(ctx=ctx, config=None)
+                    timer.mark('HEALTH_OK')
+                first_mon = teuthology.get_first_mon(ctx, config)
+                (mon,) = ctx.cluster.only(first_mon).remotes.iterkeys()
+                ctx.manager = CephManager(
+                    mon,
+                    ctx=ctx,
+                    logger=log.getChild('ceph_manager'),
+                )
+                yield
+            finally:
+                if config.get('wait-for-scrub', True):
+                    with timer.phase('osd_scrub_pgs'):
+                        osd_scrub_pgs(ctx, config)
+    finally:
+        timer.write_report(ctx, 'ceph_phases')
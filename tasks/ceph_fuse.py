@@ -7,7 +7,8 @@ import logging
 
 from teuthology import misc as teuthology
 from teuthology.orchestra import run
-from cephfs.fuse_mount import FuseMount
+from teuthology.parallel import parallel
+from cephfs.fuse_mount import FuseMount, wait_until_mounted_all
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +34,14 @@ def get_client_configs(ctx, config):
     return config
 
 
+def _umount_if_mounted(mount):
+    """
+    Unmount and wait for a FuseMount, if it is currently mounted.
+    """
+    if mount.is_mounted():
+        mount.umount_wait()
+
+
 @contextlib.contextmanager
 def task(ctx, config):
     """
@@ -43,6 +52,8 @@ def task(ctx, config):
     this operation on. This lets you e.g. set up one client with
     ``ceph-fuse`` and another with ``kclient``.
 
+    Clients are mounted and unmounted concurrently.
+
     Example that mounts all clients::
 
         tasks:
@@ -111,17 +122,22 @@ def task(ctx, config):
             mounted_by_me[id_] = all_mounts[id_]
 
     # Mount any clients we have been asked to (default to mount all)
-    for mount in mounted_by_me.values():
-        mount.mount()
+    with parallel() as p:
+        for mount in mounted_by_me.values():
+            p.spawn(mount.mount)
 
+    # Wait for the mounts with one remote wait loop per host
+    mounts_by_remote = {}
     for mount in mounted_by_me.values():
-        mount.wait_until_mounted()
+        mounts_by_remote.setdefault(mount.client_remote, []).append(mount)
+    with parallel() as p:
+        for remote, mounts in mounts_by_remote.iteritems():
+            p.spawn(wait_until_mounted_all, remote, mounts)
 
     # Umount any pre-existing clients that we have not been asked to mount
-    for client_id in set(all_mounts.keys()) - set(mounted_by_me.keys()):
-        mount = all_mounts[client_id]
-        if mount.is_mounted():
-            mount.umount_wait()
+    with parallel() as p:
+        for client_id in set(all_mounts.keys()) - set(mounted_by_me.keys()):
+            p.spawn(_umount_if_mounted, all_mounts[client_id])
 
     ctx.mounts = all_mounts
     try:
@@ -129,7 +145,7 @@ def task(ctx, config):
     finally:
         log.info('Unmounting ceph-fuse clients...')
 
-        for mount in mounted_by_me.values():
-            # Conditional because an inner context might have umounted it
-            if mount.is_mounted():
-                mount.umount_wait()
+        # Conditional because an inner context might have umounted it
+        with parallel() as p:
+            for mount in mounted_by_me.values():
+                p.spawn(_umount_if_mounted, mount)
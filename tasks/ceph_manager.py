@@ -61,7 +61,7 @@ class Thrasher:
     """
     Object used to thrash Ceph
     """
-    def __init__(self, manager, config, logger=None):
+    def __init__(self, manager, config, logger=None, journal=None):
         self.ceph_manager = manager
         self.ceph_manager.wait_for_clean()
         osd_status = self.ceph_manager.get_osd_status()
@@ -72,6 +72,8 @@ class Thrasher:
         self.stopping = False
         self.logger = logger
         self.config = config
+        # the actions taken, for tasks that want to know what happened when
+        self.journal = journal if journal is not None else []
         self.revive_timeout = self.config.get("revive_timeout", 150)
         if self.config.get('powercycle'):
             self.revive_timeout += 120
@@ -420,6 +422,8 @@ class Thrasher:
     def choose_action(self):
         """
         Random action selector.
+
+        :returns: (name, action), the name being what the journal records
         """
         chance_down = self.config.get('chance_down', 0.4)
         chance_test_min_size = self.config.get('chance_test_min_size', 0)
@@ -449,25 +453,28 @@ class Thrasher:
         actions.append((self.fix_pgp_num, self.config.get('chance_pgpnum_fix', 0),))
         actions.append((self.test_pool_min_size, chance_test_min_size,))
         actions.append((self.test_backfill_full, chance_test_backfill_full,))
+        actions = [(action.__name__, action, prob) for (action, prob) in actions]
         for key in ['heartbeat_inject_failure', 'filestore_inject_stall']:
             for scenario in [
-                (lambda: self.inject_pause(key,
-                                           self.config.get('pause_short', 3),
-                                           0,
-                                           False),
+                ('inject_pause(%s,short)' % key,
+                 lambda key=key: self.inject_pause(key,
+                                                   self.config.get('pause_short', 3),
+                                                   0,
+                                                   False),
                  self.config.get('chance_inject_pause_short', 1),),
-                (lambda: self.inject_pause(key,
-                                           self.config.get('pause_long', 80),
-                                           self.config.get('pause_check_after', 70),
-                                           True),
+                ('inject_pause(%s,long)' % key,
+                 lambda key=key: self.inject_pause(key,
+                                                   self.config.get('pause_long', 80),
+                                                   self.config.get('pause_check_after', 70),
+                                                   True),
                  self.config.get('chance_inject_pause_long', 0),)]:
                 actions.append(scenario)
 
-        total = sum([y for (x, y) in actions])
+        total = sum([prob for (name, action, prob) in actions])
         val = random.uniform(0, total)
-        for (action, prob) in actions:
+        for (name, action, prob) in actions:
             if val < prob:
-                return action
+                return name, action
             val -= prob
         return None
 
@@ -502,7 +509,14 @@ class Thrasher:
                     if random.uniform(0, 1) < (float(delay) / scrubint):
                         self.log('Scrubbing while thrashing being performed')
                         Scrubber(self.ceph_manager, self.config)
-            self.choose_action()()
+            name, action = self.choose_action()
+            start = time.time()
+            action()
+            self.journal.append({
+                'action': name,
+                'start': start,
+                'end': time.time(),
+                })
             time.sleep(delay)
         self.all_up()
 
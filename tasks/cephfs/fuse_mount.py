@@ -13,6 +13,54 @@ from .mount import CephFSMount
 log = logging.getLogger(__name__)
 
 
+# How long to wait for ceph-fuse to appear on its mountpoint
+MOUNT_TIMEOUT = 300
+
+
+def wait_until_mounted_all(remote, mounts, timeout=MOUNT_TIMEOUT):
+    """
+    Wait until all of the given FuseMounts, which must all be on ``remote``,
+    are mounted.  A single shell loop on the remote host checks the
+    filesystem type of each mountpoint; meanwhile we only watch the local
+    process handles, so that a ceph-fuse that terminates is noticed
+    without waiting for the timeout.
+
+    :param remote: Remote on which all the mounts live
+    :param mounts: list of FuseMount instances
+    :param timeout: seconds to wait before giving up
+    """
+    mountpoints = [m.mountpoint for m in mounts]
+    script = (
+        'for m in "$@"; do '
+        'while [ "$(stat --file-system --printf=%T -- "$m" 2>/dev/null)" != fuseblk ]; '
+        'do sleep 0.5; done; '
+        'done'
+    )
+    proc = remote.run(
+        args=['timeout', str(timeout), 'sh', '-c', script, 'sh'] + mountpoints,
+        wait=False,
+    )
+    while not proc.finished:
+        # Even if it's not mounted, it should at least
+        # be running: catch simple failures where it has terminated.
+        for mount in mounts:
+            if mount.fuse_daemon.finished:
+                raise RuntimeError("ceph-fuse for client.{id} exited before mounting {mnt}".format(
+                    id=mount.client_id, mnt=mount.mountpoint))
+        time.sleep(1)
+    try:
+        proc.wait()
+    except CommandFailedError:
+        raise RuntimeError("Timed out after {t}s waiting for ceph-fuse mounts {mnts} on {remote}".format(
+            t=timeout, mnts=mountpoints, remote=remote.name))
+
+    log.info('ceph-fuse is mounted on %s', ', '.join(mountpoints))
+
+    # Now that we're mounted, set permissions so that the rest of the test will have
+    # unrestricted access to the filesystem mount.
+    remote.run(args=['sudo', 'chmod', '1777'] + mountpoints)
+
+
 class FuseMount(CephFSMount):
     def __init__(self, client_config, test_dir, client_id, client_remote):
         super(FuseMount, self).__init__(test_dir, client_id, client_remote)
@@ -97,23 +145,12 @@ class FuseMount(CephFSMount):
             log.debug('ceph-fuse not mounted, got fs type {fstype!r}'.format(
                 fstype=fstype))
 
-    def wait_until_mounted(self):
+    def wait_until_mounted(self, timeout=MOUNT_TIMEOUT):
         """
-        Check to make sure that fuse is mounted on mountpoint.  If not,
-        sleep for 5 seconds and check again.
+        Wait for fuse to be mounted on mountpoint, using a loop on the
+        client host rather than polling it from here.
         """
-
-        while not self.is_mounted():
-            # Even if it's not mounted, it should at least
-            # be running: catch simple failures where it has terminated.
-            assert not self.fuse_daemon.poll()
-
-            time.sleep(5)
-
-        # Now that we're mounted, set permissions so that the rest of the test will have
-        # unrestricted access to the filesystem mount.
-        self.client_remote.run(
-            args=['sudo', 'chmod', '1777', '{tdir}/mnt.{id}'.format(tdir=self.test_dir, id=self.client_id)], )
+        wait_until_mounted_all(self.client_remote, [self], timeout=timeout)
 
     def _mountpoint_exists(self):
         return self.client_remote.run(args=["ls", "-d", self.mountpoint], check_status=False).exitstatus == 0
@@ -0,0 +1,197 @@
+"""
+A persistent I/O generator process on a CephFS client, driven over stdin
+"""
+import itertools
+import json
+import logging
+from textwrap import dedent
+
+import gevent
+from gevent.event import AsyncResult
+from teuthology.orchestra import run
+from teuthology.orchestra.run import CommandFailedError
+
+from tasks.util.stats import summarize
+
+log = logging.getLogger(__name__)
+
+
+# Runs on the client.  Each line on stdin is a JSON command; commands for
+# the same path are executed in order by a thread dedicated to that path,
+# so a blocked file does not hold up the others.  Each command gets a JSON
+# reply line on stdout carrying its id, outcome and latency.  EOF on stdin
+# ends the process, closing all files.
+WORKER_SCRIPT = dedent("""
+    import json
+    import os
+    import sys
+    import threading
+    import time
+    try:
+        import Queue as queue
+    except ImportError:
+        import queue
+
+    root = sys.argv[1]
+    out_lock = threading.Lock()
+    fds = {}
+    queues = {}
+
+    def reply(msg):
+        out_lock.acquire()
+        try:
+            sys.stdout.write(json.dumps(msg) + "\\n")
+            sys.stdout.flush()
+        finally:
+            out_lock.release()
+
+    def execute(cmd):
+        op = cmd['op']
+        path = os.path.join(root, cmd['path'])
+        if op in ('open', 'hold'):
+            fds[path] = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
+            if op == 'hold':
+                os.write(fds[path], b'content')
+        elif op == 'write':
+            os.write(fds[path], cmd['data'].encode())
+        elif op == 'fsync':
+            os.fsync(fds[path])
+        elif op == 'close':
+            os.close(fds.pop(path))
+        else:
+            raise ValueError("unknown op %s" % op)
+
+    def file_worker(q):
+        while True:
+            cmd = q.get()
+            start = time.time()
+            try:
+                execute(cmd)
+                reply({'id': cmd['id'], 'ok': True, 'latency': time.time() - start})
+            except Exception as e:
+                reply({'id': cmd['id'], 'ok': False, 'error': str(e), 'latency': time.time() - start})
+
+    for line in iter(sys.stdin.readline, ''):
+        cmd = json.loads(line)
+        q = queues.get(cmd['path'])
+        if q is None:
+            q = queues[cmd['path']] = queue.Queue()
+            t = threading.Thread(target=file_worker, args=(q,))
+            t.daemon = True
+            t.start()
+        q.put(cmd)
+    """)
+
+
+class IORequest(object):
+    """
+    Handle on a single operation submitted to an IOWorker
+    """
+    def __init__(self, op, path):
+        self.op = op
+        self.path = path
+        self.latency = None
+        self._result = AsyncResult()
+
+    @property
+    def finished(self):
+        return self._result.ready()
+
+    def wait(self, timeout=None):
+        """
+        Block until the operation has completed on the client.
+
+        :return: the operation's latency in seconds, as measured on the client
+        """
+        reply = self._result.get(timeout=timeout)
+        if not reply['ok']:
+            raise RuntimeError("{op} on {path} failed: {err}".format(
+                op=self.op, path=self.path, err=reply['error']))
+        return self.latency
+
+
+class IOWorker(object):
+    """
+    A single long-lived python process on a client that multiplexes I/O on
+    many files, so that tests needing many concurrent writers do not pay
+    for one process per file.
+
+    Paths are relative to the mountpoint.  Operations return an IORequest
+    immediately; call its wait() to block on completion.
+    """
+    def __init__(self, mount):
+        self.mount = mount
+        self.latencies = {}
+        self._ids = itertools.count()
+        self._pending = {}
+
+        self.proc = mount.client_remote.run(
+            args=['sudo', 'python', '-c', WORKER_SCRIPT, mount.mountpoint],
+            logger=log.getChild('io_worker.{id}'.format(id=mount.client_id)),
+            stdin=run.PIPE,
+            stdout=run.PIPE,
+            wait=False,
+        )
+        self._reader = gevent.spawn(self._read_replies)
+
+    def _read_replies(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            reply = json.loads(line)
+            request = self._pending.pop(reply['id'])
+            request.latency = reply['latency']
+            self.latencies.setdefault(request.op, []).append(reply['latency'])
+            request._result.set(reply)
+
+        # The worker has gone away: fail anything still outstanding
+        for request in self._pending.values():
+            request._result.set({'ok': False, 'error': 'worker exited', 'latency': None})
+        self._pending.clear()
+
+    def _submit(self, op, path, **kwargs):
+        request_id = self._ids.next()
+        request = IORequest(op, path)
+        self._pending[request_id] = request
+        cmd = dict(kwargs, id=request_id, op=op, path=path)
+        self.proc.stdin.write(json.dumps(cmd) + "\n")
+        self.proc.stdin.flush()
+        return request
+
+    def open(self, path):
+        return self._submit('open', path)
+
+    def write(self, path, data='content'):
+        return self._submit('write', path, data=data)
+
+    def fsync(self, path):
+        return self._submit('fsync', path)
+
+    def close(self, path):
+        return self._submit('close', path)
+
+    def hold_cap(self, path):
+        """
+        Open a file for writing and write to it without closing, such that
+        the client will hold a capability on it until close() or stop().
+        """
+        return self._submit('hold', path)
+
+    def latency_summary(self):
+        """
+        :return: dict of op name to latency summary (see util.stats.summarize)
+        """
+        return dict((op, summarize(lats)) for op, lats in self.latencies.iteritems())
+
+    def stop(self):
+        """
+        Close all files and terminate the worker process.
+        """
+        if not self.proc.finished:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait()
+            except CommandFailedError:
+                # e.g. if the mount was killed underneath us
+                pass
+        self._reader.join()
+        log.info("I/O worker on client.{id} latencies: {l}".format(
+            id=self.mount.client_id, l=self.latency_summary()))
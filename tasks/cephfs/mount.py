@@ -1,4 +1,6 @@
 from contextlib import contextmanager
+from StringIO import StringIO
+import json
 import logging
 import datetime
 import time
@@ -6,10 +8,15 @@ from textwrap import dedent
 import os
 from teuthology.orchestra import run
 from teuthology.orchestra.run import CommandFailedError
+from .io_worker import IOWorker
 
 log = logging.getLogger(__name__)
 
 
+# Metadata operations understood by CephFSMount.run_mdbench
+MDBENCH_OPS = ['create', 'stat', 'readdir', 'rename', 'unlink']
+
+
 class CephFSMount(object):
     def __init__(self, test_dir, client_id, client_remote):
         """
@@ -26,6 +33,7 @@ class CephFSMount(object):
         self.test_files = ['a', 'b', 'c']
 
         self.background_procs = []
+        self.io_worker = None
 
     def is_mounted(self):
         raise NotImplementedError()
@@ -97,6 +105,115 @@ class CephFSMount(object):
             'sudo', 'rm', '-f', os.path.join(self.mountpoint, filename)
         ])
 
+    def run_mdbench(self, ops, files, threads, subdir="mdbench"):
+        """
+        Run a metadata workload against this mount from a single remote
+        python process, with ``threads`` threads each working on ``files``
+        files in a private directory.
+
+        The operations in ``ops`` run as consecutive phases, all threads
+        finishing one phase before the next begins.  Each phase performs
+        one operation per file, except for ``readdir`` which lists each
+        thread's directory once.
+
+        :param ops: list of operations from create, stat, readdir, rename, unlink
+        :param files: number of files per thread
+        :param threads: number of threads
+        :param subdir: directory under the mountpoint to work in
+        :return: dict of op name to dict with 'count', 'elapsed' (seconds
+                 for the whole phase) and 'latencies' (seconds per op)
+        """
+        assert(self.is_mounted())
+
+        for op in ops:
+            if op not in MDBENCH_OPS:
+                raise RuntimeError("Unknown mdbench operation '{0}'".format(op))
+
+        path = os.path.join(self.mountpoint, subdir, "client.{0}".format(self.client_id))
+
+        pyscript = dedent("""
+            import json
+            import os
+            import threading
+            import time
+
+            root = "{path}"
+            ops = {ops}
+            nfiles = {files}
+            nthreads = {threads}
+
+            def create(d, names, lat):
+                for n in names:
+                    a = time.time()
+                    os.close(os.open(os.path.join(d, n), os.O_CREAT | os.O_WRONLY, 0o644))
+                    lat.append(time.time() - a)
+
+            def stat(d, names, lat):
+                for n in names:
+                    a = time.time()
+                    os.stat(os.path.join(d, n))
+                    lat.append(time.time() - a)
+
+            def readdir(d, names, lat):
+                a = time.time()
+                os.listdir(d)
+                lat.append(time.time() - a)
+
+            def rename(d, names, lat):
+                for i, n in enumerate(names):
+                    a = time.time()
+                    os.rename(os.path.join(d, n), os.path.join(d, n + ".r"))
+                    lat.append(time.time() - a)
+                    names[i] = n + ".r"
+
+            def unlink(d, names, lat):
+                for n in names:
+                    a = time.time()
+                    os.unlink(os.path.join(d, n))
+                    lat.append(time.time() - a)
+
+            dirs = [os.path.join(root, "t%d" % t) for t in range(nthreads)]
+            for d in dirs:
+                os.makedirs(d)
+            names = [["f%d" % i for i in range(nfiles)] for _ in range(nthreads)]
+
+            results = {{}}
+            for op in ops:
+                lats = [[] for _ in range(nthreads)]
+                workers = [threading.Thread(target=globals()[op], args=(dirs[t], names[t], lats[t]))
+                           for t in range(nthreads)]
+                start = time.time()
+                for w in workers:
+                    w.start()
+                for w in workers:
+                    w.join()
+                elapsed = time.time() - start
+                latencies = [l for thread_lats in lats for l in thread_lats]
+                results[op] = {{'count': len(latencies), 'elapsed': elapsed, 'latencies': latencies}}
+
+            print(json.dumps(results))
+            """).format(path=path, ops=repr(list(ops)), files=int(files), threads=int(threads))
+
+        self.client_remote.run(args=['sudo', 'rm', '-rf', path])
+        p = self.client_remote.run(args=[
+            'sudo', 'python', '-c', pyscript
+        ], stdout=StringIO())
+        self.client_remote.run(args=['sudo', 'rm', '-rf', path])
+
+        return json.loads(p.stdout.getvalue())
+
+    def get_io_worker(self):
+        """
+        Get this client's persistent I/O worker, starting it if needed.
+        Use this rather than open_background/write_background when a test
+        needs many files open at once.
+        """
+        assert(self.is_mounted())
+
+        if self.io_worker is None:
+            self.io_worker = IOWorker(self)
+        return self.io_worker
+
     def _run_python(self, pyscript):
         return self.client_remote.run(args=[
             'sudo', 'daemon-helper', 'kill', 'python', '-c', pyscript
@@ -130,6 +247,42 @@ class CephFSMount(object):
         self.background_procs.append(rproc)
         return rproc
 
+    def open_n_background(self, fs_path, count):
+        """
+        Open ``count`` files for writing under ``fs_path`` from a single
+        process, then block such that the client holds a capability on
+        each of them.  Files are named 0..count-1 and created in order, so
+        the last one becoming visible means all of them exist.
+        """
+        assert(self.is_mounted())
+
+        path = os.path.join(self.mountpoint, fs_path)
+
+        pyscript = dedent("""
+            import time
+            import os
+            import resource
+
+            # Running as root, so we may raise the hard limit too
+            limit = {count} + 1024
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, limit))
+
+            os.mkdir("{path}")
+            handles = []
+            for i in range({count}):
+                f = open(os.path.join("{path}", str(i)), 'w')
+                f.write('content')
+                f.flush()
+                handles.append(f)
+
+            while True:
+                time.sleep(1)
+            """).format(path=path, count=int(count))
+
+        rproc = self._run_python(pyscript)
+        self.background_procs.append(rproc)
+        return rproc
+
     def wait_for_visible(self, basename="background_file", timeout=30):
         i = 0
         while i < timeout:
@@ -170,6 +323,11 @@ class CephFSMount(object):
         return rproc
 
     def teardown(self):
+        if self.io_worker is not None:
+            log.info("Stopping I/O worker")
+            self.io_worker.stop()
+            self.io_worker = None
+
         for p in self.background_procs:
             log.info("Terminating background process")
             if p.stdin:
@@ -178,3 +336,4 @@ class CephFSMount(object):
                     p.wait()
                 except CommandFailedError:
                     pass
+        self.background_procs = []
@@ -0,0 +1,128 @@
+"""
+CephFS client metadata-operation benchmark
+"""
+import contextlib
+import logging
+import time
+
+from teuthology.parallel import parallel
+from cephfs.filesystem import Filesystem
+from cephfs.mount import MDBENCH_OPS
+from util.perf_counters import perf_counter_delta
+from util.stats import summarize
+
+log = logging.getLogger(__name__)
+
+# MDS perf counter sections reported as deltas across the benchmark
+DEFAULT_MDS_SECTIONS = ['mds', 'mds_server', 'mds_log']
+
+
+def _dump_mds_perf(fs, sections):
+    """
+    Fetch the requested perf counter sections from every MDS
+    """
+    result = {}
+    for mds_id in fs.mds_ids:
+        dump = fs.mds_asok(['perf', 'dump'], mds_id) or {}
+        result[mds_id] = dict((s, dump.get(s, {})) for s in sections)
+    return result
+
+
+@contextlib.contextmanager
+def task(ctx, config):
+    """
+    Run a mix of metadata operations (create, stat, readdir, rename, unlink)
+    from several CephFS clients at once and report throughput and latency
+    for each operation, along with the change in MDS perf counters.
+
+    Works with both ``ceph-fuse`` and ``kclient`` mounts, and must be
+    nested inside one of those tasks.
+
+    The config should be as follows::
+
+        cephfs_mdbench:
+            clients: [client list, defaults to all mounted clients]
+            threads: <threads per client, default 4>
+            files: <files per thread, default 1000>
+            ops: <list of operations, run as phases in this order,
+                  default [create, stat, readdir, rename, unlink]>
+            mds_sections: <MDS perf dump sections to report,
+                           default [mds, mds_server, mds_log]>
+
+    example::
+
+        tasks:
+        - ceph:
+        - ceph-fuse:
+        - cephfs_mdbench:
+            threads: 8
+            files: 5000
+
+    Results are logged and stored in ``ctx.summary['cephfs_mdbench']``.
+    """
+    if config is None:
+        config = {}
+    assert isinstance(config, dict), \
+        "task cephfs_mdbench only supports a dictionary for configuration"
+
+    if not hasattr(ctx, 'mounts'):
+        raise RuntimeError("This task must be nested inside 'kclient' or 'ceph_fuse' task")
+
+    if 'clients' in config:
+        mounts = []
+        for role in config['clients']:
+            PREFIX = 'client.'
+            assert role.startswith(PREFIX)
+            mounts.append(ctx.mounts[role[len(PREFIX):]])
+    else:
+        mounts = ctx.mounts.values()
+
+    ops = config.get('ops', MDBENCH_OPS)
+    threads = int(config.get('threads', 4))
+    files = int(config.get('files', 1000))
+    sections = config.get('mds_sections', DEFAULT_MDS_SECTIONS)
+
+    fs = Filesystem(ctx, config)
+
+    log.info('Running mdbench on {n} clients, {t} threads x {f} files each, ops {ops}'.format(
+        n=len(mounts), t=threads, f=files, ops=ops))
+
+    def _run(mount):
+        return mount.client_id, mount.run_mdbench(ops, files, threads)
+
+    perf_before = _dump_mds_perf(fs, sections)
+    start = time.time()
+    with parallel() as p:
+        for mount in mounts:
+            p.spawn(_run, mount)
+        per_client = dict(p)
+    elapsed = time.time() - start
+    perf_after = _dump_mds_perf(fs, sections)
+
+    results = {'elapsed': elapsed, 'clients': len(mounts), 'ops': {}, 'mds': {}}
+    for op in ops:
+        latencies = []
+        ops_per_sec = 0.0
+        for client_result in per_client.values():
+            op_result = client_result[op]
+            latencies.extend(op_result['latencies'])
+            if op_result['elapsed'] > 0:
+                ops_per_sec += op_result['count'] / op_result['elapsed']
+        op_summary = summarize(latencies)
+        op_summary['ops_per_sec'] = ops_per_sec
+        results['ops'][op] = op_summary
+        log.info('{op}: {rate:.1f} ops/s over {count} ops, latency {lat}'.format(
+            op=op, rate=ops_per_sec, count=op_summary['count'],
+            lat=dict((k, v) for k, v in op_summary.iteritems()
+                     if k.startswith('p') or k in ('mean', 'max'))))
+
+    for mds_id in fs.mds_ids:
+        results['mds'][mds_id] = dict(
+            (s, perf_counter_delta(perf_before[mds_id][s], perf_after[mds_id][s]))
+            for s in sections)
+        log.info('mds.{id} perf counter deltas: {d}'.format(
+            id=mds_id, d=results['mds'][mds_id]))
+
+    ctx.summary['cephfs_mdbench'] = results
+
+    yield
@@ -0,0 +1,294 @@
+"""
+Sample the memory, CPU and thread usage of Ceph daemons
+"""
+from cStringIO import StringIO
+
+import contextlib
+import json
+import logging
+import os
+
+import gevent
+import yaml
+from teuthology.orchestra import run
+from teuthology.orchestra.run import CommandFailedError
+
+log = logging.getLogger(__name__)
+
+# Binary and identifying option for each daemon type we know how to find
+DAEMON_PROCESSES = {
+    'mon': ('ceph-mon', '-i'),
+    'osd': ('ceph-osd', '-i'),
+    'mds': ('ceph-mds', '-i'),
+    'rgw': ('radosgw', '-n'),
+    }
+
+# Runs on each host until EOF on stdin.  Every interval it finds the
+# process of each named daemon (the innermost of the processes whose
+# command line has the daemon's binary and id, so that sudo, daemon-helper
+# and the like are skipped while valgrind is not), and prints one JSON line
+# mapping daemon name to [RSS in kB, CPU % since the last sample, threads].
+# The process is looked up afresh every time, so restarts are followed.
+SAMPLER_SCRIPT = r"""
+import json
+import os
+import select
+import sys
+import time
+
+interval = float(sys.argv[1])
+daemons = json.loads(sys.argv[2])
+hz = float(os.sysconf('SC_CLK_TCK'))
+
+def read(path):
+    f = open(path, 'rb')
+    try:
+        return f.read().decode('utf-8', 'replace')
+    finally:
+        f.close()
+
+def processes():
+    procs = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            args = read('/proc/%s/cmdline' % pid).split('\0')
+            stat = read('/proc/%s/stat' % pid)
+        except (IOError, OSError):
+            continue
+        fields = stat[stat.rindex(')') + 2:].split()
+        procs[int(pid)] = (int(fields[1]), args,
+                           int(fields[11]) + int(fields[12]))
+    return procs
+
+def find(procs, binary, flag, id_):
+    found = set()
+    for pid, (_, args, _) in procs.items():
+        if not [a for a in args if os.path.basename(a) == binary]:
+            continue
+        for i in range(len(args) - 1):
+            if args[i] == flag and args[i + 1] == id_:
+                found.add(pid)
+                break
+    parents = set(procs[pid][0] for pid in found)
+    innermost = [pid for pid in found if pid not in parents]
+    if innermost:
+        return max(innermost)
+    return None
+
+prev = {}
+while True:
+    now = time.time()
+    procs = processes()
+    sample = {}
+    for name, (binary, flag, id_) in daemons.items():
+        pid = find(procs, binary, flag, id_)
+        if pid is None:
+            continue
+        rss = threads = None
+        try:
+            for line in read('/proc/%d/status' % pid).splitlines():
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+                elif line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+        except (IOError, OSError):
+            continue
+        ticks = procs[pid][2]
+        cpu = None
+        last = prev.get(name)
+        if last is not None and last[0] == pid and now > last[2]:
+            cpu = round(100.0 * (ticks - last[1]) / hz / (now - last[2]), 1)
+        prev[name] = (pid, ticks, now)
+        sample[name] = [rss, cpu, threads]
+    sys.stdout.write(json.dumps({'t': round(now, 3), 'd': sample}) + '\n')
+    sys.stdout.flush()
+    readable = select.select([sys.stdin], [], [], interval)[0]
+    if readable and not sys.stdin.readline():
+        break
+"""
+
+
+class UsageStats(object):
+    """
+    Running peak and mean of one daemon's samples
+    """
+    def __init__(self):
+        self.samples = 0
+        self.rss_sum = 0
+        self.rss_peak = 0
+        self.cpu_samples = 0
+        self.cpu_sum = 0.0
+        self.cpu_peak = 0.0
+        self.threads_peak = 0
+
+    def add(self, rss, cpu, threads):
+        if rss is not None:
+            self.samples += 1
+            self.rss_sum += rss
+            self.rss_peak = max(self.rss_peak, rss)
+        if cpu is not None:
+            self.cpu_samples += 1
+            self.cpu_sum += cpu
+            self.cpu_peak = max(self.cpu_peak, cpu)
+        if threads is not None:
+            self.threads_peak = max(self.threads_peak, threads)
+
+    def summary(self):
+        return {
+            'samples': self.samples,
+            'rss_peak_mb': round(self.rss_peak / 1024.0, 1),
+            'rss_mean_mb': round(self.rss_sum / 1024.0 / max(self.samples, 1), 1),
+            'cpu_peak_pct': self.cpu_peak,
+            'cpu_mean_pct': round(self.cpu_sum / max(self.cpu_samples, 1), 1),
+            'threads_peak': self.threads_peak,
+            }
+
+
+class HostSampler(object):
+    """
+    The sampler process on one host, and the statistics of the samples it
+    has sent back.  Raw samples are appended to ``path`` if given.
+    """
+    def __init__(self, remote, daemons, interval, path=None):
+        self.remote = remote
+        self.stats = dict((name, UsageStats()) for name in daemons)
+        self.out = file(path, 'w') if path else None
+        self.proc = remote.run(
+            args=['sudo', 'python', '-c', SAMPLER_SCRIPT,
+                  str(interval), json.dumps(daemons)],
+            logger=log.getChild(remote.shortname),
+            stdin=run.PIPE,
+            stdout=run.PIPE,
+            wait=False,
+            )
+        self._reader = gevent.spawn(self._read_samples)
+
+    def _read_samples(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            if self.out is not None:
+                self.out.write(line)
+            for name, values in json.loads(line)['d'].iteritems():
+                self.stats[name].add(*values)
+
+    def stop(self):
+        if not self.proc.finished:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait()
+            except CommandFailedError:
+                log.exception('Sampler on %s failed', self.remote.shortname)
+        self._reader.join()
+        if self.out is not None:
+            self.out.close()
+
+
+def daemons_by_host(ctx, types=None):
+    """
+    :param types: daemon types to include, default all we know
+    :returns: dict of remote to dict of daemon name to (binary, flag, id)
+    """
+    hosts = {}
+    for type_, daemons in ctx.daemons.daemons.iteritems():
+        if type_ not in DAEMON_PROCESSES:
+            continue
+        if types is not None and type_ not in types:
+            continue
+        binary, flag = DAEMON_PROCESSES[type_]
+        for id_, daemon in daemons.iteritems():
+            name = id_ if type_ == 'rgw' else '{type}.{id}'.format(type=type_, id=id_)
+            hosts.setdefault(daemon.remote, {})[name] = (binary, flag, id_)
+    return hosts
+
+
+def sample_once(ctx, types=None):
+    """
+    Take a single sample of the daemons on every host at once.
+
+    :param types: daemon types to sample, default all we know
+    :returns: dict of daemon name to RSS in MB
+    """
+    procs = []
+    for remote, daemons in daemons_by_host(ctx, types).iteritems():
+        proc = remote.run(
+            args=['sudo', 'python', '-c', SAMPLER_SCRIPT,
+                  '1', json.dumps(daemons)],
+            stdin=run.PIPE,
+            stdout=StringIO(),
+            wait=False,
+            )
+        proc.stdin.close()
+        procs.append(proc)
+    run.wait(procs)
+
+    rss = {}
+    for proc in procs:
+        lines = proc.stdout.getvalue().splitlines()
+        if not lines:
+            continue
+        for name, values in json.loads(lines[-1])['d'].iteritems():
+            if values[0] is not None:
+                rss[name] = round(values[0] / 1024.0, 1)
+    return rss
+
+
+@contextlib.contextmanager
+def task(ctx, config):
+    """
+    Sample the resident memory, CPU use and thread count of the Ceph
+    daemons (mon, osd, mds and radosgw) already started by earlier tasks,
+    with one sampling process per host, for the duration of the tasks
+    that follow.
+
+    At the end, the peak and mean RSS (MB) and CPU (% of one core) and the
+    peak thread count of each daemon are logged and stored in
+    ctx.summary['daemon_usage'] and in daemon_usage.yaml in the archive.
+    The raw samples are kept in daemon_usage/<host>.json.
+
+    For example::
+
+        tasks:
+        - ceph:
+        - daemon_usage:
+            interval: 5    # seconds between samples, default 10
+        - radosbench:
+            clients: [client.0]
+            time: 360
+
+    :param ctx: Context
+    :param config: Configuration
+    """
+    if config is None:
+        config = {}
+    assert isinstance(config, dict), \
+        "task daemon_usage only supports a dictionary for configuration"
+    interval = config.get('interval', 10)
+
+    archive_dir = None
+    if ctx.archive is not None:
+        archive_dir = os.path.join(ctx.archive, 'daemon_usage')
+        os.makedirs(archive_dir)
+
+    samplers = []
+    for remote, daemons in daemons_by_host(ctx).iteritems():
+        path = None
+        if archive_dir is not None:
+            path = os.path.join(archive_dir, remote.shortname + '.json')
+        samplers.append(HostSampler(remote, daemons, interval, path))
+
+    try:
+        yield
+    finally:
+        for sampler in samplers:
+            sampler.stop()
+
+        summary = {}
+        for sampler in samplers:
+            for name, stats in sampler.stats.iteritems():
+                summary[name] = stats.summary()
+                log.info('%s: %s', name, summary[name])
+        ctx.summary['daemon_usage'] = summary
+        if archive_dir is not None:
+            with file(os.path.join(ctx.archive, 'daemon_usage.yaml'), 'w') as f:
+                yaml.safe_dump(summary, f, default_flow_style=False)
@@ -5,6 +5,7 @@ import contextlib
 import logging
 
 from teuthology import misc
+from teuthology.parallel import parallel
 from cephfs.kernel_mount import KernelMount
 
 log = logging.getLogger(__name__)
@@ -19,6 +20,8 @@ def task(ctx, config):
     this operation on. This lets you e.g. set up one client with
     ``ceph-fuse`` and another with ``kclient``.
 
+    Clients are mounted and unmounted concurrently.
+
     Example that mounts all clients::
 
         tasks:
@@ -57,15 +60,17 @@ def task(ctx, config):
 
     mounts = {}
     for id_, remote in clients:
-        kernel_mount = KernelMount(mons, test_dir, id_, remote)
-        mounts[id_] = kernel_mount
+        mounts[id_] = KernelMount(mons, test_dir, id_, remote)
 
-        kernel_mount.mount()
+    with parallel() as p:
+        for mount in mounts.values():
+            p.spawn(mount.mount)
 
     ctx.mounts = mounts
     try:
         yield mounts
     finally:
         log.info('Unmounting kernel clients...')
-        for mount in mounts.values():
-            mount.umount()
+        with parallel() as p:
+            for mount in mounts.values():
+                p.spawn(mount.umount)
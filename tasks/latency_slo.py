@@ -0,0 +1,159 @@
+"""
+Measure client I/O stalls and match them with thrasher actions
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+
+import gevent
+from teuthology.orchestra import run
+from teuthology.orchestra.run import CommandFailedError
+
+from util import latency_slo
+from util.stats import summarize
+
+log = logging.getLogger(__name__)
+
+
+class Prober(object):
+    """
+    The probe on one client, and the samples it has sent back, each with
+    the time it arrived here.
+    """
+    def __init__(self, ctx, role, pool, interval, size):
+        self.role = role
+        (remote,) = ctx.cluster.only(role).remotes.iterkeys()
+        self.samples = []
+        self.proc = remote.run(
+            args=['sudo', 'python', '-c', latency_slo.PROBE_SCRIPT,
+                  role, pool, str(interval), str(size)],
+            logger=log.getChild(role),
+            stdin=run.PIPE,
+            stdout=run.PIPE,
+            wait=False,
+            )
+        self._reader = gevent.spawn(self._read_samples)
+
+    def _read_samples(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            self.samples.append((time.time(), json.loads(line)))
+
+    def stop(self):
+        if not self.proc.finished:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait()
+            except CommandFailedError:
+                log.exception('Latency probe on %s failed', self.role)
+        self._reader.join()
+
+    def latencies(self):
+        return [s['w'] + s['r'] for _, s in self.samples if 'error' not in s]
+
+
+@contextlib.contextmanager
+def task(ctx, config):
+    """
+    Watch the latency seen by clients while other tasks run, and blame
+    the I/O stalls on the thrasher actions that caused them.
+
+    A probe on each listed client writes and reads back a small object
+    through librados every interval, for as long as the tasks that follow
+    run.  A probe taking longer than ``stall`` seconds (or failing) is a
+    stall.  The probes' timestamps are put on the teuthology host's clock,
+    which thrashosds also uses to record its actions in ctx.thrash_journal,
+    and each stall is attributed to the last action started before it
+    ended, no more than ``window`` seconds before it began.
+
+    The latency distribution of each client, the longest stalls and their
+    causes and the number of stalls per action are stored in
+    ctx.summary['latency_slo'], and all samples, stalls and actions in
+    latency_slo.json in the archive.  If ``max_stall`` is given, the job
+    fails when the longest stall exceeds it.
+
+    Put this task before the workload and the thrasher::
+
+        tasks:
+        - ceph:
+        - latency_slo:
+            clients: [client.0]   # default
+            interval: 1           # seconds between probes, default 1
+            size: 4096            # bytes per probe, default 4096
+            stall: 5              # seconds, default 5
+            window: 60            # seconds, default 60
+            max_stall: 120        # optional
+        - thrashosds:
+        - radosbench:
+            clients: [client.0]
+            time: 1800
+
+    :param ctx: Context
+    :param config: Configuration
+    """
+    if config is None:
+        config = {}
+    assert isinstance(config, dict), \
+        "task latency_slo only supports a dictionary for configuration"
+    threshold = config.get('stall', 5)
+    window = config.get('window', 60)
+
+    pool = ctx.manager.create_pool_with_unique_name()
+    probers = [Prober(ctx, role, pool, config.get('interval', 1),
+                      config.get('size', 4096))
+               for role in config.get('clients', ['client.0'])]
+
+    try:
+        yield
+    finally:
+        for prober in probers:
+            prober.stop()
+        ctx.manager.remove_pool(pool)
+
+        journal = getattr(ctx, 'thrash_journal', [])
+        stalls = []
+        clients = {}
+        for prober in probers:
+            offset = latency_slo.clock_offset(prober.samples)
+            log.info('%s clock is %.3fs behind', prober.role, offset)
+            found = latency_slo.find_stalls(prober.samples, threshold, offset)
+            stalls.extend(dict(s, client=prober.role) for s in found)
+            clients[prober.role] = {
+                'latency': summarize(prober.latencies()),
+                'stalls': len(found),
+                }
+        stalls = latency_slo.attribute(stalls, journal, window)
+
+        by_action = {}
+        for stall in stalls:
+            by_action[stall['action']] = by_action.get(stall['action'], 0) + 1
+        summary = {
+            'clients': clients,
+            'stalls': len(stalls),
+            'stalls_by_action': dict((str(a), n) for a, n in by_action.iteritems()),
+            'longest_stalls': stalls[:10],
+            }
+        if stalls:
+            longest = stalls[0]
+            summary['longest_stall_seconds'] = longest['seconds']
+            log.info('Longest stall: %.1fs on %s, caused by %s',
+                     longest['seconds'], longest['client'], longest['action'])
+        ctx.summary['latency_slo'] = summary
+        if ctx.archive is not None:
+            with file(os.path.join(ctx.archive, 'latency_slo.json'), 'w') as f:
+                json.dump({
+                    'samples': dict((p.role, p.samples) for p in probers),
+                    'stalls': stalls,
+                    'journal': journal,
+                    }, f)
+
+        max_stall = config.get('max_stall')
+        if max_stall is not None and stalls and stalls[0]['seconds'] > max_stall:
+            reason = 'I/O stalled for {s:.1f}s on {c} after {a}'.format(
+                s=stalls[0]['seconds'], c=stalls[0]['client'],
+                a=stalls[0]['action'])
+            log.error(reason)
+            ctx.summary['success'] = False
+            if 'failure_reason' not in ctx.summary:
+                ctx.summary['failure_reason'] = reason
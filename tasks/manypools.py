@@ -3,37 +3,229 @@ Force pg creation on all osds
 """
 from teuthology import misc as teuthology
 from teuthology.orchestra import run
+from teuthology.orchestra.run import CommandFailedError
+import json
 import logging
+import os
+import time
+
+import gevent
+
+import daemon_usage
+from util.stats import summarize
 
 log = logging.getLogger(__name__)
 
+# Runs on each client.  Creates the given pools with ``in_flight`` of them
+# being created at any time, writing 16 objects to each new pool so that
+# its pgs must be created, and prints one JSON line per pool with how long
+# the pool create and the writes took.  Exits non-zero if any failed.
+CREATE_SCRIPT = r"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+role = sys.argv[1]
+pools = json.loads(sys.argv[2])
+in_flight = int(sys.argv[3])
+lock = threading.Lock()
+failed = []
+devnull = open(os.devnull, 'w')
+
+def timed(args):
+    start = time.time()
+    status = subprocess.call(args, stdout=devnull, stderr=subprocess.STDOUT)
+    return status, time.time() - start
+
+def create(pool):
+    record = {'pool': pool}
+    status, record['create'] = timed(
+        ['rados', '--name', role, 'mkpool', pool, '-1'])
+    if status == 0:
+        status, record['pg_create'] = timed(
+            ['rados', '--name', role, '--pool', pool,
+             'bench', '0', 'write', '-t', '16', '--block-size', '1'])
+    if status != 0:
+        record['error'] = status
+    return record
+
+def worker():
+    while True:
+        lock.acquire()
+        try:
+            if not pools:
+                return
+            pool = pools.pop(0)
+        finally:
+            lock.release()
+        record = create(pool)
+        lock.acquire()
+        try:
+            if 'error' in record:
+                failed.append(pool)
+            sys.stdout.write(json.dumps(record) + '\n')
+            sys.stdout.flush()
+        finally:
+            lock.release()
+
+threads = [threading.Thread(target=worker) for _ in range(in_flight)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+sys.exit(1 if failed else 0)
+"""
+
+
+class PoolCreator(object):
+    """
+    Pool creation on all the clients: the creations completed so far, in
+    the order they completed, and the daemon memory sampled every
+    ``checkpoint`` pools.
+    """
+    def __init__(self, ctx, poolnum, in_flight, checkpoint):
+        self.ctx = ctx
+        self.poolnum = poolnum
+        self.in_flight = in_flight
+        self.checkpoint = checkpoint
+        self.records = []
+        self.errors = []
+        self.memory = {}
+        self._samplers = []
+
+    def run(self, clients):
+        """
+        Create the pools from ``clients`` (list of (remote, role)), each
+        client taking every len(clients)'th pool.
+        """
+        self.start = time.time()
+        procs = []
+        readers = []
+        for i, (remote, role) in enumerate(clients):
+            pools = ['pool{num}'.format(num=num)
+                     for num in range(i + 1, self.poolnum + 1, len(clients))]
+            if not pools:
+                continue
+            log.info('creating %d pools from %s, %d at a time',
+                     len(pools), role, self.in_flight)
+            proc = remote.run(
+                args=['python', '-c', CREATE_SCRIPT, role, json.dumps(pools),
+                      str(self.in_flight)],
+                logger=log.getChild(role),
+                stdout=run.PIPE,
+                wait=False,
+                )
+            procs.append(proc)
+            readers.append(gevent.spawn(self._read_records, proc))
+        try:
+            run.wait(procs)
+        finally:
+            self.elapsed = time.time() - self.start
+            for reader in readers:
+                reader.get()
+            for sampler in self._samplers:
+                sampler.join()
+            # the last, partial, checkpoint
+            created = len(self.records)
+            if created and created not in self.memory:
+                self._sample(created)
+
+    def _read_records(self, proc):
+        for line in iter(proc.stdout.readline, ''):
+            record = json.loads(line)
+            if 'error' in record:
+                log.error('creating %s failed', record['pool'])
+                self.errors.append(record['pool'])
+                continue
+            self.records.append(record)
+            created = len(self.records)
+            if created % self.checkpoint == 0:
+                log.info('%d pools created', created)
+                self._samplers.append(gevent.spawn(self._sample, created))
+
+    def _sample(self, created):
+        try:
+            self.memory[created] = daemon_usage.sample_once(
+                self.ctx, ['mon', 'osd'])
+        except CommandFailedError:
+            log.exception('sampling memory at %d pools failed', created)
+
+    def checkpoints(self):
+        """
+        The scaling curve: for each ``checkpoint`` pools created, the pool
+        and pg create latencies of those pools and the daemon memory once
+        they were created.
+        """
+        curve = []
+        for end in range(self.checkpoint, len(self.records) + self.checkpoint,
+                         self.checkpoint):
+            window = self.records[end - self.checkpoint:end]
+            pools = end - self.checkpoint + len(window)
+            memory = self.memory.get(pools, {})
+            curve.append({
+                'pools': pools,
+                'create_latency': summarize(
+                    [r['create'] for r in window], percentiles=[50, 99]),
+                'pg_create_latency': summarize(
+                    [r['pg_create'] for r in window], percentiles=[50, 99]),
+                'memory_mb': memory,
+                'mon_memory_mb': sum(v for k, v in memory.iteritems()
+                                     if k.startswith('mon.')),
+                'osd_memory_mb': sum(v for k, v in memory.iteritems()
+                                     if k.startswith('osd.')),
+                })
+        return curve
+
+
 def task(ctx, config):
     """
     Create the specified number of pools and write 16 objects to them (thereby forcing
     the PG creation on each OSD). This task creates pools from all the clients,
     in parallel. It is easy to add other daemon types which have the appropriate
     permissions, but I don't think anything else does.
-    The config is just the number of pools to create. I recommend setting
+    The config is just the number of pools to create, or a dict::
+
+        manypools:
+          pools: 3000
+          in_flight: 8       # pool creations kept going per client, default 4
+          checkpoint: 500    # pools between measurements, default pools / 10
+
+    I recommend setting
     "mon create pg interval" to a very low value in your ceph config to speed
     this up.
-    
-    You probably want to do this to look at memory consumption, and
-    maybe to test how performance changes with the number of PGs. For example:
-    
+
+    Every checkpoint pools, the create latencies of the pools created since
+    the last checkpoint are summarized and the memory of the mons and osds
+    is sampled, giving the scaling curve stored in
+    ctx.summary['manypools'] and manypools.json in the archive.  Pool create
+    latency is the time taken by "rados mkpool", pg create latency the time
+    taken to write the first objects to the new pool.
+
+    You probably want to do this to look at memory consumption (the
+    daemon_usage task samples it), and maybe to test how performance
+    changes with the number of PGs. For example:
+
     tasks:
     - ceph:
         config:
           mon:
             mon create pg interval: 1
+    - daemon_usage:
     - manypools: 3000
     - radosbench:
         clients: [client.0]
         time: 360
     """
-    
-    log.info('creating {n} pools'.format(n=config))
-    
-    poolnum = int(config)
+    if not isinstance(config, dict):
+        config = {'pools': config}
+    poolnum = int(config['pools'])
+    in_flight = int(config.get('in_flight', 4))
+    checkpoint = int(config.get('checkpoint', max(poolnum / 10, 1)))
+    log.info('creating {n} pools'.format(n=poolnum))
+
     creator_remotes = []
     client_roles = teuthology.all_roles_of_type(ctx.cluster, 'client')
     log.info('got client_roles={client_roles_}'.format(client_roles_=client_roles))
@@ -42,32 +234,26 @@ def task(ctx, config):
         (creator_remote, ) = ctx.cluster.only('client.{id}'.format(id=role)).remotes.iterkeys()
         creator_remotes.append((creator_remote, 'client.{id}'.format(id=role)))
 
-    remaining_pools = poolnum
-    poolprocs=dict()
-    while (remaining_pools > 0):
-        log.info('{n} pools remaining to create'.format(n=remaining_pools))
-	for remote, role_ in creator_remotes:
-            poolnum = remaining_pools
-            remaining_pools -= 1
-            if remaining_pools < 0:
-                continue
-            log.info('creating pool{num} on {role}'.format(num=poolnum, role=role_))
-	    proc = remote.run(
-	        args=[
-		    'rados',
-		    '--name', role_,
-		    'mkpool', 'pool{num}'.format(num=poolnum), '-1',
-		    run.Raw('&&'),
-		    'rados',
-		    '--name', role_,
-		    '--pool', 'pool{num}'.format(num=poolnum),
-		    'bench', '0', 'write', '-t', '16', '--block-size', '1'
-		    ],
-		wait = False
-	    )
-            log.info('waiting for pool and object creates')
-	    poolprocs[remote] = proc
-        
-        run.wait(poolprocs.itervalues())
-    
+    creator = PoolCreator(ctx, poolnum, in_flight, checkpoint)
+    try:
+        creator.run(creator_remotes)
+    finally:
+        curve = creator.checkpoints()
+        for point in curve:
+            log.info('%d pools: create %s, pg create %s, mon %s MB, osd %s MB',
+                     point['pools'], point['create_latency'],
+                     point['pg_create_latency'], point['mon_memory_mb'],
+                     point['osd_memory_mb'])
+        summary = {
+            'pools': len(creator.records),
+            'failed': len(creator.errors),
+            'checkpoints': curve,
+            }
+        if creator.records:
+            summary['pools_per_sec'] = len(creator.records) / creator.elapsed
+        ctx.summary['manypools'] = summary
+        if ctx.archive is not None:
+            with file(os.path.join(ctx.archive, 'manypools.json'), 'w') as f:
+                json.dump(dict(summary, records=creator.records), f)
+
     log.info('created all {n} pools and wrote 16 objects to each'.format(n=poolnum))
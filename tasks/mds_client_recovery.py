@@ -4,10 +4,13 @@ Teuthology task for exercising CephFS client recovery
 """
 
 import contextlib
+from StringIO import StringIO
 import logging
+import os
 import time
 import unittest
 from teuthology.orchestra import run
+from teuthology.parallel import parallel
 
 from teuthology.orchestra.run import CommandFailedError
 from teuthology.task import interactive
@@ -22,6 +25,9 @@ log = logging.getLogger(__name__)
 # an MDS or waiting for it to come up
 MDS_RESTART_GRACE = 60
 
+# Default numbers of caps per holding client for the scale test
+DEFAULT_SCALE_CAPS = [1000, 4000, 16000]
+
 
 class TestClientRecovery(unittest.TestCase):
     # Environment references
@@ -319,6 +325,127 @@ class TestClientRecovery(unittest.TestCase):
         self.assert_session_state(client_id, "open")
 
 
+class TestClientRecoveryScale(unittest.TestCase):
+    """
+    Measure how MDS reconnect time and cap recall throughput scale with
+    the number of caps held by clients.
+
+    All mounts but the last hold caps; the last mount is the observer
+    whose stats force the MDS to recall the holders' caps.
+    """
+    # Environment references
+    fs = None
+    mounts = None
+    cap_counts = None
+    results = None
+
+    def setUp(self):
+        self.fs.clear_firewall()
+        self.fs.mds_restart()
+        self.fs.wait_for_state('up:active', timeout=MDS_RESTART_GRACE)
+        with parallel() as p:
+            for mount in self.mounts:
+                p.spawn(mount.mount)
+        with parallel() as p:
+            for mount in self.mounts:
+                p.spawn(mount.wait_until_mounted)
+
+        self.mounts[0].run_shell(["sudo", "rm", "-rf", run.Raw("*")])
+
+    def tearDown(self):
+        self.fs.clear_firewall()
+        with parallel() as p:
+            for mount in self.mounts:
+                p.spawn(mount.teardown)
+
+    def _wait_active_timed(self, timeout=MDS_RESTART_GRACE):
+        """
+        Poll the MDS state until it is active, recording how many seconds
+        after the call each state was first seen.
+        """
+        mds_id = self.fs.get_lone_mds_id()
+        start = time.time()
+        first_seen = {}
+        while True:
+            mds_info = self.fs.mon_manager.get_mds_status(mds_id)
+            state = mds_info['state'] if mds_info else None
+            elapsed = time.time() - start
+            first_seen.setdefault(state, elapsed)
+            if state == 'up:active':
+                return first_seen
+            if elapsed > timeout:
+                raise RuntimeError("Timed out after {0}s waiting for MDS to become active, in state {1}".format(
+                    elapsed, state))
+            time.sleep(0.5)
+
+    def _session_caps(self):
+        ls_data = self.fs.mds_asok(['session', 'ls'])
+        return sum(s.get('num_caps', 0) for s in ls_data)
+
+    def _stat_all(self, mount, dirs, count):
+        """
+        Stat every file held open by the holders from a single process on
+        ``mount``, returning the seconds this took on the remote host.
+        """
+        pyscript = """
+import os
+import time
+start = time.time()
+for d in {dirs}:
+    for i in range({count}):
+        os.stat(os.path.join(d, str(i)))
+print(time.time() - start)
+""".format(dirs=repr([os.path.join(mount.mountpoint, d) for d in dirs]), count=count)
+        p = mount.client_remote.run(args=['sudo', 'python', '-c', pyscript], stdout=StringIO())
+        return float(p.stdout.getvalue().strip())
+
+    def test_reconnect_scale(self):
+        holders = self.mounts[:-1]
+        observer = self.mounts[-1]
+
+        for count in self.cap_counts:
+            dirs = ["caps_{0}_{1}".format(count, m.client_id) for m in holders]
+            procs = [m.open_n_background(d, count) for m, d in zip(holders, dirs)]
+
+            # All holders have created their files once the last one of
+            # each is visible
+            for mount, dirname in zip(holders, dirs):
+                mount.wait_for_visible(os.path.join(dirname, str(count - 1)), timeout=max(30, count / 10))
+            caps_before = self._session_caps()
+
+            self.fs.mds_fail_restart()
+            states = self._wait_active_timed()
+            caps_after = self._session_caps()
+
+            # Time spent in reconnect, from first seeing up:reconnect to
+            # first seeing up:active
+            reconnect_time = None
+            if 'up:reconnect' in states:
+                reconnect_time = states['up:active'] - states['up:reconnect']
+
+            recall_time = self._stat_all(observer, dirs, count)
+            total = count * len(holders)
+            result = {
+                'holders': len(holders),
+                'caps_before': caps_before,
+                'caps_after': caps_after,
+                'time_to_active': states['up:active'],
+                'reconnect_time': reconnect_time,
+                'recall_time': recall_time,
+                'recall_caps_per_sec': total / recall_time if recall_time > 0 else None,
+            }
+            log.info("{0} caps across {1} clients: {2}".format(total, len(holders), result))
+            self.results[total] = result
+
+            for proc in procs:
+                proc.stdin.close()
+                try:
+                    proc.wait()
+                except CommandFailedError:
+                    # We killed it, so it raises an error
+                    pass
+
+
 class LogStream(object):
     def __init__(self):
         self.buffer = ""
@@ -365,6 +492,18 @@ def task(ctx, config):
     Requires:
     - An outer ceph_fuse task with at least two clients
     - That the clients are on a separate host to the MDS
+
+    To instead measure how reconnect time and cap recall throughput scale
+    with the number of caps held, use scale mode.  Every mount but the last
+    holds ``caps`` open files (one process per client), the MDS is failed
+    and restarted, and then the last mount stats every file::
+
+        - mds_client_recovery:
+            scale:
+              caps: [1000, 4000, 16000]
+
+    Scale results are stored in ``ctx.summary['mds_client_recovery_scale']``,
+    keyed by the total number of caps held.
     """
     fs = Filesystem(ctx, config)
 
@@ -405,9 +544,19 @@ def task(ctx, config):
     ctx.mount_a = mount_a
     ctx.mount_b = mount_b
 
+    scale = config.get('scale') if config else None
+    if scale is not None:
+        TestClientRecoveryScale.fs = fs
+        TestClientRecoveryScale.mounts = ctx.mounts.values()
+        TestClientRecoveryScale.cap_counts = (scale or {}).get('caps', DEFAULT_SCALE_CAPS)
+        TestClientRecoveryScale.results = {}
+        ctx.summary['mds_client_recovery_scale'] = TestClientRecoveryScale.results
+
     # Execute test suite
     # ==================
-    if config and 'test_name' in config:
+    if scale is not None:
+        suite = unittest.TestLoader().loadTestsFromTestCase(TestClientRecoveryScale)
+    elif config and 'test_name' in config:
         suite = unittest.TestLoader().loadTestsFromName(
             "teuthology.task.mds_client_recovery.{0}".format(config['test_name']))
     else:
@@ -2,56 +2,207 @@
 Multibench testing
 """
 import contextlib
+import csv
 import logging
-import radosbench
+import os
 import time
-import copy
+
 import gevent
 
+from teuthology.orchestra import run
+import radosbench
+from util import rados_bench
+from util.stats import summarize
+
 log = logging.getLogger(__name__)
 
+
+class Timeline(object):
+    """
+    What happened when, across all segments: per-second bench lines
+    placed on a common clock, and pool creations and deletions.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.benches = []
+        self.pool_ops = []
+
+    def add_bench(self, started, results):
+        self.benches.append((started, results))
+
+    @contextlib.contextmanager
+    def pool_op(self, what):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.pool_ops.append((started, time.time(), what))
+
+    def throughput(self):
+        """
+        :returns: list of dicts for each second since the start, with the
+                  MB/s of all running benches added up, the number of
+                  benches reporting and whether a pool operation was in
+                  progress
+        """
+        seconds = {}
+        for started, results in self.benches:
+            for result in results.itervalues():
+                for line in result['seconds']:
+                    if line['cur_mb_sec'] is None or line['sec'] == 0:
+                        continue
+                    second = int(started - self.start) + line['sec']
+                    total, benches = seconds.get(second, (0, 0))
+                    seconds[second] = (total + line['cur_mb_sec'], benches + 1)
+        busy = set()
+        for started, finished, _ in self.pool_ops:
+            busy.update(range(int(started - self.start),
+                              int(finished - self.start) + 1))
+        return [
+            {'second': sec,
+             'mb_sec': seconds.get(sec, (0, 0))[0],
+             'benches': seconds.get(sec, (0, 0))[1],
+             'pool_op': sec in busy}
+            for sec in range(max(seconds) + 1 if seconds else 0)
+            ]
+
+
+def run_segment(ctx, config, num, timeline):
+    """
+    Run back to back radosbench write iterations until the total time is
+    up, starting ``num`` staggers after the others.
+    """
+    bench = config.get('radosbench', {})
+    clients = bench.get('clients', ['client.0'])
+    seconds = int(bench.get('time', 60))
+    total = int(config.get('time', 600))
+    stagger = config.get('stagger', seconds / float(config.get('segments', 3)))
+    churn = config.get('pool_churn', False)
+
+    profile_name = None
+    if bench.get('ec_pool', False):
+        profile = bench.get('erasure_code_profile', {})
+        profile_name = profile.get('name', 'teuthologyprofile')
+        ctx.manager.create_erasure_code_profile(profile_name, profile)
+
+    gevent.sleep(max(0, timeline.start + num * stagger - time.time()))
+    pool = None
+    iteration = 0
+    try:
+        while time.time() + seconds <= timeline.start + total:
+            if pool is None:
+                with timeline.pool_op('create pool for segment %d' % num):
+                    pool = ctx.manager.create_pool_with_unique_name(
+                        erasure_code_profile_name=profile_name)
+            log.info('Starting iteration %s of segment %s on pool %s',
+                     iteration, num, pool)
+            started = time.time()
+            procs = dict(
+                (role, radosbench.start_bench(
+                    ctx, role, pool, seconds, 'write',
+                    bench.get('block_size'), bench.get('concurrency')))
+                for role in clients)
+            run.wait(procs.itervalues())
+            timeline.add_bench(started, dict(
+                (role, rados_bench.parse_output(proc.stdout.getvalue()))
+                for role, proc in procs.iteritems()))
+            iteration += 1
+            if churn:
+                with timeline.pool_op('remove pool %s' % pool):
+                    ctx.manager.remove_pool(pool)
+                pool = None
+    finally:
+        if pool is not None:
+            with timeline.pool_op('remove pool %s' % pool):
+                ctx.manager.remove_pool(pool)
+    return iteration
+
+
+def summarize_timeline(timeline, iterations):
+    """
+    Summary of the combined throughput, overall and while pools were and
+    were not being created or removed.
+    """
+    series = timeline.throughput()
+    steady = [s['mb_sec'] for s in series if s['benches'] and not s['pool_op']]
+    during = [s['mb_sec'] for s in series if s['benches'] and s['pool_op']]
+    return {
+        'iterations': iterations,
+        'pool_ops': len(timeline.pool_ops),
+        'mb_sec': summarize([s['mb_sec'] for s in series if s['benches']],
+                            percentiles=[5, 50, 95]),
+        'mb_sec_steady': summarize(steady, percentiles=[50]),
+        'mb_sec_during_pool_ops': summarize(during, percentiles=[50]),
+        }
+
+
 @contextlib.contextmanager
 def task(ctx, config):
     """
     Run multibench
 
+    Several overlapping segments each run radosbench write iterations
+    back to back, until the total time is up.  Segment i starts i *
+    stagger seconds after the first, so that iterations do not all start
+    and stop together.  Each segment writes to a pool of its own, which
+    it reuses for all its iterations, or with pool_churn replaces with a
+    new pool after every iteration.
+
     The config should be as follows:
 
     multibench:
         time: <seconds to run total>
         segments: <number of concurrent benches>
-        radosbench: <config for radosbench>
+        stagger: <seconds between segment starts, default radosbench
+                  time / segments>
+        pool_churn: <create and remove a pool per iteration, default false>
+        radosbench:
+            clients: [client list]
+            time: <seconds per iteration>
+            block_size: <bytes, optional>
+            concurrency: <ops in flight, optional>
+            ec_pool: <use an ec pool, default false>
+            erasure_code_profile: <as for radosbench>
+
+    The bandwidth of all segments is added up second by second and saved
+    as multibench.csv in the archive, with a flag for the seconds during
+    which a pool was being created or removed.  ctx.summary['multibench']
+    has the distribution of that combined bandwidth, overall and with
+    and without pool operations in progress.
 
     example:
 
     tasks:
     - ceph:
     - multibench:
-        clients: [client.0]
         time: 360
+        segments: 3
+        pool_churn: true
+        radosbench:
+            clients: [client.0]
+            time: 60
     - interactive:
     """
     log.info('Beginning multibench...')
     assert isinstance(config, dict), \
         "please list clients to run on"
 
-    def run_one(num):
-    """Run test spawn from gevent"""
-        start = time.time()
-        benchcontext = copy.copy(config.get('radosbench'))
-        iterations = 0
-        while time.time() - start < int(config.get('time', 600)):
-            log.info("Starting iteration %s of segment %s"%(iterations, num))
-            benchcontext['pool'] = str(num) + "-" + str(iterations)
-            with radosbench.task(ctx, benchcontext):
-                time.sleep()
-            iterations += 1
-    log.info("Starting %s threads"%(str(config.get('segments', 3)),))
+    timeline = Timeline()
+    log.info("Starting %s segments" % config.get('segments', 3))
     segments = [
-        gevent.spawn(run_one, i) 
-        for i in range(0, int(config.get('segments', 3)))]
+        gevent.spawn(run_segment, ctx, config, i, timeline)
+        for i in range(int(config.get('segments', 3)))]
 
     try:
         yield
     finally:
-        [i.get() for i in segments]
+        iterations = sum(segment.get() for segment in segments)
+        summary = summarize_timeline(timeline, iterations)
+        log.info('multibench: %s', summary)
+        ctx.summary['multibench'] = summary
+        if ctx.archive is not None:
+            columns = ['second', 'mb_sec', 'benches', 'pool_op']
+            with open(os.path.join(ctx.archive, 'multibench.csv'), 'wb') as f:
+                writer = csv.DictWriter(f, columns)
+                writer.writerow(dict(zip(columns, columns)))
+                writer.writerows(timeline.throughput())
@@ -1,14 +1,105 @@
 """
 Run omapbench executable within teuthology
 """
+from cStringIO import StringIO
+
 import contextlib
+import itertools
 import logging
 
+import gevent
+
 from teuthology.orchestra import run
 from teuthology import misc as teuthology
+from util import omap_bench
 
 log = logging.getLogger(__name__)
 
+# Options that may be given a list of values to sweep over
+SWEEP_OPTIONS = ['entries', 'keysize', 'valsize', 'omaptype']
+DEFAULTS = {'entries': 10, 'keysize': 10, 'valsize': 1000, 'omaptype': 'uniform'}
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def start_omapbench(ctx, config, role, point):
+    """
+    Start omapbench on client ``role`` with the sweep options in ``point``.
+    How long it ran, in ns, is printed after its output.
+    """
+    testdir = teuthology.get_testdir(ctx)
+    PREFIX = 'client.'
+    id_ = role[len(PREFIX):]
+    (remote,) = ctx.cluster.only(role).remotes.iterkeys()
+    command = " ".join(['adjust-ulimits',
+                        'ceph-coverage',
+                        '{tdir}/archive/coverage',
+                        'omapbench',
+                        '--name', id_,
+                        '-t', str(config.get('threads', 30)),
+                        '-o', str(config.get('objects', 1000)),
+                        '--entries', str(point['entries']),
+                        '--keysize', str(point['keysize']),
+                        '--valsize', str(point['valsize']),
+                        '--inc', str(config.get('increment', 10)),
+                        '--omaptype', str(point['omaptype'])
+                        ]).format(tdir=testdir)
+    return remote.run(
+        args=[
+            "/bin/sh", "-c",
+            'start=$(date +%s%N); ' + command + '; status=$?; '
+            'echo "omapbench elapsed: $(($(date +%s%N) - start))ns"; '
+            'exit $status',
+            ],
+        logger=log.getChild('omapbench.{id}'.format(id=id_)),
+        stdin=run.PIPE,
+        stdout=StringIO(),
+        wait=False
+        )
+
+
+def run_sweep(ctx, config, matrix):
+    """
+    Run omapbench on all the clients at once for each combination of the
+    sweep options in turn, appending the results to ``matrix``.
+    """
+    objects = int(config.get('objects', 1000))
+    increment = float(config.get('increment', 10))
+    values = [_as_list(config.get(opt, DEFAULTS[opt])) for opt in SWEEP_OPTIONS]
+    for combination in itertools.product(*values):
+        point = dict(zip(SWEEP_OPTIONS, combination))
+        name = ','.join('%s=%s' % (opt, point[opt]) for opt in SWEEP_OPTIONS)
+        log.info('omapbench %s', name)
+        procs = dict((role, start_omapbench(ctx, config, role, point))
+                     for role in config.get('clients', ['client.0']))
+        run.wait(procs.itervalues())
+
+        clients = {}
+        for role, proc in procs.iteritems():
+            output = proc.stdout.getvalue()
+            log.debug('%s output:\n%s', role, output)
+            clients[role] = omap_bench.parse_output(output, objects)
+        histogram = omap_bench.merge_histograms(
+            c['histogram'] for c in clients.itervalues())
+        total = {
+            'ops_per_sec': sum(c.get('ops_per_sec', 0)
+                               for c in clients.itervalues()),
+            'latency_ms': omap_bench.histogram_percentiles(histogram, increment),
+            'histogram': histogram,
+            }
+        averages = [c['average_latency_ms'] for c in clients.itervalues()
+                    if 'average_latency_ms' in c]
+        if averages:
+            total['latency_ms']['mean'] = sum(averages) / len(averages)
+        log.info('omapbench %s: %s ops/s, latency %s', name,
+                 total['ops_per_sec'], total['latency_ms'])
+        matrix.append(dict(point, name=name, clients=clients, total=total))
+
+
 @contextlib.contextmanager
 def task(ctx, config):
     """
@@ -26,6 +117,13 @@ def task(ctx, config):
 		      increment: <interval to show in histogram (in ms)>
 		      omaptype: <how the omaps should be generated>
 
+    Any of entries, keysize, valsize and omaptype may be a list, in which
+    case omapbench is run for every combination of their values in turn,
+    all clients at once.  The latency histograms are parsed, and for each
+    combination the clients' results and the combined ops per second,
+    latency percentiles (estimated from the histogram) and histogram are
+    stored as a row of ctx.summary['omapbench'].
+
     example::
 
 		  tasks:
@@ -34,9 +132,9 @@ def task(ctx, config):
 		      clients: [client.0]
 		      threads: 30
 		      objects: 1000
-		      entries: 10
+		      entries: [10, 1000]
 		      keysize: 10
-		      valsize: 100
+		      valsize: [100, 4096]
 		      increment: 100
 		      omaptype: uniform
 		  - interactive:
@@ -44,40 +142,17 @@ def task(ctx, config):
     log.info('Beginning omapbench...')
     assert isinstance(config, dict), \
         "please list clients to run on"
-    omapbench = {}
-    testdir = teuthology.get_testdir(ctx)
-    print(str(config.get('increment',-1)))
     for role in config.get('clients', ['client.0']):
         assert isinstance(role, basestring)
         PREFIX = 'client.'
         assert role.startswith(PREFIX)
-        id_ = role[len(PREFIX):]
-        (remote,) = ctx.cluster.only(role).remotes.iterkeys()
-        proc = remote.run(
-            args=[
-                "/bin/sh", "-c",
-                " ".join(['adjust-ulimits',
-                          'ceph-coverage',
-                          '{tdir}/archive/coverage',
-                          'omapbench',
-                          '--name', role[len(PREFIX):],
-                          '-t', str(config.get('threads', 30)),
-                          '-o', str(config.get('objects', 1000)),
-                          '--entries', str(config.get('entries',10)),
-                          '--keysize', str(config.get('keysize',10)),
-                          '--valsize', str(config.get('valsize',1000)),
-                          '--inc', str(config.get('increment',10)),
-                          '--omaptype', str(config.get('omaptype','uniform'))
-                          ]).format(tdir=testdir),
-                ],
-            logger=log.getChild('omapbench.{id}'.format(id=id_)),
-            stdin=run.PIPE,
-            wait=False
-            )
-        omapbench[id_] = proc
+
+    matrix = []
+    sweep = gevent.spawn(run_sweep, ctx, config, matrix)
 
     try:
         yield
     finally:
         log.info('joining omapbench')
-        run.wait(omapbench.itervalues())
+        sweep.get()
+        ctx.summary['omapbench'] = matrix
@@ -1,10 +1,15 @@
 """
 Remotely run peering tests.
 """
+from cStringIO import StringIO
+
+import datetime
+import json
 import logging
 import time
 from teuthology import misc as teuthology
 import ceph_manager
+from util.stats import summarize
 
 log = logging.getLogger(__name__)
 
@@ -18,9 +23,68 @@ ARGS = [
     ('num_objects', 'objects to create', 256 * 1024, int),
     ('object_size', 'size in bytes for objects', 64, int),
     ('creation_time_limit', 'time limit for pool population', 60*60, int),
-    ('create_threads', 'concurrent writes for create', 256, int)
+    ('create_threads', 'concurrent writes for create', 256, int),
+    ('pg_timings', 'record per-pg peering durations (0 or 1)', 0, int),
+    ('query_concurrency', 'pg queries to run at once', 16, int),
+    ('outlier_factor', 'pgs slower than this times the median are outliers', 3.0, float),
     ]
 
+# Runs on the mon.  Queries the given pgs, several at a time, and prints
+# for each the acting set, the epoch its current interval began and when
+# it entered the Started and Active states, as reported by its primary.
+QUERY_SCRIPT = r"""
+import json
+import subprocess
+import sys
+import threading
+
+pgids = json.loads(sys.argv[1])
+concurrency = int(sys.argv[2])
+lock = threading.Lock()
+result = {}
+
+def query(pgid):
+    try:
+        proc = subprocess.Popen(
+            ['ceph', 'pg', pgid, 'query', '--format=json'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            return {'error': 'exit status %d: %s' % (proc.returncode, err.strip())}
+        q = json.loads(out.decode('utf-8'))
+    except Exception as e:
+        return {'error': str(e)}
+    states = dict((s.get('name'), s.get('enter_time'))
+                  for s in q.get('recovery_state', []))
+    return {
+        'acting': q.get('acting', []),
+        'same_interval_since': q.get('info', {}).get('history', {}).get('same_interval_since'),
+        'started': states.get('Started'),
+        'active': states.get('Started/Primary/Active'),
+        }
+
+def worker():
+    while True:
+        lock.acquire()
+        try:
+            if not pgids:
+                return
+            pgid = pgids.pop()
+        finally:
+            lock.release()
+        r = query(pgid)
+        lock.acquire()
+        result[pgid] = r
+        lock.release()
+
+threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+sys.stdout.write(json.dumps(result))
+"""
+
 def setup(ctx, config):
     """
     Setup peering test on remotes.
@@ -36,10 +100,90 @@ def setup(ctx, config):
         config.create_threads)
     log.info("done populating pool")
 
+def osdmap_epoch(ctx):
+    """
+    Current osdmap epoch
+    """
+    out = ctx.manager.raw_cluster_cmd('osd', 'dump', '--format=json')
+    return json.loads('\n'.join(out.split('\n')[1:]))['epoch']
+
+
+def query_pgs(ctx, config):
+    """
+    Query every pg of the test pool from the mon.
+
+    :returns: dict of pgid to the fields printed by QUERY_SCRIPT
+    """
+    prefix = '%d.' % ctx.manager.get_pool_num(POOLNAME)
+    pgids = [pg['pgid'] for pg in ctx.manager.get_pg_stats()
+             if pg['pgid'].startswith(prefix)]
+    proc = ctx.manager.controller.run(
+        args=['python', '-c', QUERY_SCRIPT, json.dumps(pgids),
+              str(config.query_concurrency)],
+        stdout=StringIO(),
+        )
+    return json.loads(proc.stdout.getvalue())
+
+
+def _parse_time(stamp):
+    return datetime.datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S.%f')
+
+
+def peering_durations(queries, since_epoch):
+    """
+    How long each pg that started a new interval after ``since_epoch``
+    took to go from Started to Active, from its primary's timestamps.
+
+    :returns: dict of pgid to (seconds, primary osd)
+    """
+    durations = {}
+    for pgid, q in queries.iteritems():
+        if 'error' in q:
+            log.warning('pg %s query failed: %s', pgid, q['error'])
+            continue
+        if not q['started'] or not q['active'] or \
+                q['same_interval_since'] is None or \
+                q['same_interval_since'] <= since_epoch:
+            continue
+        elapsed = _parse_time(q['active']) - _parse_time(q['started'])
+        seconds = elapsed.days * 86400 + elapsed.seconds + \
+            elapsed.microseconds / 1e6
+        durations[pgid] = (seconds, q['acting'][0] if q['acting'] else None)
+    return durations
+
+
+def summarize_peering(durations, outlier_factor):
+    """
+    Distribution of per-pg peering durations, the outlier pgs (slower
+    than outlier_factor times the median), and the durations grouped by
+    primary osd.
+    """
+    summary = summarize([d for d, _ in durations.itervalues()])
+    if not durations:
+        return {'duration': summary}
+    threshold = summary['p50'] * outlier_factor
+    outliers = sorted(
+        ({'pgid': pgid, 'time': d, 'primary': primary}
+         for pgid, (d, primary) in durations.iteritems() if d > threshold),
+        key=lambda o: -o['time'])
+    by_primary = {}
+    for d, primary in durations.itervalues():
+        by_primary.setdefault(primary, []).append(d)
+    return {
+        'duration': summary,
+        'outliers': outliers,
+        'by_primary': dict(
+            ('osd.%s' % primary, summarize(ds, percentiles=[50]))
+            for primary, ds in by_primary.iteritems()),
+        }
+
+
 def do_run(ctx, config):
     """
     Perform the test.
     """
+    if config.pg_timings:
+        epoch = osdmap_epoch(ctx)
     start = time.time()
     # mark in osd
     ctx.manager.mark_in_osd(0)
@@ -53,6 +197,17 @@ def do_run(ctx, config):
         cleanup = True)
     peering_end = time.time()
 
+    peering = None
+    if config.pg_timings:
+        peering = summarize_peering(
+            peering_durations(query_pgs(ctx, config), epoch),
+            config.outlier_factor)
+        log.info('per-pg peering: %s, %d outliers',
+                 peering['duration'], len(peering.get('outliers', [])))
+        for outlier in peering.get('outliers', []):
+            log.info('slow peering: pg %s took %.3fs, primary osd.%s',
+                     outlier['pgid'], outlier['time'], outlier['primary'])
+
     log.info("peering done, waiting on recovery")
     ctx.manager.wait_for_clean()
 
@@ -62,15 +217,34 @@ def do_run(ctx, config):
         assert(peering_end - start < config.max_time)
     ctx.manager.mark_out_osd(0)
     ctx.manager.wait_for_clean()
-    return {
+    result = {
         'time_to_active': peering_end - start,
         'time_to_clean': recovery_end - start
         }
+    if peering is not None:
+        result['peering'] = peering
+    return result
 
 @argify("peering_speed_test", ARGS)
 def task(ctx, config):
     """
     Peering speed test
+
+    Each run marks osd.0 in and times how long it takes for one object
+    per pg to be written (time_to_active) and for the cluster to be
+    clean again (time_to_clean).
+
+    With pg_timings: 1, each run also queries every pg of the test pool
+    and reports the distribution of the time the pgs that re-peered took
+    from Started to Active, the outliers (slower than outlier_factor
+    times the median) and the durations grouped by primary osd, to tell
+    a uniformly slow peering from a long tail on some osds.  Only pgs
+    whose current interval began after the osdmap epoch seen at the start
+    of the run are counted, so those that did not re-peer are left out.
+
+    ctx.summary['recovery_times'] has the results of every run and
+    ctx.summary['peering_speed_test'] their distribution across runs, for
+    perf_regression.
     """
     setup(ctx, config)
     ctx.manager.mark_out_osd(0)
@@ -84,3 +258,11 @@ def task(ctx, config):
     ctx.summary['recovery_times'] = {
         'runs': ret
         }
+    ctx.summary['peering_speed_test'] = {
+        'active_seconds': summarize([r['time_to_active'] for r in ret]),
+        'clean_seconds': summarize([r['time_to_clean'] for r in ret]),
+        }
+    if config.pg_timings:
+        ctx.summary['peering_speed_test']['pg_median_peering_duration'] = summarize(
+            [r['peering']['duration'].get('p50') for r in ret
+             if r['peering']['duration']['count']])
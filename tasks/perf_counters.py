@@ -0,0 +1,238 @@
+"""
+Periodically collect daemon perf counters through their admin sockets
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+
+import gevent
+import yaml
+from teuthology.orchestra import run
+from teuthology.orchestra.run import CommandFailedError
+
+from util.perf_counters import SCRAPER_SCRIPT, interval_values
+
+log = logging.getLogger(__name__)
+
+DAEMON_TYPES = ['mon', 'osd', 'mds', 'rgw']
+
+# Collected unless the task config lists its own counters
+DEFAULT_COUNTERS = [
+    'osd.op',
+    'osd.op_r',
+    'osd.op_w',
+    'osd.op_latency',
+    'osd.op_r_latency',
+    'osd.op_w_latency',
+    'osd.subop_w_latency',
+    'osd.recovery_ops',
+    'osd.numpg',
+    'filestore.journal_queue_ops',
+    'filestore.journal_queue_bytes',
+    'filestore.journal_latency',
+    'filestore.apply_latency',
+    'filestore.commitcycle_latency',
+    'mon.num_sessions',
+    'mon.election_call',
+    'paxos.commit_latency',
+    'mds.request',
+    'mds.reply_latency',
+    'mds.inodes',
+    'mds_log.ev',
+    ]
+
+
+class PerfSeries(object):
+    """
+    Per-interval values of one daemon's counters (see
+    util.perf_counters.interval_values), with the most recent ``history``
+    intervals kept in memory and running means and peaks for the whole run.
+    """
+    def __init__(self, name, history):
+        self.name = name
+        self.types = {}
+        self.recent = collections.deque(maxlen=history)
+        self.totals = {}
+        self._last = None
+
+    def add(self, t, counters):
+        """
+        Add a raw sample taken at time ``t``.
+
+        :returns: the values for the interval since the previous sample, or
+                  None for the first sample
+        """
+        last, self._last = self._last, (t, counters)
+        if last is None:
+            return None
+        values = interval_values(last[1], counters, t - last[0], self.types)
+        self.recent.append((t, values))
+        for name, value in values.iteritems():
+            count, total, peak = self.totals.get(name, (0, 0.0, value))
+            self.totals[name] = (count + 1, total + value, max(peak, value))
+        return values
+
+    def summary(self):
+        return dict(
+            (name, {'mean': total / count, 'max': peak})
+            for name, (count, total, peak) in self.totals.iteritems()
+            )
+
+
+class HostScraper(object):
+    """
+    The scraper process on one host, feeding a PerfSeries per daemon.
+    Interval values are appended to <archive_dir>/<daemon>.json if an
+    archive_dir is given.
+    """
+    def __init__(self, remote, sockets, counters, interval, history,
+                 archive_dir=None):
+        self.remote = remote
+        self.series = dict((name, PerfSeries(name, history)) for name in sockets)
+        self.files = {}
+        if archive_dir is not None:
+            for name in sockets:
+                self.files[name] = file(
+                    os.path.join(archive_dir, name + '.json'), 'w')
+        self.proc = remote.run(
+            args=['sudo', 'python', '-c', SCRAPER_SCRIPT, str(interval),
+                  json.dumps(sockets), json.dumps(counters)],
+            logger=log.getChild(remote.shortname),
+            stdin=run.PIPE,
+            stdout=run.PIPE,
+            wait=False,
+            )
+        self._reader = gevent.spawn(self._read_samples)
+
+    def _read_samples(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            msg = json.loads(line)
+            for name, types in msg.get('schema', {}).iteritems():
+                self.series[name].types = types
+            for name, counters in msg.get('d', {}).iteritems():
+                values = self.series[name].add(msg['t'], counters)
+                if values is not None and name in self.files:
+                    self.files[name].write(
+                        json.dumps({'t': msg['t'], 'values': values}) + '\n')
+
+    def stop(self):
+        if not self.proc.finished:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait()
+            except CommandFailedError:
+                log.exception('Scraper on %s failed', self.remote.shortname)
+        self._reader.join()
+        for f in self.files.itervalues():
+            f.close()
+
+
+class PerfCounterCollector(object):
+    """
+    All the hosts' scrapers.  Available to later tasks as
+    ctx.perf_counters, e.g. to look at recent() values while they run.
+    """
+    def __init__(self, scrapers):
+        self.scrapers = scrapers
+
+    def series(self):
+        """
+        :returns: dict of daemon name to PerfSeries
+        """
+        result = {}
+        for scraper in self.scrapers:
+            result.update(scraper.series)
+        return result
+
+    def recent(self, name):
+        """
+        :returns: list of (time, values) for the daemon's recent intervals
+        """
+        return list(self.series()[name].recent)
+
+    def stop(self):
+        for scraper in self.scrapers:
+            scraper.stop()
+
+    def summary(self):
+        return dict((name, series.summary())
+                    for name, series in self.series().iteritems())
+
+
+def admin_sockets_by_host(ctx):
+    """
+    :returns: dict of remote to dict of daemon name to admin socket path
+    """
+    hosts = {}
+    for type_ in DAEMON_TYPES:
+        for daemon in ctx.daemons.iter_daemons_of_role(type_):
+            name = daemon.id_ if type_ == 'rgw' else \
+                '{type}.{id}'.format(type=type_, id=daemon.id_)
+            hosts.setdefault(daemon.remote, {})[name] = \
+                '/var/run/ceph/ceph-{name}.asok'.format(name=name)
+    return hosts
+
+
+@contextlib.contextmanager
+def task(ctx, config):
+    """
+    Collect the perf counters of every mon, osd, mds and radosgw daemon
+    started by earlier tasks, for the duration of the tasks that follow.
+    Each host runs a single process that polls all of its daemons' admin
+    sockets every interval.
+
+    Each interval is reduced to a value per counter: the mean for
+    averaged counters such as latencies, the rate per second for
+    counters, and the value itself for gauges.  These time series are
+    written to perf_counters/<daemon>.json in the archive, the mean and
+    max of each counter over the run to ctx.summary['perf_counters'], and
+    the latest intervals are available to other tasks through
+    ctx.perf_counters.
+
+    For example::
+
+        tasks:
+        - ceph:
+        - perf_counters:
+            interval: 5       # seconds, default 10
+            history: 120      # intervals kept in memory, default 360
+            counters:         # section.counter or whole sections,
+            - osd.op_w_latency  # default DEFAULT_COUNTERS
+            - filestore
+        - radosbench:
+            clients: [client.0]
+
+    :param ctx: Context
+    :param config: Configuration
+    """
+    if config is None:
+        config = {}
+    assert isinstance(config, dict), \
+        "task perf_counters only supports a dictionary for configuration"
+
+    archive_dir = None
+    if ctx.archive is not None:
+        archive_dir = os.path.join(ctx.archive, 'perf_counters')
+        os.makedirs(archive_dir)
+
+    scrapers = [
+        HostScraper(remote, sockets,
+                    config.get('counters', DEFAULT_COUNTERS),
+                    config.get('interval', 10),
+                    config.get('history', 360),
+                    archive_dir)
+        for remote, sockets in admin_sockets_by_host(ctx).iteritems()
+        ]
+    ctx.perf_counters = PerfCounterCollector(scrapers)
+
+    try:
+        yield
+    finally:
+        ctx.perf_counters.stop()
+        ctx.summary['perf_counters'] = ctx.perf_counters.summary()
+        if archive_dir is not None:
+            with file(os.path.join(ctx.archive, 'perf_counters.yaml'), 'w') as f:
+                yaml.safe_dump(ctx.summary['perf_counters'], f,
+                               default_flow_style=False)
@@ -0,0 +1,114 @@
+"""
+Fail a job whose benchmark results are worse than a stored baseline
+"""
+import contextlib
+import logging
+
+from util import baseline
+
+log = logging.getLogger(__name__)
+
+# Tasks whose results in ctx.summary[<task>] are checked by default
+DEFAULT_TASKS = [
+    'radosbench',
+    'omapbench',
+    'recovery_bench',
+    'peering_speed_test',
+    'cephfs_mdbench',
+    ]
+
+
+def task_config(ctx, name):
+    """
+    The config of the first instance of task ``name`` in the job.
+    """
+    for entry in ctx.config.get('tasks', []):
+        if name in entry:
+            return entry[name]
+    return None
+
+
+@contextlib.contextmanager
+def task(ctx, config):
+    """
+    Compare the results of the benchmark tasks in this job with a baseline
+    file, and mark the job failed if any throughput dropped or latency rose
+    beyond the allowed tolerance.
+
+    The baseline file (YAML or JSON, on the machine running teuthology)
+    holds, for each benchmark task, config and machine type, a list of
+    values from previous runs for each metric.  A metric regresses if it
+    is worse than the mean of those values by more than ``tolerance`` (a
+    fraction, default 0.1) and, when there are several values, by more
+    than ``max_sigma`` standard deviations (default 3).  Only metrics that
+    are clearly throughputs or latencies, judged by their names, are
+    compared.
+
+    With ``record: true``, this run's results are added to the baseline
+    instead, so a baseline can be built from a few runs of the same job.
+
+    Put this task before the benchmarks, since it does the comparison as
+    it finishes, after the tasks that follow it::
+
+        tasks:
+        - ceph:
+        - perf_regression:
+            baseline: /home/teuthworker/baselines/rados.yaml
+            tasks: [radosbench]    # default: all known benchmarks
+            tolerance: 0.1
+            max_sigma: 3
+            tolerances:            # per metric overrides, fnmatch patterns
+              '*latency*': 0.25
+            record: false
+        - radosbench:
+            clients: [client.0]
+            time: 60
+
+    The comparisons are stored in ctx.summary['perf_regression'].
+
+    :param ctx: Context
+    :param config: Configuration
+    """
+    assert isinstance(config, dict) and 'baseline' in config, \
+        "task perf_regression needs a baseline file"
+    machine_type = ctx.config.get('machine_type', 'unknown')
+
+    try:
+        yield
+    finally:
+        baselines = baseline.load(config['baseline'])
+        regressions = []
+        report = {}
+        for name in config.get('tasks', DEFAULT_TASKS):
+            if name not in ctx.summary:
+                continue
+            key = baseline.baseline_key(name, task_config(ctx, name), machine_type)
+            current = baseline.flatten(ctx.summary[name])
+            if config.get('record', False):
+                log.info('Recording %s results in baseline %s', name, key)
+                baseline.record(baselines, key, current,
+                                config.get('max_samples', 10))
+                continue
+            if key not in baselines:
+                log.warning('No baseline %s for %s', key, name)
+                continue
+            comparisons = baseline.compare_all(
+                current, baselines[key],
+                tolerance=config.get('tolerance', 0.1),
+                max_sigma=config.get('max_sigma', 3),
+                overrides=config.get('tolerances', {}))
+            report[name] = comparisons
+            log.info('%s against baseline %s:\n%s', name, key,
+                     baseline.format_diff(comparisons))
+            regressions.extend(
+                '%s %s' % (name, c['metric']) for c in comparisons if c['regression'])
+
+        if config.get('record', False):
+            baseline.save(config['baseline'], baselines)
+        ctx.summary['perf_regression'] = report
+        if regressions:
+            log.error('Performance regressions: %s', ', '.join(regressions))
+            ctx.summary['success'] = False
+            if 'failure_reason' not in ctx.summary:
+                ctx.summary['failure_reason'] = \
+                    'performance regression in ' + ', '.join(regressions)
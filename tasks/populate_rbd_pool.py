@@ -1,13 +1,120 @@
 """
 Populate rbd pools
 """
+from cStringIO import StringIO
+
 import contextlib
+import json
 import logging
-from ceph_manager import CephManager
-from teuthology import misc as teuthology
+import time
+
+from gevent.queue import Queue, Empty
+
+from teuthology.parallel import parallel
 
 log = logging.getLogger(__name__)
 
+
+class Populator(object):
+    """
+    Images waiting to be populated, shared by all the clients, and what
+    has been done so far.
+    """
+    def __init__(self, ctx, config):
+        self.ctx = ctx
+        self.image_size = config.get("image_size", 100)
+        self.num_snaps = config.get("num_snaps", 4)
+        self.write_size = config.get("write_size", 1024*1024)
+        self.write_threads = config.get("write_threads", 10)
+        self.write_total_per_snap = config.get("write_total_per_snap", 1024*1024*30)
+        self.images = Queue()
+        self.done = []
+
+    def run_client(self, client, at_once):
+        """
+        Populate images from ``client``, ``at_once`` at a time, until
+        there are none left.  If one fails, the others are stopped.
+        """
+        (remote,) = self.ctx.cluster.only(client).remotes.iterkeys()
+        with parallel() as p:
+            for _ in range(at_once):
+                p.spawn(self._worker, remote)
+
+    def _worker(self, remote):
+        while True:
+            try:
+                poolname, imagename = self.images.get_nowait()
+            except Empty:
+                return
+            self.populate_image(remote, poolname, imagename)
+
+    def bench_run(self, remote, poolname, imagename):
+        remote.run(
+            args = [
+                "rbd",
+                "bench-write",
+                imagename,
+                "--pool", poolname,
+                "--io-size", str(self.write_size),
+                "--io-threads", str(self.write_threads),
+                "--io-total", str(self.write_total_per_snap),
+                "--io-pattern", "rand"])
+
+    def populate_image(self, remote, poolname, imagename):
+        """
+        Create an image, write to it, then alternately snapshot and write
+        num_snaps times.
+        """
+        log.info("Creating imagename %s/%s" % (poolname, imagename))
+        remote.run(
+            args = [
+                "rbd",
+                "create",
+                imagename,
+                "--image-format", "1",
+                "--size", str(self.image_size),
+                "--pool", str(poolname)])
+        log.info("imagename %s/%s first bench" % (poolname, imagename))
+        self.bench_run(remote, poolname, imagename)
+        for snapid in range(self.num_snaps):
+            snapname = "snap-%s" % (str(snapid),)
+            log.info("imagename %s/%s creating snap %s" % (poolname, imagename, snapname))
+            remote.run(
+                args = [
+                    "rbd", "snap", "create",
+                    "--pool", poolname,
+                    "--snap", snapname,
+                    imagename
+                    ])
+            self.bench_run(remote, poolname, imagename)
+        self.done.append((poolname, imagename))
+
+
+def verify(remote, pools, num_images, num_snaps):
+    """
+    Check that every image and snapshot exists.
+
+    :returns: list of the missing images and snapshots
+    """
+    missing = []
+    for poolname in pools:
+        proc = remote.run(
+            args=["rbd", "ls", "-l", "--format", "json", "--pool", poolname],
+            stdout=StringIO())
+        found = set()
+        for entry in json.loads(proc.stdout.getvalue() or '[]'):
+            found.add((entry['image'], entry.get('snapshot')))
+        for imageid in range(num_images):
+            imagename = "rbd-%s" % (str(imageid),)
+            for snapname in [None] + ["snap-%s" % (str(snapid),)
+                                      for snapid in range(num_snaps)]:
+                if (imagename, snapname) not in found:
+                    missing.append('%s/%s%s' % (
+                        poolname, imagename,
+                        '@' + snapname if snapname else ''))
+    return missing
+
+
 @contextlib.contextmanager
 def task(ctx, config):
     """
@@ -23,61 +130,62 @@ def task(ctx, config):
           num_images: 10
           num_snaps: 3
           image_size: 10737418240
+
+    To populate faster, give a list of clients instead, and the number
+    of images each of them works on at once::
+
+        populate_rbd_pool:
+          clients: [client.0, client.1]
+          parallel: 4
+          ...
+
+    Each image is created, written to and snapshotted in turn by one
+    client, while the other images are populated alongside it.  Once all
+    are done, every image and snapshot is checked to exist, and the
+    populate rate is stored in ctx.summary['populate_rbd_pool'].
     """
     if config is None:
         config = {}
-    client = config.get("client", "client.0")
+    clients = config.get("clients", [config.get("client", "client.0")])
+    at_once = config.get("parallel", 1)
     pool_prefix = config.get("pool_prefix", "foo")
     num_pools = config.get("num_pools", 2)
     num_images = config.get("num_images", 20)
-    num_snaps = config.get("num_snaps", 4)
-    image_size = config.get("image_size", 100)
-    write_size = config.get("write_size", 1024*1024)
-    write_threads = config.get("write_threads", 10)
-    write_total_per_snap = config.get("write_total_per_snap", 1024*1024*30)
-
-    (remote,) = ctx.cluster.only(client).remotes.iterkeys()
 
+    populator = Populator(ctx, config)
+    pools = []
     for poolid in range(num_pools):
         poolname = "%s-%s" % (pool_prefix, str(poolid))
         log.info("Creating pool %s" % (poolname,))
         ctx.manager.create_pool(poolname)
+        pools.append(poolname)
         for imageid in range(num_images):
-            imagename = "rbd-%s" % (str(imageid),)
-            log.info("Creating imagename %s" % (imagename,))
-            remote.run(
-                args = [
-                    "rbd",
-                    "create",
-                    imagename,
-                    "--image-format", "1",
-                    "--size", str(image_size),
-                    "--pool", str(poolname)])
-            def bench_run():
-                remote.run(
-                    args = [
-                        "rbd",
-                        "bench-write",
-                        imagename,
-                        "--pool", poolname,
-                        "--io-size", str(write_size),
-                        "--io-threads", str(write_threads),
-                        "--io-total", str(write_total_per_snap),
-                        "--io-pattern", "rand"])
-            log.info("imagename %s first bench" % (imagename,))
-            bench_run()
-            for snapid in range(num_snaps):
-                snapname = "snap-%s" % (str(snapid),)
-                log.info("imagename %s creating snap %s" % (imagename, snapname))
-                remote.run(
-                    args = [
-                        "rbd", "snap", "create",
-                        "--pool", poolname,
-                        "--snap", snapname,
-                        imagename
-                        ])
-                bench_run()
-            
+            populator.images.put((poolname, "rbd-%s" % (str(imageid),)))
+
+    start = time.time()
+    with parallel() as p:
+        for client in clients:
+            p.spawn(populator.run_client, client, at_once)
+    elapsed = time.time() - start
+
+    images = len(populator.done)
+    written = images * (populator.num_snaps + 1) * populator.write_total_per_snap
+    summary = {
+        'images': images,
+        'snaps': images * populator.num_snaps,
+        'elapsed': elapsed,
+        'images_per_sec': images / elapsed if elapsed else None,
+        'mb_sec': written / 1024.0 / 1024.0 / elapsed if elapsed else None,
+        }
+    log.info('populated %d images in %.1fs: %s', images, elapsed, summary)
+    ctx.summary['populate_rbd_pool'] = summary
+
+    (remote,) = ctx.cluster.only(clients[0]).remotes.iterkeys()
+    missing = verify(remote, pools, num_images, populator.num_snaps)
+    if missing:
+        raise RuntimeError('missing rbd images or snapshots: %s' %
+                           ', '.join(missing))
+
     try:
         yield
     finally:
@@ -1,14 +1,128 @@
 """
 Rados benchmarking
 """
+from cStringIO import StringIO
+
 import contextlib
+import itertools
 import logging
+import os
+
+import gevent
 
 from teuthology.orchestra import run
 from teuthology import misc as teuthology
+from util import rados_bench
 
 log = logging.getLogger(__name__)
 
+READ_PHASES = ['seq', 'rand']
+
+
+def start_bench(ctx, role, pool, seconds, mode, block_size=None,
+                concurrency=None, no_cleanup=False, run_name=None):
+    """
+    Start one 'rados bench' run on the client ``role``.  The objects of
+    a write run kept for reads are found by ``run_name``, so clients
+    sharing a pool must each use their own.
+
+    :returns: the remote process, with its output in proc.stdout
+    """
+    testdir = teuthology.get_testdir(ctx)
+    id_ = role[len('client.'):]
+    (remote,) = ctx.cluster.only(role).remotes.iterkeys()
+    args = ['adjust-ulimits',
+            'ceph-coverage',
+            '{tdir}/archive/coverage',
+            'rados',
+            '--name', role,
+            '-p' , pool,
+            ]
+    if block_size is not None:
+        args.extend(['-b', str(block_size)])
+    if concurrency is not None:
+        args.extend(['-t', str(concurrency)])
+    args.extend(['bench', str(seconds), mode])
+    if run_name is not None:
+        args.extend(['--run-name', run_name])
+    if no_cleanup:
+        args.append('--no-cleanup')
+    return remote.run(
+        args=[
+            "/bin/sh", "-c",
+            " ".join(args).format(tdir=testdir),
+            ],
+        logger=log.getChild('radosbench.{id}'.format(id=id_)),
+        stdin=run.PIPE,
+        stdout=StringIO(),
+        wait=False
+        )
+
+
+def cleanup_bench(ctx, role, pool, run_name):
+    """
+    Remove the objects left by 'rados bench write --no-cleanup' in the
+    run ``run_name``.
+    """
+    (remote,) = ctx.cluster.only(role).remotes.iterkeys()
+    proc = remote.run(
+        args=['rados', '--name', role, '-p', pool, 'cleanup',
+              '--run-name', run_name],
+        check_status=False,
+        )
+    if proc.exitstatus != 0:
+        log.warning('rados cleanup of pool %s failed', pool)
+
+
+def _run_name(role):
+    return 'radosbench.{role}'.format(role=role)
+
+
+def run_phases(ctx, config, pools, runs):
+    """
+    Run every phase at every point of the block size and concurrency
+    sweep, each phase on all clients at once, appending a dict describing
+    each phase's results to ``runs`` as it completes.
+
+    :param pools: dict of client role to the pool it uses
+    """
+    phases = config.get('phases', ['write'])
+    read_phases = [phase for phase in phases if phase in READ_PHASES]
+    seconds = config.get('time', 360)
+    sweep = itertools.product(config.get('block_sizes', [None]),
+                              config.get('concurrency', [None]))
+    for block_size, concurrency in sweep:
+        for phase in phases:
+            log.info('radosbench %s, block size %s, concurrency %s',
+                     phase, block_size or 'default', concurrency or 'default')
+            procs = dict(
+                (role, start_bench(ctx, role, pool, seconds, phase,
+                                   block_size, concurrency,
+                                   no_cleanup=(phase == 'write' and
+                                               bool(read_phases)),
+                                   run_name=_run_name(role)))
+                for role, pool in pools.iteritems())
+            run.wait(procs.itervalues())
+
+            results = {}
+            for role, proc in procs.iteritems():
+                output = proc.stdout.getvalue()
+                log.debug('%s output:\n%s', role, output)
+                results[role] = rados_bench.parse_output(output)
+            point = {
+                'phase': phase,
+                'block_size': block_size,
+                'concurrency': concurrency,
+                }
+            total = rados_bench.aggregate(results)
+            log.info('radosbench %s: %s', point, total)
+            runs.append(dict(point, results=results, total=total))
+
+        if read_phases:
+            for role, pool in pools.iteritems():
+                cleanup_bench(ctx, role, pool, _run_name(role))
+
+
 @contextlib.contextmanager
 def task(ctx, config):
     """
@@ -18,7 +132,7 @@ def task(ctx, config):
 
     radosbench:
         clients: [client list]
-        time: <seconds to run>
+        time: <seconds to run each phase>
         pool: <pool to use>
         unique_pool: use a unique pool, defaults to False
         ec_pool: create an ec pool, defaults to False
@@ -27,6 +141,24 @@ def task(ctx, config):
           k: 2
           m: 1
           ruleset-failure-domain: osd
+        phases: [write, seq, rand], defaults to [write]
+        block_sizes: [object sizes in bytes for -b]
+        concurrency: [concurrent ops for -t]
+
+    The phases run one after another, each on all the clients at once.
+    When there are read phases (seq, rand), the write phase keeps its
+    objects for them and they are removed after the last phase.  The
+    phases are repeated for every combination of block size and
+    concurrency, so that one job can measure throughput against object
+    size.  Each client benches under a run name of its own, so clients
+    sharing a pool read back, and remove, only their own objects.
+
+    Each client's output is parsed (see util.rados_bench).  For every
+    phase of every combination, the results of all clients and their
+    aggregate (total bandwidth and IOPS, spread of bandwidth between
+    clients, percentiles of the per-second latencies) are stored in
+    ctx.summary['radosbench'], and the per-second figures in
+    radosbench.csv in the archive.
 
     example:
 
@@ -36,20 +168,30 @@ def task(ctx, config):
         clients: [client.0]
         time: 360
     - interactive:
+
+    To sweep reads and writes over object sizes:
+
+    tasks:
+    - ceph:
+    - radosbench:
+        clients: [client.0, client.1]
+        time: 60
+        phases: [write, seq, rand]
+        block_sizes: [4096, 65536, 4194304]
+        concurrency: [16]
     """
     log.info('Beginning radosbench...')
     assert isinstance(config, dict), \
         "please list clients to run on"
-    radosbench = {}
-
-    testdir = teuthology.get_testdir(ctx)
+    for phase in config.get('phases', ['write']):
+        assert phase in ['write'] + READ_PHASES, \
+            'unknown radosbench phase %s' % phase
 
+    pools = {}
     for role in config.get('clients', ['client.0']):
         assert isinstance(role, basestring)
         PREFIX = 'client.'
         assert role.startswith(PREFIX)
-        id_ = role[len(PREFIX):]
-        (remote,) = ctx.cluster.only(role).remotes.iterkeys()
 
         if config.get('ec_pool', False):
             profile = config.get('erasure_code_profile', {})
@@ -61,35 +203,48 @@ def task(ctx, config):
         pool = 'data'
         if config.get('pool'):
             pool = config.get('pool')
-            if pool is not 'data':
+            if pool != 'data' and pool not in pools.values():
                 ctx.manager.create_pool(pool, erasure_code_profile_name=profile_name)
         else:
             pool = ctx.manager.create_pool_with_unique_name(erasure_code_profile_name=profile_name)
+        pools[role] = pool
 
-        proc = remote.run(
-            args=[
-                "/bin/sh", "-c",
-                " ".join(['adjust-ulimits',
-                          'ceph-coverage',
-                          '{tdir}/archive/coverage',
-                          'rados',
-                          '--name', role,
-                          '-p' , pool,
-                          'bench', str(config.get('time', 360)), 'write',
-                          ]).format(tdir=testdir),
-                ],
-            logger=log.getChild('radosbench.{id}'.format(id=id_)),
-            stdin=run.PIPE,
-            wait=False
-            )
-        radosbench[id_] = proc
+    runs = []
+    bench = gevent.spawn(run_phases, ctx, config, pools, runs)
 
     try:
         yield
     finally:
-        timeout = config.get('time', 360) * 5
-        log.info('joining radosbench (timing out after %ss)', timeout)
-        run.wait(radosbench.itervalues(), timeout=timeout)
+        try:
+            npoints = len(config.get('block_sizes', [None])) * \
+                len(config.get('concurrency', [None]))
+            timeout = config.get('time', 360) * 5 * \
+                len(config.get('phases', ['write'])) * npoints
+            log.info('joining radosbench (timing out after %ss)', timeout)
+            bench.join(timeout=timeout)
+            if not bench.ready():
+                bench.kill()
+                raise RuntimeError('radosbench timed out after %ss' % timeout)
+            bench.get()
+        finally:
+            for pool in set(pools.itervalues()):
+                if pool != 'data':
+                    ctx.manager.remove_pool(pool)
 
-        if pool is not 'data':
-            ctx.manager.remove_pool(pool)
+        ctx.summary['radosbench'] = [
+            {
+                'phase': r['phase'],
+                'block_size': r['block_size'],
+                'concurrency': r['concurrency'],
+                'clients': dict((role, result['summary'])
+                                for role, result in r['results'].iteritems()),
+                'total': r['total'],
+            }
+            for r in runs
+            ]
+        if ctx.archive is not None:
+            rados_bench.write_csv(
+                os.path.join(ctx.archive, 'radosbench.csv'),
+                [(dict(phase=r['phase'], block_size=r['block_size'],
+                       concurrency=r['concurrency']), r['results'])
+                 for r in runs])
@@ -12,17 +12,37 @@ import time
 
 import ceph_manager
 from teuthology import misc as teuthology
+from util.stats import percentile_key, summarize
 
 log = logging.getLogger(__name__)
 
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Recovery figures sampled from the pgmap in the cluster status
+RECOVERY_RATE_KEYS = ['recovering_objects_per_sec', 'recovering_bytes_per_sec']
+RECOVERY_KEYS = RECOVERY_RATE_KEYS + ['degraded_objects']
+
 @contextlib.contextmanager
 def task(ctx, config):
     """
     Benchmark the recovery system.
 
     Generates objects with smalliobench, runs it normally to get a
-    baseline performance measurement, then marks an OSD out and reruns
-    to measure performance during recovery.
+    baseline performance measurement, then reruns it during recovery
+    for each scenario in turn, waiting for the cluster to be clean again
+    between scenarios.  The scenarios are:
+
+    out: mark an OSD out (the default)
+    kill: kill an OSD and mark it down and out
+    host_out: mark all the OSDs of another host out (needs OSDs on at
+              least two hosts)
+    new_osd: empty an OSD, then bring it back in, so that it is
+             backfilled like a newly added OSD
+
+    The client latency percentiles of each op type, and the recovery rate
+    and degraded objects sampled from the cluster status during each run,
+    are stored in ctx.summary['recovery_bench'], one entry per scenario
+    starting with the baseline.
 
     The config should be as follows:
 
@@ -30,6 +50,8 @@ def task(ctx, config):
         duration: <seconds for each measurement run>
         num_objects: <number of objects>
         io_size: <io size in bytes>
+        scenarios: <list of scenarios, default [out]>
+        sample_interval: <seconds between recovery samples, default 5>
 
     example:
 
@@ -68,7 +90,7 @@ def task(ctx, config):
         yield
     finally:
         log.info('joining recovery bencher')
-        bench_proc.do_join()
+        ctx.summary['recovery_bench'] = bench_proc.do_join()
 
 class RecoveryBencher:
     """
@@ -85,13 +107,7 @@ class RecoveryBencher:
         if self.config is None:
             self.config = dict()
 
-        else:
-            def tmp(x):
-                """
-                Local wrapper to print value.
-                """
-                print x
-            self.log = tmp
+        self.results = []
 
         log.info("spawning thread")
 
@@ -101,8 +117,104 @@ class RecoveryBencher:
         """
         Join the recovery bencher.  This is called after the main
         task exits.
+
+        :returns: list of results, one per scenario
         """
         self.thread.get()
+        return self.results
+
+    def osds_on(self, remote):
+        """
+        ids of the osds on a remote
+        """
+        roles = self.ceph_manager.ctx.cluster.remotes[remote]
+        return [int(id_) for id_ in teuthology.roles_of_type(roles, 'osd')]
+
+    def run_smalliobench(self, remote, duration, io_size):
+        """
+        Run smalliobench against the objects created by do_bench, sampling
+        recovery progress from the cluster status meanwhile.
+
+        :returns: dict with the latency summary per op type and the
+                  recovery samples
+        """
+        testdir = teuthology.get_testdir(self.ceph_manager.ctx)
+        recovery = []
+        sampler = gevent.spawn(self.sample_recovery, recovery,
+                               self.config.get('sample_interval', 5))
+        try:
+            p = remote.run(
+                args=[
+                    'adjust-ulimits',
+                    'ceph-coverage',
+                    '{tdir}/archive/coverage'.format(tdir=testdir),
+                    'smalliobench',
+                    '--use-prefix', 'recovery_bench',
+                    '--do-not-init', '1',
+                    '--duration', str(duration),
+                    '--io-size', str(io_size),
+                    ],
+                stdout=StringIO(),
+                stderr=StringIO(),
+                wait=True,
+            )
+        finally:
+            sampler.kill()
+        return {
+            'latency': self.process_samples(p.stderr.getvalue()),
+            'recovery': summarize_recovery(recovery),
+            }
+
+    def sample_recovery(self, samples, interval):
+        """
+        Append the recovery rate and degraded object count from the cluster
+        status to ``samples`` every ``interval`` seconds, until killed.
+        """
+        while True:
+            pgmap = self.ceph_manager.raw_cluster_status().get('pgmap', {})
+            samples.append(dict(
+                (key, pgmap.get(key, 0)) for key in RECOVERY_KEYS))
+            gevent.sleep(interval)
+
+    def disrupt(self, scenario, osd, osd_remote):
+        """
+        Start recovery as described by ``scenario``.
+
+        :returns: function that undoes the disruption
+        """
+        manager = self.ceph_manager
+        if scenario == 'out':
+            manager.mark_out_osd(osd)
+            return lambda: manager.mark_in_osd(osd)
+        if scenario == 'kill':
+            manager.kill_osd(osd)
+            manager.mark_down_osd(osd)
+            manager.mark_out_osd(osd)
+            def restore():
+                manager.revive_osd(osd)
+                manager.mark_in_osd(osd)
+            return restore
+        if scenario == 'host_out':
+            # a host other than the one running the bench; do_bench()
+            # made sure there is one
+            remotes = [r for r in manager.ctx.cluster.only(
+                teuthology.is_type('osd')).remotes.iterkeys()
+                if r != osd_remote]
+            osds = self.osds_on(random.choice(remotes))
+            for o in osds:
+                manager.mark_out_osd(o)
+            def restore():
+                for o in osds:
+                    manager.mark_in_osd(o)
+            return restore
+        if scenario == 'new_osd':
+            # Approximate adding an osd by emptying one and then bringing
+            # it back, so that it is backfilled while we measure
+            manager.mark_out_osd(osd)
+            manager.wait_for_clean()
+            manager.mark_in_osd(osd)
+            return lambda: None
+        raise RuntimeError('unknown recovery_bench scenario %s' % scenario)
 
     def do_bench(self):
         """
@@ -111,8 +223,16 @@ class RecoveryBencher:
         duration = self.config.get("duration", 60)
         num_objects = self.config.get("num_objects", 500)
         io_size = self.config.get("io_size", 4096)
-
-        osd = str(random.choice(self.osds))
+        scenarios = self.config.get("scenarios", ['out'])
+        osd_hosts = self.ceph_manager.ctx.cluster.only(
+            teuthology.is_type('osd')).remotes
+        if 'host_out' in scenarios and len(osd_hosts) < 2:
+            # with every osd out the pgs could never be clean again
+            raise RuntimeError(
+                'recovery_bench scenario host_out needs osds on at least '
+                'two hosts')
+
+        osd = random.choice(self.osds)
         (osd_remote,) = self.ceph_manager.ctx.cluster.only('osd.%s' % osd).remotes.iterkeys()
 
         testdir = teuthology.get_testdir(self.ceph_manager.ctx)
@@ -134,75 +254,66 @@ class RecoveryBencher:
 
         # baseline bench
         log.info('non-recovery (baseline)')
-        p = osd_remote.run(
-            args=[
-                'adjust-ulimits',
-                'ceph-coverage',
-                '{tdir}/archive/coverage'.format(tdir=testdir),
-                'smalliobench',
-                '--use-prefix', 'recovery_bench',
-                '--do-not-init', '1',
-                '--duration', str(duration),
-                '--io-size', str(io_size),
-                ],
-            stdout=StringIO(),
-            stderr=StringIO(),
-            wait=True,
-        )
-        self.process_samples(p.stderr.getvalue())
-
-        self.ceph_manager.raw_cluster_cmd('osd', 'out', osd)
-        time.sleep(5)
-
-        # recovery bench
-        log.info('recovery active')
-        p = osd_remote.run(
-            args=[
-                'adjust-ulimits',
-                'ceph-coverage',
-                '{tdir}/archive/coverage'.format(tdir=testdir),
-                'smalliobench',
-                '--use-prefix', 'recovery_bench',
-                '--do-not-init', '1',
-                '--duration', str(duration),
-                '--io-size', str(io_size),
-                ],
-            stdout=StringIO(),
-            stderr=StringIO(),
-            wait=True,
-        )
-        self.process_samples(p.stderr.getvalue())
-
-        self.ceph_manager.raw_cluster_cmd('osd', 'in', osd)
+        result = self.run_smalliobench(osd_remote, duration, io_size)
+        self.results.append(dict(result, scenario='baseline'))
+
+        for scenario in scenarios:
+            log.info('recovery active: %s', scenario)
+            restore = self.disrupt(scenario, osd, osd_remote)
+            time.sleep(5)
+            result = self.run_smalliobench(osd_remote, duration, io_size)
+            self.results.append(dict(result, scenario=scenario))
+            restore()
+            self.ceph_manager.wait_for_clean()
 
     def process_samples(self, input):
         """
         Extract samples from the input and process the results
 
         :param input: input lines in JSON format
+        :returns: dict of op type to latency summary (see util.stats)
         """
         lat = {}
+        skipped = 0
         for line in input.split('\n'):
+            if not line.strip():
+                continue
             try:
                 sample = json.loads(line)
+            except ValueError:
+                skipped += 1
+                log.debug('not a latency sample: %s', line)
+                continue
+            try:
                 samples = lat.setdefault(sample['type'], [])
                 samples.append(float(sample['latency']))
-            except Exception:
-                pass
+            except (KeyError, TypeError, ValueError):
+                log.warning('malformed latency sample: %s', line)
+                skipped += 1
+        if skipped:
+            log.info('skipped %d lines of smalliobench output', skipped)
 
+        result = {}
         for type in lat:
-            samples = lat[type]
-            samples.sort()
-
-            num = len(samples)
-
-            # median
-            if num & 1 == 1: # odd number of samples
-                median = samples[num / 2]
-            else:
-                median = (samples[num / 2] + samples[num / 2 - 1]) / 2
+            result[type] = summarize(lat[type], percentiles=PERCENTILES)
+            log.info("%s: %s" % (type, ', '.join(
+                '%s %f' % (key, result[type][key])
+                for key in [percentile_key(p) for p in PERCENTILES] + ['max'])))
+        return result
 
-            # 99%
-            ninety_nine = samples[int(num * 0.99)]
 
-            log.info("%s: median %f, 99%% %f" % (type, median, ninety_nine))
+def summarize_recovery(samples):
+    """
+    Mean and peak recovery rates, and the degraded objects at the first
+    and last samples.
+    """
+    if not samples:
+        return {}
+    result = {'samples': len(samples)}
+    for key in RECOVERY_RATE_KEYS:
+        values = [s[key] for s in samples]
+        result[key] = {'mean': sum(values) / float(len(values)),
+                       'max': max(values)}
+    result['degraded_objects'] = {'first': samples[0]['degraded_objects'],
+                                  'last': samples[-1]['degraded_objects']}
+    return result
@@ -160,10 +160,13 @@ def task(ctx, config):
                             r=remote.name))
 
     log.info('Beginning thrashosds...')
+    if not hasattr(ctx, 'thrash_journal'):
+        ctx.thrash_journal = []
     thrash_proc = ceph_manager.Thrasher(
         ctx.manager,
         config,
-        logger=log.getChild('thrasher')
+        logger=log.getChild('thrasher'),
+        journal=ctx.thrash_journal,
         )
     try:
         yield
@@ -0,0 +1,187 @@
+"""
+Comparison of benchmark results against a stored baseline
+"""
+import fnmatch
+import hashlib
+import json
+import math
+import os
+import re
+
+import yaml
+
+# Entries of a list of results are labelled by these fields, when present,
+# rather than by their position
+LABEL_FIELDS = ['phase', 'scenario', 'name', 'block_size', 'concurrency']
+
+STATISTIC = re.compile(r'^(mean|min|max|avg|median|p[\d.]+)$')
+HIGHER_IS_BETTER = re.compile(r'(bandwidth|iops|mb_sec|per_sec|throughput|rate)')
+LOWER_IS_BETTER = re.compile(r'(^|_)(lat|latency|duration|elapsed|seconds)($|_)')
+
+
+def baseline_key(task, task_config, machine_type):
+    """
+    Key of the baseline for a task run with the given config on the given
+    type of machine.
+    """
+    config_hash = hashlib.sha1(
+        json.dumps(task_config, sort_keys=True)).hexdigest()[:12]
+    return '{task}/{hash}/{machine}'.format(
+        task=task, hash=config_hash, machine=machine_type)
+
+
+def _label(item, index):
+    parts = ['%s=%s' % (f, item[f]) for f in LABEL_FIELDS
+             if f in item and item[f] is not None]
+    return ','.join(parts) or str(index)
+
+
+def flatten(results, prefix=''):
+    """
+    Flatten nested results (as stored in ctx.summary) into a dict of
+    dotted path to number.
+    """
+    metrics = {}
+    if isinstance(results, dict):
+        for key, value in results.iteritems():
+            metrics.update(flatten(value, prefix + str(key) + '.'))
+    elif isinstance(results, list):
+        for index, value in enumerate(results):
+            label = _label(value, index) if isinstance(value, dict) else str(index)
+            metrics.update(flatten(value, prefix + '[' + label + '].'))
+    elif isinstance(results, (int, long, float)) and not isinstance(results, bool):
+        metrics[prefix.rstrip('.')] = results
+    return metrics
+
+
+def direction(path):
+    """
+    :returns: 1 if larger values of the metric are better, -1 if smaller
+              values are better, or None if it is not a performance figure
+    """
+    parts = path.split('.')
+    if STATISTIC.match(parts[-1]):
+        # a statistic of something named further up, e.g.
+        # latency.write.p99
+        names = reversed(parts[:-1])
+    else:
+        names = [parts[-1]]
+    for name in names:
+        if HIGHER_IS_BETTER.search(name):
+            return 1
+        if LOWER_IS_BETTER.search(name):
+            return -1
+    return None
+
+
+def compare(metric, current, samples, tolerance, max_sigma):
+    """
+    Compare one metric with its baseline samples.  It has regressed if it
+    is worse than the baseline mean by more than ``tolerance`` (a fraction)
+    and, when there are several samples that vary, by more than
+    ``max_sigma`` standard deviations.
+
+    :returns: dict describing the comparison, with 'regression' set if the
+              metric regressed
+    """
+    n = len(samples)
+    mean = sum(samples) / float(n)
+    stddev = 0.0
+    if n > 1:
+        stddev = math.sqrt(sum((s - mean) ** 2 for s in samples) / (n - 1))
+    change = (current - mean) / abs(mean) if mean else 0.0
+    worse_by = -change * direction(metric)
+    regression = worse_by > tolerance and \
+        (stddev == 0 or abs(current - mean) > max_sigma * stddev)
+    return {
+        'metric': metric,
+        'current': current,
+        'baseline_mean': mean,
+        'baseline_stddev': stddev,
+        'baseline_samples': n,
+        'change_pct': round(100 * change, 2),
+        'regression': regression,
+        }
+
+
+def tolerance_for(metric, tolerance, overrides):
+    """
+    The tolerance for a metric: that of the first pattern in ``overrides``
+    (dict of fnmatch pattern to tolerance) it matches, or ``tolerance``.
+    """
+    for pattern, value in sorted(overrides.iteritems()):
+        if fnmatch.fnmatch(metric, pattern):
+            return value
+    return tolerance
+
+
+def compare_all(current, baseline, tolerance=0.1, max_sigma=3,
+                overrides=None):
+    """
+    Compare every metric found in both ``current`` (dict of metric to
+    value) and ``baseline`` (dict of metric to list of values) whose
+    direction is known.
+
+    :returns: list of compare() results, sorted by metric
+    """
+    overrides = overrides or {}
+    comparisons = []
+    for metric, value in sorted(current.iteritems()):
+        samples = baseline.get(metric)
+        if not samples or direction(metric) is None:
+            continue
+        comparisons.append(compare(
+            metric, value, samples,
+            tolerance_for(metric, tolerance, overrides), max_sigma))
+    return comparisons
+
+
+def format_diff(comparisons):
+    """
+    Human readable table of comparisons, regressions marked with '!'.
+    """
+    lines = []
+    for c in comparisons:
+        lines.append('{mark} {metric}: {current:.4g} vs {mean:.4g} '
+                     '(+/-{stddev:.2g}, n={n}) {change:+.1f}%'.format(
+                         mark='!' if c['regression'] else ' ',
+                         metric=c['metric'],
+                         current=c['current'],
+                         mean=c['baseline_mean'],
+                         stddev=c['baseline_stddev'],
+                         n=c['baseline_samples'],
+                         change=c['change_pct']))
+    return '\n'.join(lines)
+
+
+def load(path):
+    """
+    Read a baseline file, YAML or JSON, of
+    {key: {metric: [value, ...]}}.  A missing file is an empty baseline.
+    """
+    if not os.path.exists(path):
+        return {}
+    with file(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def save(path, baselines):
+    with file(path, 'w') as f:
+        if path.endswith('.json'):
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        else:
+            yaml.safe_dump(baselines, f, default_flow_style=False)
+
+
+def record(baselines, key, current, max_samples=10):
+    """
+    Add the current values of a run to the baseline, keeping the most
+    recent ``max_samples`` values of each metric.
+    """
+    entry = baselines.setdefault(key, {})
+    for metric, value in current.iteritems():
+        if direction(metric) is None:
+            continue
+        samples = entry.setdefault(metric, [])
+        samples.append(value)
+        del samples[:-max_samples]
@@ -0,0 +1,168 @@
+"""
+Scanning of the cluster log for errors and warnings
+"""
+from cStringIO import StringIO
+import json
+import logging
+
+import gevent
+from gevent.event import Event
+
+log = logging.getLogger(__name__)
+
+# Most severe first
+SEVERITIES = ['SEC', 'ERR', 'WRN']
+
+# Runs on the host with the log.  Reads the log once from the given offset,
+# skipping lines that match any whitelist pattern (compiled into a single
+# regex), and prints counts and the first few lines for each severity, plus
+# the offset to resume from.  A trailing partial line is left for next time.
+SCAN_SCRIPT = r"""
+import json
+import os
+import re
+import sys
+
+path = sys.argv[1]
+offset = int(sys.argv[2])
+patterns = json.loads(sys.argv[3])
+limit = int(sys.argv[4])
+
+def compile_whitelist(patterns):
+    if not patterns:
+        return None
+    try:
+        return re.compile('|'.join('(?:%s)' % p for p in patterns))
+    except re.error:
+        # fall back to matching any pattern python does not understand literally
+        safe = []
+        for p in patterns:
+            try:
+                re.compile(p)
+                safe.append(p)
+            except re.error:
+                safe.append(re.escape(p))
+        return re.compile('|'.join('(?:%s)' % p for p in safe))
+
+severity = re.compile(r'\[(SEC|ERR|WRN)\]')
+whitelist = compile_whitelist(patterns)
+counts = {}
+matches = {}
+
+try:
+    size = os.path.getsize(path)
+except OSError:
+    size = 0
+    offset = 0
+if offset > size:
+    # the log was replaced, start again
+    offset = 0
+
+if size:
+    f = open(path, 'rb')
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        offset += len(line)
+        text = line.decode('utf-8', 'replace').rstrip('\n')
+        m = severity.search(text)
+        if m is None:
+            continue
+        if whitelist is not None and whitelist.search(text):
+            continue
+        sev = m.group(1)
+        counts[sev] = counts.get(sev, 0) + 1
+        lines = matches.setdefault(sev, [])
+        if len(lines) < limit:
+            lines.append(text)
+    f.close()
+
+sys.stdout.write(json.dumps({'offset': offset, 'counts': counts, 'matches': matches}))
+"""
+
+
+class ClusterLogScanner(object):
+    """
+    Incrementally scan a cluster log for [SEC], [ERR] and [WRN] entries
+    that are not whitelisted.  Each scan() only reads what was appended
+    since the previous one, so scanning periodically during a job keeps
+    the scan at teardown short.
+    """
+    def __init__(self, remote, whitelist, path='/var/log/ceph/ceph.log',
+                 max_lines=100):
+        """
+        :param remote: Remote holding the log
+        :param whitelist: list of egrep-style regexes for entries to ignore
+        :param path: path of the log on the remote
+        :param max_lines: how many matching lines to keep per severity
+        """
+        self.remote = remote
+        self.whitelist = list(whitelist)
+        self.path = path
+        self.max_lines = max_lines
+        self.offset = 0
+        self.counts = dict((sev, 0) for sev in SEVERITIES)
+        self.matches = dict((sev, []) for sev in SEVERITIES)
+        self._stop = None
+        self._greenlet = None
+
+    def merge(self, result):
+        """
+        Fold the output of one run of SCAN_SCRIPT into the totals.
+        """
+        if result['offset'] < self.offset:
+            log.warning('%s was truncated, rescanned from the start', self.path)
+        self.offset = result['offset']
+        for sev, count in result['counts'].iteritems():
+            self.counts[sev] += count
+        for sev, lines in result['matches'].iteritems():
+            room = self.max_lines - len(self.matches[sev])
+            self.matches[sev].extend(lines[:max(room, 0)])
+
+    def scan(self):
+        """
+        Scan anything appended to the log since the last scan.
+        """
+        proc = self.remote.run(
+            args=[
+                'sudo', 'python', '-c', SCAN_SCRIPT,
+                self.path, str(self.offset), json.dumps(self.whitelist),
+                str(self.max_lines),
+                ],
+            stdout=StringIO(),
+            )
+        self.merge(json.loads(proc.stdout.getvalue()))
+        return self
+
+    def first(self):
+        """
+        :returns: the first entry of the most severe kind seen, or None
+        """
+        for sev in SEVERITIES:
+            if self.matches[sev]:
+                return self.matches[sev][0]
+        return None
+
+    def _scan_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.scan()
+            except Exception:
+                log.exception('Failed to scan %s, will retry', self.path)
+
+    def start(self, interval):
+        """
+        Start scanning in the background every ``interval`` seconds.
+        """
+        self._stop = Event()
+        self._greenlet = gevent.spawn(self._scan_loop, interval)
+
+    def stop(self):
+        """
+        Stop any background scanning, waiting for a scan in progress.
+        """
+        if self._greenlet is not None:
+            self._stop.set()
+            self._greenlet.join()
+            self._greenlet = None
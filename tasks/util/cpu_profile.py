@@ -0,0 +1,114 @@
+"""
+Collection and aggregation of gperftools CPU profiles (see the ceph
+task's cpu_profile option)
+"""
+from cStringIO import StringIO
+import logging
+import tarfile
+
+log = logging.getLogger(__name__)
+
+PROFILE_DIR = '/var/log/ceph/profiling-logger'
+
+# Runs on each host.  Symbolizes every <type>.<id>.prof in the profile
+# directory against its daemon binary, leaving <type>.<id>.txt (pprof's
+# flat/cumulative listing) and <type>.<id>.collapsed (folded stacks, one
+# "frame;frame;... count" line per stack) beside it, and then writes a tar
+# of the .collapsed files to stdout.
+SYMBOLIZE_SCRIPT = r"""
+cd "$1" || exit 0
+PPROF=$(command -v pprof || command -v google-pprof) || {
+    echo "pprof not found, not symbolizing profiles" >&2
+    exit 0
+}
+for prof in *.prof; do
+    [ -s "$prof" ] || continue
+    name=${prof%.prof}
+    bin=$(command -v ceph-${name%%.*}) || continue
+    $PPROF --text "$bin" "$prof" > "$name.txt" 2>/dev/null
+    $PPROF --collapsed "$bin" "$prof" > "$name.collapsed" 2>/dev/null
+done
+set -- *.collapsed
+[ -e "$1" ] || exit 0
+exec tar -c -f - -- "$@"
+"""
+
+
+def collect(remote, profile_dir=PROFILE_DIR):
+    """
+    Symbolize the profiles on a remote and fetch their folded stacks.
+
+    :returns: dict of daemon name (e.g. 'osd.0') to folded stack text
+    """
+    proc = remote.run(
+        args=['sudo', 'sh', '-c', SYMBOLIZE_SCRIPT, 'symbolize', profile_dir],
+        stdout=StringIO(),
+        )
+    data = proc.stdout.getvalue()
+    if not data:
+        return {}
+    result = {}
+    tar = tarfile.open(mode='r', fileobj=StringIO(data))
+    for member in tar.getmembers():
+        if member.isfile() and member.name.endswith('.collapsed'):
+            result[member.name[:-len('.collapsed')]] = \
+                tar.extractfile(member).read()
+    tar.close()
+    return result
+
+
+def parse_collapsed(text):
+    """
+    :returns: dict of stack (';' separated frames, outermost first) to
+              sample count
+    """
+    stacks = {}
+    for line in text.splitlines():
+        stack, _, count = line.rstrip().rpartition(' ')
+        if not stack:
+            continue
+        try:
+            stacks[stack] = stacks.get(stack, 0) + int(count)
+        except ValueError:
+            log.debug('Ignoring folded stack line %r', line)
+    return stacks
+
+
+def merge(stack_dicts):
+    """
+    Sum several dicts from parse_collapsed().
+    """
+    merged = {}
+    for stacks in stack_dicts:
+        for stack, count in stacks.iteritems():
+            merged[stack] = merged.get(stack, 0) + count
+    return merged
+
+
+def format_collapsed(stacks):
+    """
+    Inverse of parse_collapsed(), suitable for flamegraph.pl.
+    """
+    return ''.join('%s %d\n' % (stack, count)
+                   for stack, count in sorted(stacks.iteritems()))
+
+
+def top_functions(stacks, n=10):
+    """
+    The functions with the most samples of their own (i.e. as the
+    innermost frame).
+
+    :returns: list of dicts with function, samples and percent, hottest first
+    """
+    total = sum(stacks.itervalues())
+    flat = {}
+    for stack, count in stacks.iteritems():
+        leaf = stack.rsplit(';', 1)[-1]
+        flat[leaf] = flat.get(leaf, 0) + count
+    hottest = sorted(flat.iteritems(), key=lambda kv: (-kv[1], kv[0]))[:n]
+    return [
+        {'function': function,
+         'samples': samples,
+         'percent': round(100.0 * samples / total, 2)}
+        for function, samples in hottest
+        ]
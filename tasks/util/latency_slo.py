@@ -0,0 +1,120 @@
+"""
+Client latency probing, and matching of I/O stalls with thrasher actions
+"""
+
+# Runs on a client until EOF on stdin.  Every interval it writes a small
+# object and reads it back through librados, and prints one JSON line per
+# probe with when it started by the client's clock ('t') and how long the
+# write ('w') and read ('r') took, or the error if either failed.  A
+# stalled op blocks the probe, so the stall shows as one long op.
+PROBE_SCRIPT = r"""
+import json
+import select
+import sys
+import time
+
+import rados
+
+name = sys.argv[1]
+pool = sys.argv[2]
+interval = float(sys.argv[3])
+size = int(sys.argv[4])
+
+cluster = rados.Rados(conffile='/etc/ceph/ceph.conf', name=name)
+cluster.connect()
+ioctx = cluster.open_ioctx(pool)
+data = b'x' * size
+n = 0
+while True:
+    obj = '%s.probe.%d' % (name, n % 16)
+    n += 1
+    sample = {'t': round(time.time(), 3)}
+    try:
+        start = time.time()
+        ioctx.write_full(obj, data)
+        sample['w'] = round(time.time() - start, 4)
+        start = time.time()
+        ioctx.read(obj, size)
+        sample['r'] = round(time.time() - start, 4)
+    except Exception as e:
+        sample['error'] = str(e)
+    sys.stdout.write(json.dumps(sample) + '\n')
+    sys.stdout.flush()
+    readable = select.select([sys.stdin], [], [], interval)[0]
+    if readable and not sys.stdin.readline():
+        break
+ioctx.close()
+cluster.shutdown()
+"""
+
+
+def clock_offset(samples):
+    """
+    Offset to add to a client's timestamps to put them on the local clock.
+
+    Each sample is printed as soon as its probe finishes, so its arrival
+    time here is its end by the client's clock plus the offset plus the
+    time the line took to arrive.  The smallest difference is the best
+    estimate of the offset.
+
+    :param samples: list of (arrival time, probe sample)
+    """
+    ends = [arrived - (s['t'] + s.get('w', 0) + s.get('r', 0))
+            for arrived, s in samples]
+    if not ends:
+        return 0.0
+    return min(ends)
+
+
+def find_stalls(samples, threshold, offset=0.0):
+    """
+    The probes that took longer than ``threshold`` seconds, or failed.
+
+    :param samples: list of (arrival time, probe sample)
+    :returns: list of dicts with the stall's start and end on the local
+              clock and its length
+    """
+    stalls = []
+    for arrived, s in samples:
+        start = s['t'] + offset
+        if 'error' in s:
+            stalls.append({'start': start, 'end': arrived,
+                           'seconds': arrived - start, 'error': s['error']})
+            continue
+        latency = s['w'] + s['r']
+        if latency > threshold:
+            stalls.append({'start': start, 'end': start + latency,
+                           'seconds': latency})
+    return stalls
+
+
+def cause(stall, journal, window):
+    """
+    The thrasher action most likely to have caused a stall: the last one
+    to start before the stall ended, if it started no more than
+    ``window`` seconds before the stall began.
+
+    :param journal: list of thrasher actions with 'start' times
+    """
+    candidates = [a for a in journal
+                  if stall['start'] - window <= a['start'] <= stall['end']]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda a: a['start'])
+
+
+def attribute(stalls, journal, window):
+    """
+    Attach the cause of every stall, as 'action' (None when no thrasher
+    action explains it) and 'after' (seconds from the action's start to
+    the stall's), and sort them longest first.
+    """
+    result = []
+    for stall in stalls:
+        action = cause(stall, journal, window)
+        stall = dict(stall, action=None)
+        if action is not None:
+            stall['action'] = action['action']
+            stall['after'] = stall['start'] - action['start']
+        result.append(stall)
+    return sorted(result, key=lambda s: -s['seconds'])
@@ -0,0 +1,92 @@
+"""
+Parsing of omapbench output
+"""
+import re
+
+from .stats import percentile_key
+
+# e.g. "Average latency:	1.2345ms"
+STAT_LINE = re.compile(r'^(Average|Minimum|Maximum|Total) latency:\s*([-.\deE]+)ms')
+MODE_LINE = re.compile(r'^Mode latency:\s*between ([-.\d]+) and ([-.\d]+)ms')
+# e.g. ">= 10ms   [*****".  The bars are scaled so that the mode bucket
+# has 45 stars.
+HISTOGRAM_LINE = re.compile(r'^>=\s*([-.\d]+)ms\s*\[(\**)\s*$')
+# Printed by the omapbench task after omapbench exits
+ELAPSED_LINE = re.compile(r'^omapbench elapsed:\s*(\d+)ns$')
+
+
+def parse_output(text, objects=None):
+    """
+    Parse the results printed by omapbench.
+
+    :param text: omapbench's output
+    :param objects: number of objects written, to turn the histogram bars
+                    into op counts and to compute ops_per_sec
+    :returns: dict of latency statistics in ms, the mode bucket,
+              'histogram', a list of [bucket lower bound in ms, ops],
+              and, if the output says how long the run took, 'elapsed'
+              in seconds and 'ops_per_sec'
+
+    The histogram bars are only relative, so the op counts are estimated
+    by sharing ``objects`` out between the buckets in proportion to their
+    bars.  Without ``objects`` the bars are returned as they are.
+    """
+    result = {'histogram': []}
+    for line in text.splitlines():
+        line = line.strip()
+        m = STAT_LINE.match(line)
+        if m:
+            result[m.group(1).lower() + '_latency_ms'] = float(m.group(2))
+            continue
+        m = MODE_LINE.match(line)
+        if m:
+            result['mode_latency_ms'] = [float(m.group(1)), float(m.group(2))]
+            continue
+        m = HISTOGRAM_LINE.match(line)
+        if m:
+            result['histogram'].append([float(m.group(1)), len(m.group(2))])
+            continue
+        m = ELAPSED_LINE.match(line)
+        if m:
+            result['elapsed'] = int(m.group(1)) / 1e9
+    stars = sum(count for _, count in result['histogram'])
+    if objects and stars:
+        result['histogram'] = [[lower, count * float(objects) / stars]
+                               for lower, count in result['histogram']]
+    if objects and result.get('elapsed'):
+        result['ops_per_sec'] = objects / result['elapsed']
+    return result
+
+
+def merge_histograms(histograms):
+    """
+    Add up several histograms of [lower bound, ops] with the same bucket
+    width, as returned by parse_output() given the number of objects.
+    """
+    merged = {}
+    for histogram in histograms:
+        for lower, count in histogram:
+            merged[lower] = merged.get(lower, 0) + count
+    return [[lower, merged[lower]] for lower in sorted(merged)]
+
+
+def histogram_percentiles(histogram, increment, percentiles=(50, 90, 99)):
+    """
+    Estimate latency percentiles from a histogram, as the upper bound of
+    the bucket in which each percentile falls.
+
+    :returns: dict of percentile_key() to ms
+    """
+    total = sum(count for _, count in histogram)
+    result = {}
+    if not total:
+        return result
+    for pct in percentiles:
+        target = total * pct / 100.0
+        seen = 0
+        for lower, count in histogram:
+            seen += count
+            if seen >= target:
+                result[percentile_key(pct)] = lower + increment
+                break
+    return result
@@ -0,0 +1,145 @@
+"""
+Helpers for reading and comparing daemon perf counters
+"""
+
+# Counter type bits from 'perf schema'
+PERFCOUNTER_TIME = 0x1
+PERFCOUNTER_U64 = 0x2
+PERFCOUNTER_LONGRUNAVG = 0x4
+PERFCOUNTER_COUNTER = 0x8
+
+# Runs on each host until EOF on stdin.  Every interval it sends 'perf dump'
+# to the admin socket of each daemon, speaking the socket protocol directly
+# rather than forking the ceph tool, and prints one JSON line of
+# {'t': time, 'd': {daemon: {'section.counter': value}}} with just the
+# wanted counters (a counter is wanted if its full name or its section is
+# listed, or if nothing is listed).  The first time a daemon answers, its
+# 'perf schema' types are printed as {'schema': {daemon: {counter: type}}}.
+SCRAPER_SCRIPT = r"""
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+interval = float(sys.argv[1])
+daemons = json.loads(sys.argv[2])
+wanted = set(json.loads(sys.argv[3]))
+
+def recv_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise IOError('admin socket closed')
+        data += chunk
+    return data
+
+def command(path, prefix):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(30)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps({'prefix': prefix}).encode() + b'\0')
+        length = struct.unpack('>I', recv_exactly(sock, 4))[0]
+        return json.loads(recv_exactly(sock, length).decode('utf-8'))
+    finally:
+        sock.close()
+
+def select_counters(dump):
+    result = {}
+    for section, counters in dump.items():
+        for name, value in counters.items():
+            key = section + '.' + name
+            if not wanted or key in wanted or section in wanted:
+                result[key] = value
+    return result
+
+def emit(msg):
+    sys.stdout.write(json.dumps(msg) + '\n')
+    sys.stdout.flush()
+
+have_schema = set()
+while True:
+    now = time.time()
+    sample = {}
+    for name, path in daemons.items():
+        if not os.path.exists(path):
+            continue
+        try:
+            if name not in have_schema:
+                schema = select_counters(command(path, 'perf schema'))
+                emit({'schema': {name: dict((k, v.get('type'))
+                                            for k, v in schema.items())}})
+                have_schema.add(name)
+            sample[name] = select_counters(command(path, 'perf dump'))
+        except (IOError, OSError, ValueError, struct.error, socket.error):
+            continue
+    emit({'t': round(now, 3), 'd': sample})
+    readable = select.select([sys.stdin], [], [], interval)[0]
+    if readable and not sys.stdin.readline():
+        break
+"""
+
+
+def perf_counter_delta(before, after):
+    """
+    Compute the change in numeric perf counters between two ``perf dump``
+    results.  Averaged counters ({avgcount, sum}) are reduced to the number
+    of new samples and their mean.
+
+    :param before: section dict from the first perf dump
+    :param after: section dict from the second perf dump
+    :returns: dict of counter name to delta
+    """
+    delta = {}
+    for name, value in after.iteritems():
+        old = before.get(name)
+        if isinstance(value, dict) and 'avgcount' in value:
+            old = old or {'avgcount': 0, 'sum': 0}
+            count = value['avgcount'] - old['avgcount']
+            total = value['sum'] - old['sum']
+            delta[name] = {
+                'avgcount': count,
+                'avg': total / count if count else 0,
+                }
+        elif isinstance(value, (int, long, float)):
+            delta[name] = value - (old or 0)
+    return delta
+
+
+def interval_values(before, after, elapsed, types=None):
+    """
+    Reduce two consecutive samples of the same counters to one value per
+    counter for the interval between them: the mean of an averaged counter
+    (e.g. seconds for a latency), the rate per second of a counter, or the
+    current value of a gauge.  Counters are treated as counters unless
+    ``types`` (from 'perf schema') says otherwise.  Counters that went
+    backwards, because the daemon restarted, are left out.
+
+    :param before: dict of counter name to value, from the earlier sample
+    :param after: the same, from the later sample
+    :param elapsed: seconds between the samples
+    :param types: optional dict of counter name to perf schema type
+    :returns: dict of counter name to value
+    """
+    types = types or {}
+    values = {}
+    for name, value in after.iteritems():
+        old = before.get(name)
+        if isinstance(value, dict):
+            if 'avgcount' not in value or old is None:
+                continue
+            count = value['avgcount'] - old['avgcount']
+            if count < 0:
+                continue
+            values[name] = (value['sum'] - old['sum']) / count if count else 0
+        elif isinstance(value, (int, long, float)):
+            type_ = types.get(name)
+            if type_ is not None and not type_ & PERFCOUNTER_COUNTER:
+                values[name] = value
+            elif old is not None and value >= old and elapsed > 0:
+                values[name] = (value - old) / float(elapsed)
+    return values
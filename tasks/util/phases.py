@@ -0,0 +1,97 @@
+"""
+Timing of the phases of a task, for finding where setup time goes
+"""
+import contextlib
+import logging
+import os
+import time
+
+import yaml
+
+log = logging.getLogger(__name__)
+
+
+class PhaseTimer(object):
+    """
+    Record how long named phases take, and when they started relative to
+    the creation of the timer.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []
+
+    def record(self, name, started, duration):
+        """
+        Record a phase that began at time ``started`` and lasted
+        ``duration`` seconds.
+        """
+        log.info('phase %s took %.1fs', name, duration)
+        self.phases.append({
+            'phase': name,
+            'start': round(started - self.start, 3),
+            'duration': round(duration, 3),
+            })
+
+    def mark(self, name):
+        """
+        Record a point in time, e.g. the first HEALTH_OK.
+        """
+        self.record(name, time.time(), 0)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time the body of a with statement as a phase.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.time() - started)
+
+    @contextlib.contextmanager
+    def stage(self, name, manager):
+        """
+        Enter the context manager ``manager``, timing its setup as phase
+        ``name`` and its teardown as ``name`` + ' teardown'.
+        """
+        started = time.time()
+        exit_started = None
+        try:
+            with manager as value:
+                self.record(name, started, time.time() - started)
+                try:
+                    yield value
+                finally:
+                    exit_started = time.time()
+        finally:
+            if exit_started is not None:
+                self.record(name + ' teardown', exit_started,
+                            time.time() - exit_started)
+
+    def report(self):
+        """
+        :returns: list of {phase, start, duration} dicts in the order the
+                  phases finished
+        """
+        return list(self.phases)
+
+    def write_report(self, ctx, key):
+        """
+        Store the report in ctx.summary[key] and, if there is an archive,
+        in <archive>/<key>.yaml.
+        """
+        report = self.report()
+        ctx.summary[key] = report
+        if ctx.archive is not None:
+            with file(os.path.join(ctx.archive, key + '.yaml'), 'w') as f:
+                yaml.safe_dump(report, f, default_flow_style=False)
+
+
+def get_phase_timer(ctx):
+    """
+    Get the PhaseTimer attached to ctx, creating it if needed.
+    """
+    if getattr(ctx, 'phase_timer', None) is None:
+        ctx.phase_timer = PhaseTimer()
+    return ctx.phase_timer
@@ -0,0 +1,108 @@
+"""
+Parsing and aggregation of 'rados bench' output
+"""
+import csv
+import re
+
+from .stats import summarize
+
+# Columns of the per-second progress lines, e.g.
+#   sec Cur ops   started  finished  avg MB/s  cur MB/s  last lat   avg lat
+#     1      16        29        13   51.9803        52   0.78543  0.529558
+SECOND_FIELDS = ['sec', 'cur_ops', 'started', 'finished',
+                 'avg_mb_sec', 'cur_mb_sec', 'last_lat', 'avg_lat']
+
+SECOND_LINE = re.compile(r'^\s*(\d+)' + r'\s+(\S+)' * 7 + r'\s*$')
+SUMMARY_LINE = re.compile(r'^\s*([A-Z][A-Za-z /()]+):\s+([-+.\deE]+)\s*$')
+
+
+def _number(text):
+    if text == '-':
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def summary_key(label):
+    """
+    'Bandwidth (MB/sec)' -> 'bandwidth_mb_sec'
+    """
+    return re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')
+
+
+def parse_output(text):
+    """
+    Parse the output of one 'rados bench' run.
+
+    :returns: dict with 'seconds', a list of dicts keyed by SECOND_FIELDS,
+              and 'summary', the closing statistics keyed by summary_key()
+              of their labels plus 'ops' and 'iops'
+    """
+    seconds = []
+    summary = {}
+    for line in text.splitlines():
+        m = SECOND_LINE.match(line)
+        if m:
+            try:
+                seconds.append(dict(zip(SECOND_FIELDS,
+                                        [_number(v) for v in m.groups()])))
+            except ValueError:
+                pass
+            continue
+        m = SUMMARY_LINE.match(line)
+        if m:
+            summary[summary_key(m.group(1))] = _number(m.group(2))
+
+    ops = summary.get('total_writes_made', summary.get('total_reads_made'))
+    if ops is not None:
+        summary['ops'] = ops
+        if summary.get('total_time_run'):
+            summary['iops'] = ops / float(summary['total_time_run'])
+    return {'seconds': seconds, 'summary': summary}
+
+
+def aggregate(results):
+    """
+    Combine the parsed output of several clients running at once.
+
+    :param results: dict of client name to parse_output() result
+    :returns: dict with total bandwidth and IOPS, the spread of bandwidth
+              between clients, and percentiles of the per-second latencies
+    """
+    bandwidths = [r['summary']['bandwidth_mb_sec'] for r in results.itervalues()
+                  if 'bandwidth_mb_sec' in r['summary']]
+    latencies = [s['last_lat'] for r in results.itervalues()
+                 for s in r['seconds'] if s['last_lat'] is not None]
+    return {
+        'clients': len(results),
+        'bandwidth_mb_sec': sum(bandwidths),
+        'iops': sum(r['summary'].get('iops', 0) for r in results.itervalues()),
+        'client_bandwidth_mb_sec': summarize(bandwidths, percentiles=[50]),
+        'latency': summarize(latencies),
+        }
+
+
+def write_csv(path, runs):
+    """
+    Write the per-second lines of several runs to a CSV file, one row per
+    client per second.
+
+    :param path: file to write
+    :param runs: list of (columns, results), where columns is a dict of
+                 column name to value describing the run (e.g. its phase),
+                 the same for every run, and results is a dict of client
+                 name to parse_output() result
+    """
+    columns = sorted(runs[0][0]) if runs else []
+    columns += ['client'] + SECOND_FIELDS
+    with open(path, 'wb') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writerow(dict(zip(columns, columns)))
+        for extra, results in runs:
+            for client, result in sorted(results.iteritems()):
+                for second in result['seconds']:
+                    row = dict(second, client=client)
+                    row.update(extra)
+                    writer.writerow(row)
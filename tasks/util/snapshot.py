@@ -0,0 +1,215 @@
+"""
+Save and restore freshly created clusters, so that short jobs can skip
+the mon/osd mkfs and key setup.
+
+A snapshot holds, for every host, a tarball of its mon stores, OSD data
+directories, MDS keyrings, client keyrings and the cluster keyring, plus
+the fsid of the saved cluster.  Snapshots are keyed by the cluster shape
+(roles per host, ceph sha1, non-debug config and OSD filesystem), so a snapshot is only
+ever restored onto an equivalent cluster.  Hosts are matched by their
+role lists, since role names are unique within a cluster.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+from cStringIO import StringIO
+
+import yaml
+
+from teuthology import misc as teuthology
+from teuthology.orchestra import run
+from teuthology.parallel import parallel
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_PATH = os.path.expanduser('~/.cache/ceph-qa-snapshots')
+
+
+class LocalSnapshotStore(object):
+    """
+    Snapshots kept as files in a directory on the machine running
+    teuthology, one subdirectory per snapshot key.
+    """
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH):
+        self.path = path
+
+    def _dir(self, key):
+        return os.path.join(self.path, key)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self._dir(key), 'metadata.yaml'))
+
+    def host_path(self, key, host_key, partial=False):
+        """
+        Path of the tarball for the host with roles ``host_key``.  Snapshots
+        are written under a .partial directory and only become visible once
+        complete (see commit()).
+        """
+        d = self._dir(key) + ('.partial' if partial else '')
+        return os.path.join(d, host_key + '.tgz')
+
+    def begin(self, key):
+        partial = self._dir(key) + '.partial'
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+        os.makedirs(partial)
+
+    def commit(self, key, metadata):
+        partial = self._dir(key) + '.partial'
+        with file(os.path.join(partial, 'metadata.yaml'), 'w') as f:
+            yaml.safe_dump(metadata, f, default_flow_style=False)
+        if os.path.exists(self._dir(key)):
+            shutil.rmtree(self._dir(key))
+        os.rename(partial, self._dir(key))
+
+    def metadata(self, key):
+        with file(os.path.join(self._dir(key), 'metadata.yaml')) as f:
+            return yaml.safe_load(f)
+
+
+def host_key(roles):
+    return ','.join(sorted(roles))
+
+
+def snapshot_key(ctx, conf, config):
+    """
+    Key identifying the shape of the cluster: roles per host, the ceph
+    sha1 being tested, the configuration other than debug settings and
+    mon addresses, and the filesystem the OSD data is on (a btrfs OSD's
+    snapshot subvolumes cannot be restored onto xfs, for instance).
+
+    :param config: the ceph task's config
+    """
+    shape = {
+        'fs': config.get('fs'),
+        'mkfs_options': config.get('mkfs_options'),
+        'mount_options': config.get('mount_options'),
+        'hosts': sorted(host_key(roles) for roles in ctx.cluster.remotes.values()),
+        'sha1': ctx.config.get('sha1'),
+        'conf': dict(
+            (section, dict((k, str(v)) for k, v in keys.iteritems()
+                           if not k.startswith('debug') and k != 'mon addr'))
+            for section, keys in conf.iteritems()),
+        }
+    return hashlib.sha1(yaml.safe_dump(shape, default_flow_style=False)).hexdigest()
+
+
+def _host_paths(roles, keyring_path):
+    """
+    Paths, relative to /, that make up a host's part of the snapshot
+    """
+    paths = [keyring_path.lstrip('/')]
+    for type_ in ['mon', 'osd', 'mds']:
+        for id_ in teuthology.roles_of_type(roles, type_):
+            paths.append('var/lib/ceph/{type}/ceph-{id}'.format(type=type_, id=id_))
+    for id_ in teuthology.roles_of_type(roles, 'client'):
+        paths.append('etc/ceph/ceph.client.{id}.keyring'.format(id=id_))
+    return paths
+
+
+# OSD data keeps its metadata in extended attributes, so keep them all
+TAR_XATTR_ARGS = ['--xattrs', '--xattrs-include=*', '--acls']
+
+
+def _save_host(store, key, remote, roles, keyring_path):
+    with file(store.host_path(key, host_key(roles), partial=True), 'wb') as f:
+        remote.run(
+            args=['sudo', 'tar', '-C', '/', '-c', '-z'] + TAR_XATTR_ARGS
+            + ['-f', '-', '--'] + _host_paths(roles, keyring_path),
+            stdout=f,
+            )
+
+
+def _restore_host(store, key, remote, roles):
+    with file(store.host_path(key, host_key(roles)), 'rb') as f:
+        remote.run(
+            args=['sudo', 'tar', '-C', '/', '-x', '-z'] + TAR_XATTR_ARGS
+            + ['-f', '-'],
+            stdin=f,
+            )
+
+
+def save(ctx, store, key, fsid, keyring_path):
+    """
+    Save the state of a freshly created cluster (daemons not yet started).
+    """
+    log.info('Saving cluster snapshot %s to %s...', key, store.path)
+    store.begin(key)
+    with parallel() as p:
+        for remote, roles in ctx.cluster.remotes.iteritems():
+            p.spawn(_save_host, store, key, remote, roles, keyring_path)
+    store.commit(key, {'fsid': fsid})
+
+
+def restore(ctx, store, key):
+    """
+    Unpack a snapshot onto the cluster's hosts.  OSD data devices, if any,
+    must already be mounted.
+
+    :returns: the fsid of the restored cluster
+    """
+    log.info('Restoring cluster snapshot %s from %s...', key, store.path)
+    with parallel() as p:
+        for remote, roles in ctx.cluster.remotes.iteritems():
+            p.spawn(_restore_host, store, key, remote, roles)
+    return store.metadata(key)['fsid']
+
+
+def create_monmap(ctx, remote, conf, fsid):
+    """
+    Like teuthology.create_simple_monmap, but for an existing fsid, so
+    that a restored cluster can be given the current mon addresses.
+    """
+    testdir = teuthology.get_testdir(ctx)
+    args = [
+        'adjust-ulimits',
+        'ceph-coverage',
+        '{tdir}/archive/coverage'.format(tdir=testdir),
+        'monmaptool',
+        '--create',
+        '--clobber',
+        '--fsid', fsid,
+        ]
+    for section, data in conf.iteritems():
+        PREFIX = 'mon.'
+        if section.startswith(PREFIX):
+            args.extend(['--add', section[len(PREFIX):], data['mon addr']])
+    args.extend(['--print', '{tdir}/monmap'.format(tdir=testdir)])
+    r = remote.run(args=args, stdout=StringIO())
+    assert re.search(fsid, r.stdout.getvalue()), \
+        'monmaptool did not use fsid {fsid}'.format(fsid=fsid)
+
+
+def inject_monmap(ctx, mons):
+    """
+    Replace the monmap in each restored mon store with {tdir}/monmap.
+    """
+    testdir = teuthology.get_testdir(ctx)
+    for remote, roles in mons.remotes.iteritems():
+        for id_ in teuthology.roles_of_type(roles, 'mon'):
+            remote.run(
+                args=[
+                    'sudo',
+                    'ceph-mon',
+                    '-i', id_,
+                    '--inject-monmap', '{tdir}/monmap'.format(tdir=testdir),
+                    ],
+                )
+
+
+def remove_maps(ctx, mons, restoring):
+    """
+    Remove the maps the mons were created from.  A restored cluster only
+    had a monmap made for it, its osdmap is in the restored mon stores.
+    """
+    testdir = teuthology.get_testdir(ctx)
+    maps = ['monmap'] if restoring else ['monmap', 'osdmap']
+    run.wait(
+        mons.run(
+            args=['rm', '--'] + ['{tdir}/{map}'.format(tdir=testdir, map=map_)
+                                 for map_ in maps],
+            wait=False,
+            ),
+        )
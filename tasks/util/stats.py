@@ -0,0 +1,51 @@
+"""
+Helpers for summarizing benchmark samples
+"""
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(samples, pct):
+    """
+    Return the pct'th percentile of samples, using linear interpolation
+    between the two closest ranks.
+
+    :param samples: sequence of numbers, need not be sorted
+    :param pct: percentile in the range [0, 100]
+    :returns: the percentile value, or None if samples is empty
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * (pct / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def percentile_key(pct):
+    """
+    Name used for a percentile in result dictionaries, e.g. p99 or p99.9
+    """
+    return 'p%s' % ('%g' % pct)
+
+
+def summarize(samples, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summarize a list of samples as count, min, mean, max and the requested
+    percentiles.
+
+    :param samples: sequence of numbers
+    :param percentiles: percentiles to report
+    :returns: dict suitable for logging or for ctx.summary
+    """
+    result = {'count': len(samples)}
+    if not samples:
+        return result
+    ordered = sorted(samples)
+    result['min'] = ordered[0]
+    result['max'] = ordered[-1]
+    result['mean'] = sum(ordered) / float(len(ordered))
+    for pct in percentiles:
+        result[percentile_key(pct)] = percentile(ordered, pct)
+    return result
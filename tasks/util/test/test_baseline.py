@@ -0,0 +1,50 @@
+from .. import baseline
+
+
+class TestBaseline(object):
+
+    def test_flatten(self):
+        results = [{'phase': 'write', 'block_size': None,
+                    'total': {'bandwidth_mb_sec': 100.0, 'latency': {'p99': 0.5}},
+                    'ok': True}]
+        assert baseline.flatten(results) == {
+            '[phase=write].total.bandwidth_mb_sec': 100.0,
+            '[phase=write].total.latency.p99': 0.5,
+            }
+        assert baseline.flatten({'a': [1, 2]}) == {'a.[0]': 1, 'a.[1]': 2}
+
+    def test_direction(self):
+        assert baseline.direction('total.bandwidth_mb_sec') == 1
+        assert baseline.direction('client_bandwidth_mb_sec.p50') == 1
+        assert baseline.direction('total.latency.p99') == -1
+        assert baseline.direction('clients.client.0.average_latency') == -1
+        assert baseline.direction('total.latency.count') is None
+        assert baseline.direction('[scenario=out].latency.write.p99') == -1
+        assert baseline.direction('degraded_objects.last') is None
+        assert baseline.direction('clients.client.0.total_time_run') is None
+
+    def test_compare(self):
+        c = baseline.compare('bandwidth_mb_sec', 80.0, [100.0], 0.1, 3)
+        assert c['regression'] and c['change_pct'] == -20.0
+        assert not baseline.compare('bandwidth_mb_sec', 95.0, [100.0], 0.1, 3)['regression']
+        # latency going down is an improvement
+        assert not baseline.compare('latency.p99', 0.1, [1.0], 0.1, 3)['regression']
+        assert baseline.compare('latency.p99', 2.0, [1.0], 0.1, 3)['regression']
+        # within the noise of a variable baseline
+        assert not baseline.compare('iops', 70.0, [50.0, 100.0, 150.0], 0.1, 3)['regression']
+
+    def test_compare_all(self):
+        current = {'bandwidth_mb_sec': 50.0, 'latency.p99': 1.2, 'ops': 3}
+        base = {'bandwidth_mb_sec': [100.0], 'latency.p99': [1.0], 'ops': [5]}
+        comparisons = baseline.compare_all(current, base,
+                                           overrides={'latency*': 0.5})
+        assert [(c['metric'], c['regression']) for c in comparisons] == \
+            [('bandwidth_mb_sec', True), ('latency.p99', False)]
+        assert 'bandwidth_mb_sec' in baseline.format_diff(comparisons)
+
+    def test_record(self):
+        baselines = {}
+        for value in range(5):
+            baseline.record(baselines, 'k', {'iops': value, 'ops': value},
+                            max_samples=3)
+        assert baselines == {'k': {'iops': [2, 3, 4]}}
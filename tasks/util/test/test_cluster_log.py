@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+
+from .. import cluster_log
+
+
+def run_scan(path, offset, whitelist, limit=100):
+    out = subprocess.check_output([
+        sys.executable, '-c', cluster_log.SCAN_SCRIPT,
+        str(path), str(offset), json.dumps(whitelist), str(limit),
+        ])
+    return json.loads(out)
+
+
+class TestScanScript(object):
+
+    def test_missing_log(self, tmpdir):
+        result = run_scan(tmpdir.join('ceph.log'), 0, [])
+        assert result == {'offset': 0, 'counts': {}, 'matches': {}}
+
+    def test_whitelist_and_severity(self, tmpdir):
+        log = tmpdir.join('ceph.log')
+        log.write('a : [INF] fine\n'
+                  'b : [WRN] slow request\n'
+                  'c : [ERR] scrub mismatch\n'
+                  'd : [WRN] clock skew\n'
+                  'e : [SEC] bad auth\n')
+        result = run_scan(log, 0, ['slow request', 'clock.*skew'])
+        assert result['offset'] == log.size()
+        assert result['counts'] == {'ERR': 1, 'SEC': 1}
+        assert result['matches']['SEC'] == ['e : [SEC] bad auth']
+
+    def test_incremental(self, tmpdir):
+        log = tmpdir.join('ceph.log')
+        log.write('a : [WRN] one\nb : [WRN] tw')
+        first = run_scan(log, 0, [])
+        # the partial line is left for the next scan
+        assert first['counts'] == {'WRN': 1}
+        assert first['offset'] == len('a : [WRN] one\n')
+        log.write('o\nc : [ERR] three\n', mode='a')
+        second = run_scan(log, first['offset'], [])
+        assert second['counts'] == {'WRN': 1, 'ERR': 1}
+        assert second['matches']['WRN'] == ['b : [WRN] two']
+        assert second['offset'] == log.size()
+
+    def test_limit(self, tmpdir):
+        log = tmpdir.join('ceph.log')
+        log.write(''.join('%d : [ERR] x\n' % i for i in range(10)))
+        result = run_scan(log, 0, [], limit=3)
+        assert result['counts'] == {'ERR': 10}
+        assert len(result['matches']['ERR']) == 3
@@ -0,0 +1,26 @@
+from .. import cpu_profile
+
+
+class TestCpuProfile(object):
+
+    def test_parse_collapsed(self):
+        text = ('main;OSD::do_op;memcpy 5\n'
+                'main;OSD::do_op 3\n'
+                'garbage\n'
+                'main;OSD::do_op;memcpy 2\n')
+        assert cpu_profile.parse_collapsed(text) == {
+            'main;OSD::do_op;memcpy': 7,
+            'main;OSD::do_op': 3,
+            }
+
+    def test_merge_and_format(self):
+        merged = cpu_profile.merge([{'a;b': 1, 'a': 2}, {'a;b': 4}])
+        assert merged == {'a;b': 5, 'a': 2}
+        assert cpu_profile.format_collapsed(merged) == 'a 2\na;b 5\n'
+
+    def test_top_functions(self):
+        stacks = {'main;f;memcpy': 6, 'main;g;memcpy': 2, 'main;g': 2}
+        top = cpu_profile.top_functions(stacks, n=1)
+        assert top == [{'function': 'memcpy', 'samples': 8, 'percent': 80.0}]
+        assert [f['function'] for f in cpu_profile.top_functions(stacks)] == \
+            ['memcpy', 'g']
@@ -0,0 +1,45 @@
+from .. import latency_slo
+
+
+class TestLatencySlo(object):
+
+    def test_clock_offset(self):
+        # the client's clock is 100s behind; lines take 0.01-0.5s to arrive
+        samples = [
+            (110.51, {'t': 10.0, 'w': 0.3, 'r': 0.2}),
+            (120.06, {'t': 20.0, 'w': 0.01, 'r': 0.04}),
+            ]
+        assert abs(latency_slo.clock_offset(samples) - 100.01) < 1e-9
+        assert latency_slo.clock_offset([]) == 0.0
+
+    def test_find_stalls(self):
+        samples = [
+            (101, {'t': 1.0, 'w': 0.01, 'r': 0.01}),
+            (109, {'t': 2.0, 'w': 6.5, 'r': 0.5}),
+            (130, {'t': 10.0, 'error': 'timed out'}),
+            ]
+        stalls = latency_slo.find_stalls(samples, 5, offset=100)
+        assert stalls == [
+            {'start': 102.0, 'end': 109.0, 'seconds': 7.0},
+            {'start': 110.0, 'end': 130, 'seconds': 20.0,
+             'error': 'timed out'},
+            ]
+
+    def test_attribute(self):
+        journal = [
+            {'start': 50.0, 'end': 51.0, 'action': 'out_osd'},
+            {'start': 100.0, 'end': 101.0, 'action': 'kill_osd'},
+            {'start': 200.0, 'end': 201.0, 'action': 'revive_osd'},
+            ]
+        stalls = [
+            # began before the kill and was held up by it
+            {'start': 99.0, 'end': 104.0, 'seconds': 5.0},
+            {'start': 103.0, 'end': 120.0, 'seconds': 17.0},
+            # nothing happened shortly before
+            {'start': 180.0, 'end': 186.0, 'seconds': 6.0},
+            ]
+        result = latency_slo.attribute(stalls, journal, window=30)
+        assert [(s['seconds'], s['action']) for s in result] == [
+            (17.0, 'kill_osd'), (6.0, None), (5.0, 'kill_osd')]
+        assert result[0]['after'] == 3.0
+        assert result[2]['after'] == -1.0
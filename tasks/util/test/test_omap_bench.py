@@ -0,0 +1,53 @@
+from .. import omap_bench
+
+# As printed by OmapBench::print_results() in omap_bench.cc, for 17 ops
+# of which 3, 9, 4 and 1 fell in each 10ms bucket: the bars are scaled so
+# that the mode bucket has 45 stars.  The last line is added by the task.
+OUTPUT = """\
+========================================================
+Number of kvmaps written:\t17
+Number of ops at once:\t2
+Entries per kvmap:\t\t10
+Characters per key:\t10
+Characters per val:\t100
+
+Average latency:\t14.7ms
+Minimum latency:\t3ms
+Maximum latency:\t31ms
+Mode latency:\t\tbetween 10 and 20ms
+Total latency:\t\t250ms
+
+Histogram:
+>= 0ms    [***************
+>= 10ms   [*********************************************
+>= 20ms   [********************
+>= 30ms   [*****
+
+========================================================
+omapbench elapsed: 125000000ns
+"""
+
+
+class TestOmapBench(object):
+
+    def test_parse_output(self):
+        result = omap_bench.parse_output(OUTPUT, objects=17)
+        assert result['average_latency_ms'] == 14.7
+        assert result['maximum_latency_ms'] == 31
+        assert result['mode_latency_ms'] == [10, 20]
+        assert result['histogram'] == [[0, 3], [10, 9], [20, 4], [30, 1]]
+        assert result['elapsed'] == 0.125
+        # 17 ops in 0.125s, two at a time
+        assert result['ops_per_sec'] == 136.0
+
+    def test_parse_output_without_objects(self):
+        result = omap_bench.parse_output(OUTPUT)
+        assert result['histogram'] == [[0, 15], [10, 45], [20, 20], [30, 5]]
+        assert 'ops_per_sec' not in result
+
+    def test_histograms(self):
+        merged = omap_bench.merge_histograms([[[0, 5], [10, 10]], [[10, 3], [20, 2]]])
+        assert merged == [[0, 5], [10, 13], [20, 2]]
+        assert omap_bench.histogram_percentiles(merged, 10, [50, 99]) == \
+            {'p50': 20, 'p99': 30}
+        assert omap_bench.histogram_percentiles([], 10) == {}
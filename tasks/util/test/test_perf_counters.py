@@ -0,0 +1,28 @@
+from .. import perf_counters
+
+
+class TestPerfCounters(object):
+
+    def test_perf_counter_delta(self):
+        before = {'req': 10, 'lat': {'avgcount': 2, 'sum': 1.0}}
+        after = {'req': 15, 'lat': {'avgcount': 6, 'sum': 3.0}, 'new': 1}
+        assert perf_counters.perf_counter_delta(before, after) == {
+            'req': 5, 'lat': {'avgcount': 4, 'avg': 0.5}, 'new': 1}
+
+    def test_interval_values(self):
+        before = {'osd.op_w': 100, 'osd.op_w_latency': {'avgcount': 10, 'sum': 1.0},
+                  'osd.numpg': 30}
+        after = {'osd.op_w': 150, 'osd.op_w_latency': {'avgcount': 30, 'sum': 3.0},
+                 'osd.numpg': 40}
+        types = {'osd.op_w': perf_counters.PERFCOUNTER_U64 |
+                 perf_counters.PERFCOUNTER_COUNTER,
+                 'osd.numpg': perf_counters.PERFCOUNTER_U64}
+        assert perf_counters.interval_values(before, after, 10, types) == {
+            'osd.op_w': 5.0, 'osd.op_w_latency': 0.1, 'osd.numpg': 40}
+        # without a schema, everything is a counter
+        assert perf_counters.interval_values(before, after, 10)['osd.numpg'] == 1.0
+
+    def test_restart(self):
+        before = {'osd.op_w': 100, 'osd.op_w_latency': {'avgcount': 10, 'sum': 1.0}}
+        after = {'osd.op_w': 5, 'osd.op_w_latency': {'avgcount': 1, 'sum': 0.1}}
+        assert perf_counters.interval_values(before, after, 10) == {}
@@ -0,0 +1,59 @@
+from .. import rados_bench
+
+OUTPUT = """\
+ Maintaining 16 concurrent writes of 4194304 bytes for up to 3 seconds or 0 objects
+ Object prefix: benchmark_data_plana01_12345
+   sec Cur ops   started  finished  avg MB/s  cur MB/s  last lat   avg lat
+     0       0         0         0         0         0         -         0
+     1      16        29        13   51.9803        52   0.78543  0.529558
+     2      16        48        32   63.9836        76  0.830258  0.748853
+ 2014-10-01 12:00:02.000000min lat: 0.311431 max lat: 1.55178 avg lat: 0.971977
+     3      16        60        44   58.6500        48  1.20000   0.850000
+ Total time run:         3.536271
+Total writes made:      60
+Write size:             4194304
+Bandwidth (MB/sec):     67.868
+
+Stddev Bandwidth:       14.4393
+Max bandwidth (MB/sec): 76
+Min bandwidth (MB/sec): 0
+Average Latency:        0.971977
+Stddev Latency:         0.281386
+Max latency:            1.55178
+Min latency:            0.311431
+"""
+
+
+class TestRadosBench(object):
+
+    def test_parse_output(self):
+        result = rados_bench.parse_output(OUTPUT)
+        assert [s['sec'] for s in result['seconds']] == [0, 1, 2, 3]
+        assert result['seconds'][0]['last_lat'] is None
+        assert result['seconds'][2]['cur_mb_sec'] == 76
+        summary = result['summary']
+        assert summary['bandwidth_mb_sec'] == 67.868
+        assert summary['max_bandwidth_mb_sec'] == 76
+        assert summary['average_latency'] == 0.971977
+        assert summary['ops'] == 60
+        assert abs(summary['iops'] - 60 / 3.536271) < 1e-9
+
+    def test_aggregate(self):
+        result = rados_bench.parse_output(OUTPUT)
+        total = rados_bench.aggregate({'client.0': result, 'client.1': result})
+        assert total['clients'] == 2
+        assert total['bandwidth_mb_sec'] == 2 * 67.868
+        assert total['latency']['count'] == 6
+        assert total['latency']['max'] == 1.2
+
+    def test_write_csv(self, tmpdir):
+        path = str(tmpdir.join('bench.csv'))
+        results = {'client.0': rados_bench.parse_output(OUTPUT)}
+        rados_bench.write_csv(path, [({'phase': 'write', 'block_size': 4096}, results),
+                                     ({'phase': 'seq', 'block_size': 4096}, results)])
+        lines = open(path).read().splitlines()
+        assert lines[0] == 'block_size,phase,client,' + \
+            ','.join(rados_bench.SECOND_FIELDS)
+        assert lines[2] == '4096,write,client.0,1,16,29,13,51.9803,52,0.78543,0.529558'
+        assert lines[6] == '4096,seq,client.0,1,16,29,13,51.9803,52,0.78543,0.529558'
+        assert len(lines) == 9
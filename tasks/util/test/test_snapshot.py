@@ -0,0 +1,152 @@
+import os
+from cStringIO import StringIO
+
+from teuthology.orchestra.run import CommandFailedError
+
+from .. import snapshot
+
+
+class FakeCluster(object):
+    def __init__(self, remotes):
+        self.remotes = remotes
+
+    def run(self, args, wait=True):
+        for remote in self.remotes:
+            remote.run(args=args)
+        return []
+
+
+class FakeRemote(object):
+    """
+    Runs the commands the cluster bootstrap uses against a set of files.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.files = set()
+
+    def __repr__(self):
+        return self.name
+
+    def run(self, args, stdin=None, stdout=None):
+        if 'monmaptool' in args:
+            self.files.add(args[args.index('--print') + 1])
+            stdout.write(args[args.index('--fsid') + 1])
+        elif 'tar' in args:
+            assert stdin.read() == 'data'
+        elif '--inject-monmap' in args:
+            if args[args.index('--inject-monmap') + 1] not in self.files:
+                raise CommandFailedError(args, 1)
+        elif args[0] == 'rm':
+            for path in args[2:]:
+                if path not in self.files:
+                    raise CommandFailedError(args, 1)
+                self.files.remove(path)
+        return FakeProc(stdout)
+
+
+class FakeProc(object):
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+
+class FakeCtx(object):
+    def __init__(self, remotes, sha1='abc'):
+        self.cluster = FakeCluster(remotes)
+        self.config = {'sha1': sha1}
+
+
+def make_ctx(sha1='abc'):
+    return FakeCtx({'host1': ['mon.a', 'osd.0'], 'host2': ['osd.1', 'client.0']},
+                   sha1)
+
+
+CONF = {'global': {'osd pool default size': 2, 'debug osd': 20},
+        'mon.a': {'mon addr': '10.0.0.1:6789'}}
+
+
+class TestSnapshotKey(object):
+
+    def test_same_shape(self):
+        other = FakeCtx({'h3': ['osd.1', 'client.0'], 'h4': ['osd.0', 'mon.a']})
+        assert snapshot.snapshot_key(make_ctx(), CONF, {}) == \
+            snapshot.snapshot_key(other, CONF, {})
+
+    def test_ignores_debug_and_mon_addr(self):
+        conf = {'global': {'osd pool default size': 2, 'debug osd': 1},
+                'mon.a': {'mon addr': '10.0.0.2:6789'}}
+        assert snapshot.snapshot_key(make_ctx(), CONF, {}) == \
+            snapshot.snapshot_key(make_ctx(), conf, {})
+
+    def test_differs(self):
+        key = snapshot.snapshot_key(make_ctx(), CONF, {'fs': 'xfs'})
+        conf = {'global': {'osd pool default size': 3}}
+        assert key != snapshot.snapshot_key(make_ctx('def'), CONF, {'fs': 'xfs'})
+        assert key != snapshot.snapshot_key(make_ctx(), conf, {'fs': 'xfs'})
+        assert key != snapshot.snapshot_key(make_ctx(), CONF, {'fs': 'btrfs'})
+        assert key != snapshot.snapshot_key(
+            make_ctx(), CONF, {'fs': 'xfs', 'mount_options': ['noatime']})
+
+
+class TestLocalSnapshotStore(object):
+
+    def test_commit(self, tmpdir):
+        store = snapshot.LocalSnapshotStore(str(tmpdir))
+        assert not store.exists('k')
+        store.begin('k')
+        path = store.host_path('k', 'mon.a,osd.0', partial=True)
+        with open(path, 'w') as f:
+            f.write('data')
+        # not visible until committed
+        assert not store.exists('k')
+        store.commit('k', {'fsid': 'f00'})
+        assert store.exists('k')
+        assert store.metadata('k') == {'fsid': 'f00'}
+        with open(store.host_path('k', 'mon.a,osd.0')) as f:
+            assert f.read() == 'data'
+        assert not os.path.exists(str(tmpdir.join('k.partial')))
+
+    def test_replace(self, tmpdir):
+        store = snapshot.LocalSnapshotStore(str(tmpdir))
+        store.begin('k')
+        store.commit('k', {'fsid': 'old'})
+        store.begin('k')
+        # an interrupted save is thrown away by the next one
+        store.begin('k')
+        store.commit('k', {'fsid': 'new'})
+        assert store.metadata('k') == {'fsid': 'new'}
+
+
+class TestRestore(object):
+
+    def test_restore(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(snapshot.teuthology, 'get_testdir',
+                            lambda ctx: '/tdir')
+        mon_host = FakeRemote('host1')
+        other_host = FakeRemote('host2')
+        ctx = FakeCtx({mon_host: ['mon.a', 'osd.0'],
+                       other_host: ['osd.1', 'client.0']})
+        mons = FakeCluster({mon_host: ['mon.a', 'osd.0']})
+        store = snapshot.LocalSnapshotStore(str(tmpdir))
+        key = snapshot.snapshot_key(ctx, CONF, {})
+        store.begin(key)
+        for roles in ctx.cluster.remotes.values():
+            with open(store.host_path(key, snapshot.host_key(roles),
+                                      partial=True), 'w') as f:
+                f.write('data')
+        store.commit(key, {'fsid': 'f00'})
+
+        # the order ceph.cluster() takes them in when restoring
+        snapshot.create_monmap(ctx, mon_host, CONF, 'f00')
+        assert snapshot.restore(ctx, store, key) == 'f00'
+        snapshot.inject_monmap(ctx, mons)
+        snapshot.remove_maps(ctx, mons, restoring=True)
+        assert mon_host.files == set()
+
+    def test_remove_maps_after_mkfs(self, monkeypatch):
+        monkeypatch.setattr(snapshot.teuthology, 'get_testdir',
+                            lambda ctx: '/tdir')
+        mon_host = FakeRemote('host1')
+        mon_host.files.update(['/tdir/monmap', '/tdir/osdmap'])
+        snapshot.remove_maps(None, FakeCluster({mon_host: ['mon.a']}),
+                             restoring=False)
+        assert mon_host.files == set()
@@ -0,0 +1,26 @@
+from .. import stats
+
+
+class TestStats(object):
+
+    def test_percentile(self):
+        assert stats.percentile([], 50) is None
+        assert stats.percentile([3], 99) == 3
+        assert stats.percentile([4, 1, 3, 2, 5], 50) == 3
+        assert stats.percentile([1, 2, 3, 4, 5], 0) == 1
+        assert stats.percentile([1, 2, 3, 4, 5], 100) == 5
+        assert stats.percentile([1, 2], 50) == 1.5
+
+    def test_percentile_key(self):
+        assert stats.percentile_key(50) == 'p50'
+        assert stats.percentile_key(99.9) == 'p99.9'
+
+    def test_summarize(self):
+        assert stats.summarize([]) == {'count': 0}
+        summary = stats.summarize(range(1, 101), percentiles=[50, 99])
+        assert summary['count'] == 100
+        assert summary['min'] == 1
+        assert summary['max'] == 100
+        assert summary['mean'] == 50.5
+        assert summary['p50'] == 50.5
+        assert 'p99' in summary
@@ -0,0 +1,75 @@
+import gzip
+import json
+import subprocess
+import sys
+
+from .. import valgrind
+
+ERROR = """
+  <error>
+    <unique>0x{n:x}</unique>
+    <kind>{kind}</kind>
+    <xwhat><text>{kind} here</text></xwhat>
+    <stack>
+      <frame><ip>0x1</ip><fn>malloc</fn></frame>
+      <frame><ip>0x2</ip><fn>{fn}</fn><file>foo.cc</file><line>12</line></frame>
+    </stack>
+  </error>
+"""
+
+
+def write_log(errors, complete=True):
+    text = '<?xml version="1.0"?>\n<valgrindoutput>\n'
+    for n, (kind, fn) in enumerate(errors):
+        text += ERROR.format(n=n, kind=kind, fn=fn)
+    if complete:
+        text += '</valgrindoutput>\n'
+    return text
+
+
+def run_triage(logdir):
+    out = subprocess.check_output([
+        sys.executable, '-c', valgrind.TRIAGE_SCRIPT, str(logdir), '5',
+        ])
+    return json.loads(out)
+
+
+class TestTriageScript(object):
+
+    def test_dedup(self, tmpdir):
+        tmpdir.join('osd.0.log').write(write_log([
+            ('Leak_DefinitelyLost', 'Foo::bar'),
+            ('Leak_DefinitelyLost', 'Foo::bar'),
+            ('InvalidRead', 'Foo::baz'),
+            ]))
+        report = run_triage(tmpdir)
+        errors = report['osd.0']['errors']
+        assert [(e['kind'], e['count']) for e in errors] == \
+            [('Leak_DefinitelyLost', 2), ('InvalidRead', 1)]
+        assert errors[1]['frames'][1] == {'fn': 'Foo::baz', 'where': 'foo.cc:12'}
+        assert errors[1]['what'] == 'InvalidRead here'
+
+    def test_truncated_and_gzipped(self, tmpdir):
+        f = gzip.open(str(tmpdir.join('mds.a.log.gz')), 'wb')
+        f.write(write_log([('InvalidRead', 'f')], complete=False).encode())
+        f.close()
+        report = run_triage(tmpdir)
+        assert 'truncated' in report['mds.a']
+        assert report['mds.a']['errors'][0]['count'] == 1
+
+    def test_empty(self, tmpdir):
+        assert run_triage(tmpdir.join('missing')) == {}
+
+
+class TestSuppressions(object):
+
+    def test_mds_lost(self):
+        report = {
+            'mds.a': {'errors': [{'kind': 'Leak_DefinitelyLost', 'count': 1},
+                                 {'kind': 'InvalidRead', 'count': 1}]},
+            'osd.0': {'errors': [{'kind': 'Leak_DefinitelyLost', 'count': 1}]},
+            }
+        failures = valgrind.apply_suppressions(report)
+        assert [(d, e['kind']) for d, e in failures] == \
+            [('mds.a', 'InvalidRead'), ('osd.0', 'Leak_DefinitelyLost')]
+        assert report['mds.a']['errors'][0]['suppressed']
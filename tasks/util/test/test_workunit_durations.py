@@ -0,0 +1,40 @@
+from .. import workunit_durations
+
+
+class TestWorkunitDurations(object):
+
+    def test_longest_first(self):
+        pairs = [
+            ('client.0', 'rados/short.sh'),
+            ('client.0', 'rados/new.sh'),
+            ('client.1', 'rbd/long.sh'),
+            ('client.1', 'rados/short.sh'),
+            ('client.0', 'rbd/other_new.sh'),
+            ]
+        history = {'rados/short.sh': 5, 'rbd/long.sh': 300}
+        assert workunit_durations.longest_first(pairs, history) == [
+            # never timed, in their original order
+            ('client.0', 'rados/new.sh'),
+            ('client.0', 'rbd/other_new.sh'),
+            ('client.1', 'rbd/long.sh'),
+            ('client.0', 'rados/short.sh'),
+            ('client.1', 'rados/short.sh'),
+            ]
+
+    def test_merge(self):
+        history = {'a.sh': 10, 'b.sh': 20, 'c.sh': 30}
+        durations = {
+            'client.0': {'a.sh': 12, 'b.sh': 5},
+            'client.1': {'a.sh': 15, 'd.sh': 1},
+            }
+        merged = workunit_durations.merge(history, durations)
+        # the longest client this run, even if shorter than last time
+        assert merged == {'a.sh': 15, 'b.sh': 5, 'c.sh': 30, 'd.sh': 1}
+        assert history == {'a.sh': 10, 'b.sh': 20, 'c.sh': 30}
+
+    def test_save_and_load(self, tmpdir):
+        path = str(tmpdir.join('durations.json'))
+        assert workunit_durations.load(path) == {}
+        assert workunit_durations.load(None) == {}
+        workunit_durations.save(path, {'a.sh': 1}, {'client.0': {'b.sh': 2}})
+        assert workunit_durations.load(path) == {'a.sh': 1, 'b.sh': 2}
@@ -0,0 +1,141 @@
+"""
+Triage of valgrind XML logs
+"""
+from cStringIO import StringIO
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# Number of stack frames that identify an error
+SIGNATURE_DEPTH = 5
+
+# Errors matching one of these are expected and do not fail the run.  Each
+# rule gives regexes for the daemon name (e.g. 'mds.a') and the error kind.
+SUPPRESSIONS = [
+    # known mds leaks
+    {'daemon': r'mds', 'kind': r'.Lost'},
+]
+
+# Runs on each host.  Stream-parses every valgrind XML log in the given
+# directory, deduplicating errors by kind and the function names of their
+# innermost frames, and prints a JSON summary per daemon.  Logs may have
+# been gzipped by archiving, and are truncated if the daemon was killed;
+# whatever parsed before the truncation is still reported.
+TRIAGE_SCRIPT = r"""
+import glob
+import gzip
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+logdir = sys.argv[1]
+depth = int(sys.argv[2])
+
+def frames(error):
+    result = []
+    for frame in error.findall('stack/frame'):
+        fn = frame.findtext('fn') or frame.findtext('obj') or frame.findtext('ip')
+        where = None
+        if frame.findtext('file'):
+            where = '%s:%s' % (frame.findtext('file'), frame.findtext('line'))
+        result.append({'fn': fn, 'where': where})
+    return result
+
+report = {}
+for path in sorted(glob.glob(os.path.join(logdir, '*'))):
+    if not os.path.isfile(path):
+        continue
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.log'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    errors = {}
+    entry = {}
+    try:
+        f = (gzip.open if path.endswith('.gz') else open)(path, 'rb')
+        try:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != 'error':
+                    continue
+                kind = elem.findtext('kind')
+                stack = frames(elem)[:depth]
+                sig = '|'.join([kind or '?'] + [fr['fn'] or '?' for fr in stack])
+                error = errors.get(sig)
+                if error is None:
+                    what = elem.findtext('what') or elem.findtext('xwhat/text')
+                    error = errors[sig] = {'kind': kind, 'what': what,
+                                           'frames': stack, 'count': 0}
+                error['count'] += 1
+                elem.clear()
+        finally:
+            f.close()
+    # ET.ParseError (a SyntaxError) is new in 2.7; 2.6 raises ExpatError
+    except (SyntaxError, expat.ExpatError) as e:
+        entry['truncated'] = str(e)
+    except (IOError, OSError) as e:
+        entry['read_error'] = str(e)
+    entry['errors'] = sorted(errors.values(), key=lambda e: -e['count'])
+    report[name] = entry
+
+sys.stdout.write(json.dumps(report))
+"""
+
+
+def start_triage(remote, logdir='/var/log/ceph/valgrind',
+                 depth=SIGNATURE_DEPTH):
+    """
+    Start summarizing the valgrind logs on a remote.
+
+    :returns: the remote process; pass it to finish_triage()
+    """
+    return remote.run(
+        args=['sudo', 'python', '-c', TRIAGE_SCRIPT, logdir, str(depth)],
+        wait=False,
+        stdout=StringIO(),
+        )
+
+
+def finish_triage(proc):
+    """
+    :returns: dict of daemon name to summary, as printed by TRIAGE_SCRIPT
+    """
+    proc.wait()
+    return json.loads(proc.stdout.getvalue())
+
+
+def is_suppressed(daemon, kind, rules=SUPPRESSIONS):
+    for rule in rules:
+        if re.search(rule['daemon'], daemon) and re.search(rule['kind'], kind or ''):
+            return True
+    return False
+
+
+def apply_suppressions(report, rules=SUPPRESSIONS):
+    """
+    Mark each error in a report from finish_triage() as suppressed or not.
+
+    :returns: list of (daemon, error) for the errors that are not suppressed
+    """
+    failures = []
+    for daemon, entry in sorted(report.iteritems()):
+        for error in entry['errors']:
+            error['suppressed'] = is_suppressed(daemon, error['kind'], rules)
+            if not error['suppressed']:
+                failures.append((daemon, error))
+    return failures
+
+
+def describe(error, frames=3):
+    """
+    One line description of an error from a report: its kind, count and
+    top frames.
+    """
+    return '{kind} x{count} at {frames}'.format(
+        kind=error['kind'],
+        count=error['count'],
+        frames=' < '.join(fr['fn'] or '?' for fr in error['frames'][:frames]),
+        )
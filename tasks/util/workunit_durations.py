@@ -0,0 +1,51 @@
+"""
+Per-workunit durations, kept between runs to schedule workunits
+longest first
+"""
+import json
+import os
+
+
+def load(path):
+    """
+    Durations of the workunits in previous runs, from a JSON file of
+    workunit to seconds.  A missing file has none.
+    """
+    if path is None or not os.path.exists(path):
+        return {}
+    with file(path) as f:
+        return json.load(f)
+
+
+def merge(history, durations):
+    """
+    Update ``history`` (workunit: seconds) with the durations of this run
+    (role: {workunit: seconds}), taking for each workunit the longest time
+    any client took this time.
+
+    :returns: the updated durations, ``history`` is left as it is
+    """
+    latest = {}
+    for times in durations.itervalues():
+        for workunit, seconds in times.iteritems():
+            latest[workunit] = max(seconds, latest.get(workunit, 0))
+    merged = dict(history)
+    merged.update(latest)
+    return merged
+
+
+def save(path, history, durations):
+    """
+    Write merge(history, durations) to ``path``.
+    """
+    with file(path, 'w') as f:
+        json.dump(merge(history, durations), f, indent=2, sort_keys=True)
+
+
+def longest_first(pairs, history):
+    """
+    Order (role, workunit) pairs so that the workunits that took longest
+    last time come first.  Those never timed, which might take longest
+    of all, go before them; otherwise the order is kept.
+    """
+    return sorted(pairs, key=lambda pair: -history.get(pair[1], float('inf')))
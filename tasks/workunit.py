@@ -1,18 +1,222 @@
 """
 Workunit task -- Run ceph on sets of specific clients
 """
+import hashlib
 import logging
 import pipes
 import os
+import tempfile
+import time
+import uuid
 
+import gevent.subprocess
+from gevent.lock import Semaphore
 from teuthology import misc
 from teuthology.orchestra.run import CommandFailedError
 from teuthology.parallel import parallel
 from teuthology.orchestra import run
+from util import workunit_durations
 
 log = logging.getLogger(__name__)
 
 CLIENT_PREFIX = 'client.'
+GIT_URL = 'git://ceph.newdream.net/git/ceph.git'
+
+
+class WorkunitCache(object):
+    """
+    The workunits of one refspec, fetched and built once on each host and
+    shared, read-only, by all the roles on it.  Each instance has
+    directories of its own, so that two workunit tasks running at once
+    with the same refspec do not remove each other's.
+
+    With ``preseed``, the workunits are fetched from git once, by the
+    teuthology host, and copied to each host from there.
+    """
+    def __init__(self, ctx, refspec, preseed=False):
+        self.ctx = ctx
+        self.refspec = refspec
+        self.preseed = preseed
+        key = hashlib.sha1('{url}:{ref}'.format(url=GIT_URL, ref=refspec))
+        self.path = '{tdir}/workunits.{key}.{nonce}'.format(
+            tdir=misc.get_testdir(ctx), key=key.hexdigest()[:16],
+            nonce=uuid.uuid4().hex[:8])
+        self.hosts = {}
+        self._locks = {}
+        self._lock = Semaphore()
+        self._tarball = None
+
+    def _archive(self):
+        """
+        Fetch the workunits on the teuthology host, once.
+
+        :returns: path of a tarball of them
+        """
+        with self._lock:
+            if self._tarball is None:
+                log.info('Fetching workunits from ref %s for all hosts',
+                         self.refspec)
+                fd, path = tempfile.mkstemp(suffix='.tar')
+                with os.fdopen(fd, 'wb') as f:
+                    # cooperatively, so the other greenlets keep running
+                    gevent.subprocess.check_call(
+                        ['git', 'archive', '--remote=' + GIT_URL,
+                         '%s:qa/workunits' % self.refspec],
+                        stdout=f)
+                self._tarball = path
+        return self._tarball
+
+    def get(self, remote, role):
+        """
+        Make sure the workunits are on ``remote``, fetching and building
+        them if no other role on it has yet.
+
+        :returns: the directory holding them
+        """
+        lock = self._locks.setdefault(remote.name, Semaphore())
+        with lock:
+            if remote.name in self.hosts:
+                return self.path
+            tmp = self.path + '.tmp'
+            args = [
+                'mkdir', '--', tmp,
+                run.Raw('&&'),
+            ]
+            stdin = None
+            if self.preseed:
+                stdin = open(self._archive(), 'rb')
+            else:
+                args.extend([
+                    'git',
+                    'archive',
+                    '--remote=' + GIT_URL,
+                    '%s:qa/workunits' % self.refspec,
+                    run.Raw('|'),
+                ])
+            args.extend([
+                'tar',
+                '-C', tmp,
+                '-x',
+                '-f-',
+                run.Raw('&&'),
+                'cd', '--', tmp,
+                run.Raw('&&'),
+                'if', 'test', '-e', 'Makefile', run.Raw(';'), 'then', 'make', run.Raw(';'), 'fi',
+                run.Raw('&&'),
+                'cd', '/',
+                run.Raw('&&'),
+                'mv', '--', tmp, self.path,
+                run.Raw('&&'),
+                'chmod', '-R', 'a-w', '--', self.path,
+            ])
+            try:
+                remote.run(
+                    logger=log.getChild(role),
+                    args=args,
+                    stdin=stdin,
+                )
+            finally:
+                if stdin is not None:
+                    stdin.close()
+            self.hosts[remote.name] = remote
+        return self.path
+
+    def list_workunits(self, remote, role):
+        """
+        :returns: sorted list of the executables in the workunits, as
+                  paths relative to the cache directory
+        """
+        listfile = '{path}.list.{role}'.format(path=self.path, role=role)
+        remote.run(
+            logger=log.getChild(role),
+            args=[
+                'cd', '--', self.path,
+                run.Raw('&&'),
+                'find', '-executable', '-type', 'f', '-printf', r'%P\0',
+                run.Raw('>{listfile}'.format(listfile=listfile)),
+            ],
+        )
+        try:
+            return sorted(misc.get_file(remote, listfile).split('\0'))
+        finally:
+            remote.run(args=['rm', '-f', '--', listfile])
+
+    def cleanup(self):
+        """
+        Remove the workunits from every host they were fetched to.
+        """
+        for remote in self.hosts.itervalues():
+            remote.run(
+                args=[
+                    'chmod', '-R', 'u+w', '--', self.path,
+                    run.Raw('&&'),
+                    'rm', '-rf', '--', self.path,
+                ],
+            )
+        self.hosts = {}
+        if self._tarball is not None:
+            os.remove(self._tarball)
+            self._tarball = None
+
+
+class Scheduler(object):
+    """
+    Runs workunits from a queue of (client, workunit) pairs, up to
+    ``concurrency`` at once on each client, each in a scratch dir of its
+    own, longest first according to the durations in ``history`` (dict of
+    workunit to seconds; those never timed go first).  The durations of
+    the workunits run are kept in ``durations`` as role: {workunit:
+    seconds}.
+    """
+    def __init__(self, ctx, refspec, env, subdir, timeout, cache,
+                 concurrency, history):
+        self.ctx = ctx
+        self.refspec = refspec
+        self.env = env
+        self.subdir = subdir
+        self.timeout = timeout
+        self.cache = cache
+        self.concurrency = concurrency
+        self.history = history
+        self.durations = {}
+
+    def run(self, tests_by_role):
+        """
+        Run the workunits matching the specs listed for each role.
+        """
+        queue = []
+        for role, tests in tests_by_role.iteritems():
+            assert isinstance(tests, list)
+            (remote,) = self.ctx.cluster.only(role).remotes.iterkeys()
+            self.cache.get(remote, role)
+            workunits = self.cache.list_workunits(remote, role)
+            for spec in tests:
+                queue.extend((role, w) for w in _matching_workunits(workunits, spec))
+        queue = workunit_durations.longest_first(queue, self.history)
+        log.info('Scheduled %d workunits: %s', len(queue),
+                 ', '.join('%s on %s' % (w, role) for role, w in queue))
+
+        start = time.time()
+        with parallel() as p:
+            for role in tests_by_role:
+                for slot in range(self.concurrency):
+                    p.spawn(self._worker, role, slot, queue)
+        log.info('Ran workunits in %.1fs', time.time() - start)
+
+    def _worker(self, role, slot, queue):
+        (remote,) = self.ctx.cluster.only(role).remotes.iterkeys()
+        # inside the role's dir, which _make_scratch_dir() made ours
+        scratch = os.path.join(_client_dir(self.ctx, role, self.subdir),
+                               'tmp.{slot}'.format(slot=slot))
+        while True:
+            mine = [pair for pair in queue if pair[0] == role]
+            if not mine:
+                return
+            queue.remove(mine[0])
+            workunit = mine[0][1]
+            self.durations.setdefault(role, {})[workunit] = _run_workunit(
+                self.ctx, remote, role, self.refspec, self.cache.path,
+                workunit, scratch, self.env, self.timeout)
 
 
 def task(ctx, config):
@@ -39,6 +243,11 @@ def task(ctx, config):
             clients:
               all: [direct_io, xattrs.sh, snaps]
 
+    The workunits are fetched and built once per host, and shared by all the
+    clients on it.  With "preseed: true" they are fetched by the teuthology
+    host and copied to each host, instead of every host fetching them from
+    git.
+
     If you have an "all" section it will run all the workunits
     on each client simultaneously, AFTER running any workunits specified
     for individual clients. (This prevents unintended simultaneous runs.)
@@ -58,6 +267,25 @@ def task(ctx, config):
               BAZ: quux
             timeout: 3h
 
+    Each client normally runs its workunits one after another, and the
+    "all" workunits in step: each one starts on all clients once the
+    previous one finished on all of them.  To shorten the job, give a
+    concurrency instead.  Then each client takes the next of its
+    workunits as soon as it has a free slot, up to that many at once,
+    each in a scratch dir of its own.  The time each workunit took is
+    stored in ctx.summary['workunit'], and if a durations file (JSON, on
+    the teuthology host) is given, recorded there and used by the next
+    run to start the longest workunits first:
+
+        tasks:
+        - ceph:
+        - ceph-fuse:
+        - workunit:
+            clients:
+              all: [rados, rbd]
+            concurrency: 2
+            durations: /home/teuthworker/workunit-durations.json
+
     :param ctx: Context
     :param config: Configuration
     """
@@ -79,6 +307,7 @@ def task(ctx, config):
     timeout = config.get('timeout', '3h')
 
     log.info('Pulling workunits from ref %s', refspec)
+    cache = WorkunitCache(ctx, refspec, config.get('preseed', False))
 
     created_mountpoint = {}
 
@@ -97,22 +326,42 @@ def task(ctx, config):
         created_mnt_dir = _make_scratch_dir(ctx, role, config.get('subdir'))
         created_mountpoint[role] = created_mnt_dir
 
-    # Execute any non-all workunits
-    with parallel() as p:
-        for role, tests in clients.iteritems():
-            if role != "all":
-                p.spawn(_run_tests, ctx, refspec, role, tests,
-                        config.get('env'), timeout=timeout)
-
-    # Clean up dirs from any non-all workunits
-    for role, created in created_mountpoint.items():
-        _delete_dir(ctx, role, created)
+    scheduler = None
+    if config.get('concurrency'):
+        history = workunit_durations.load(config.get('durations'))
+        scheduler = Scheduler(ctx, refspec, config.get('env'),
+                              config.get('subdir'), timeout, cache,
+                              int(config['concurrency']), history)
 
-    # Execute any 'all' workunits
-    if 'all' in clients:
-        all_tasks = clients["all"]
-        _spawn_on_all_clients(ctx, refspec, all_tasks, config.get('env'),
-                              config.get('subdir'), timeout=timeout)
+    try:
+        # Execute any non-all workunits
+        if scheduler is not None:
+            scheduler.run(dict((role, tests) for role, tests in clients.iteritems()
+                               if role != "all"))
+        else:
+            with parallel() as p:
+                for role, tests in clients.iteritems():
+                    if role != "all":
+                        p.spawn(_run_tests, ctx, refspec, role, tests,
+                                config.get('env'), timeout=timeout, cache=cache)
+
+        # Clean up dirs from any non-all workunits
+        for role, created in created_mountpoint.items():
+            _delete_dir(ctx, role, created)
+
+        # Execute any 'all' workunits
+        if 'all' in clients:
+            all_tasks = clients["all"]
+            _spawn_on_all_clients(ctx, refspec, all_tasks, config.get('env'),
+                                  config.get('subdir'), timeout=timeout,
+                                  cache=cache, scheduler=scheduler)
+    finally:
+        cache.cleanup()
+        if scheduler is not None:
+            ctx.summary['workunit'] = {'durations': scheduler.durations}
+            if config.get('durations'):
+                workunit_durations.save(config['durations'], history,
+                                scheduler.durations)
 
 
 def _delete_dir(ctx, role, created_mountpoint):
@@ -229,10 +478,12 @@ def _make_scratch_dir(ctx, role, subdir):
     return created_mountpoint
 
 
-def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None):
+def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None,
+                          cache=None, scheduler=None):
     """
     Make a scratch directory for each client in the cluster, and then for each
-    test spawn _run_tests() for each role.
+    test spawn _run_tests() for each role, or with a Scheduler, have it run
+    all the tests on every client.
 
     See run_tests() for parameter documentation.
     """
@@ -245,11 +496,14 @@ def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None):
         client_remotes.append((client_remote, 'client.{id}'.format(id=client)))
         created_mountpoint[client] = _make_scratch_dir(ctx, "client.{id}".format(id=client), subdir)
 
-    for unit in tests:
-        with parallel() as p:
-            for remote, role in client_remotes:
-                p.spawn(_run_tests, ctx, refspec, role, [unit], env, subdir,
-                        timeout=timeout)
+    if scheduler is not None:
+        scheduler.run(dict((role, tests) for _, role in client_remotes))
+    else:
+        for unit in tests:
+            with parallel() as p:
+                for remote, role in client_remotes:
+                    p.spawn(_run_tests, ctx, refspec, role, [unit], env, subdir,
+                            timeout=timeout, cache=cache)
 
     # cleanup the generated client directories
     client_generator = misc.all_roles_of_type(ctx.cluster, 'client')
@@ -257,10 +511,12 @@ def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None):
         _delete_dir(ctx, 'client.{id}'.format(id=client), created_mountpoint[client])
 
 
-def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None):
+def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None,
+               cache=None):
     """
-    Run the individual test. Create a scratch directory and then extract the
-    workunits from git. Make the executables, and then run the tests.
+    Run the individual test. Create a scratch directory and then get the
+    workunits from the cache, which extracts them from git and makes the
+    executables if they are not on this host yet, and then run the tests.
     Clean up (remove files created) after the tests are finished.
 
     :param ctx:     Context
@@ -274,99 +530,111 @@ def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None):
                     followed by 's' for seconds, 'm' for minutes, 'h' for
                     hours, or 'd' for days. If '0' or anything that evaluates
                     to False is passed, the 'timeout' command is not used.
+    :param cache:   WorkunitCache shared with the other roles.  If None, the
+                    workunits are fetched for this call only.
     """
-    testdir = misc.get_testdir(ctx)
     assert isinstance(role, basestring)
     assert role.startswith(CLIENT_PREFIX)
-    id_ = role[len(CLIENT_PREFIX):]
     (remote,) = ctx.cluster.only(role).remotes.iterkeys()
-    mnt = os.path.join(testdir, 'mnt.{id}'.format(id=id_))
-    # subdir so we can remove and recreate this a lot without sudo
-    if subdir is None:
-        scratch_tmp = os.path.join(mnt, 'client.{id}'.format(id=id_), 'tmp')
-    else:
-        scratch_tmp = os.path.join(mnt, subdir)
-    srcdir = '{tdir}/workunit.{role}'.format(tdir=testdir, role=role)
-
-    remote.run(
-        logger=log.getChild(role),
-        args=[
-            'mkdir', '--', srcdir,
-            run.Raw('&&'),
-            'git',
-            'archive',
-            '--remote=git://ceph.newdream.net/git/ceph.git',
-            '%s:qa/workunits' % refspec,
-            run.Raw('|'),
-            'tar',
-            '-C', srcdir,
-            '-x',
-            '-f-',
-            run.Raw('&&'),
-            'cd', '--', srcdir,
-            run.Raw('&&'),
-            'if', 'test', '-e', 'Makefile', run.Raw(';'), 'then', 'make', run.Raw(';'), 'fi',
-            run.Raw('&&'),
-            'find', '-executable', '-type', 'f', '-printf', r'%P\0'.format(srcdir=srcdir),
-            run.Raw('>{tdir}/workunits.list'.format(tdir=testdir)),
-        ],
-    )
-
-    workunits = sorted(misc.get_file(
-        remote,
-        '{tdir}/workunits.list'.format(tdir=testdir)).split('\0'))
+    scratch_tmp = _scratch_dir(ctx, role, subdir)
+    own_cache = cache is None
+    if own_cache:
+        cache = WorkunitCache(ctx, refspec)
+    srcdir = cache.get(remote, role)
+    workunits = cache.list_workunits(remote, role)
     assert workunits
 
     try:
         assert isinstance(tests, list)
         for spec in tests:
             log.info('Running workunits matching %s on %s...', spec, role)
-            prefix = '{spec}/'.format(spec=spec)
-            to_run = [w for w in workunits if w == spec or w.startswith(prefix)]
-            if not to_run:
-                raise RuntimeError('Spec did not match any workunits: {spec!r}'.format(spec=spec))
-            for workunit in to_run:
-                log.info('Running workunit %s...', workunit)
-                args = [
-                    'mkdir', '-p', '--', scratch_tmp,
-                    run.Raw('&&'),
-                    'cd', '--', scratch_tmp,
-                    run.Raw('&&'),
-                    run.Raw('CEPH_CLI_TEST_DUP_COMMAND=1'),
-                    run.Raw('CEPH_REF={ref}'.format(ref=refspec)),
-                    run.Raw('TESTDIR="{tdir}"'.format(tdir=testdir)),
-                    run.Raw('CEPH_ID="{id}"'.format(id=id_)),
-                ]
-                if env is not None:
-                    for var, val in env.iteritems():
-                        quoted_val = pipes.quote(val)
-                        env_arg = '{var}={val}'.format(var=var, val=quoted_val)
-                        args.append(run.Raw(env_arg))
-                args.extend([
-                    'adjust-ulimits',
-                    'ceph-coverage',
-                    '{tdir}/archive/coverage'.format(tdir=testdir)])
-                if timeout and timeout != '0':
-                    args.extend(['timeout', timeout])
-                args.extend([
-                    '{srcdir}/{workunit}'.format(
-                        srcdir=srcdir,
-                        workunit=workunit,
-                    ),
-                ])
-                remote.run(
-                    logger=log.getChild(role),
-                    args=args,
-                )
-                remote.run(
-                    logger=log.getChild(role),
-                    args=['sudo', 'rm', '-rf', '--', scratch_tmp],
-                )
+            for workunit in _matching_workunits(workunits, spec):
+                _run_workunit(ctx, remote, role, refspec, srcdir, workunit,
+                              scratch_tmp, env, timeout)
     finally:
         log.info('Stopping %s on %s...', tests, role)
-        remote.run(
-            logger=log.getChild(role),
-            args=[
-                'rm', '-rf', '--', '{tdir}/workunits.list'.format(tdir=testdir), srcdir,
-            ],
-        )
+        if own_cache:
+            cache.cleanup()
+
+
+def _client_dir(ctx, role, subdir=None):
+    """
+    The directory made for a role by _make_scratch_dir().
+    """
+    id_ = role[len(CLIENT_PREFIX):]
+    mnt = os.path.join(misc.get_testdir(ctx), 'mnt.{id}'.format(id=id_))
+    return os.path.join(mnt, subdir or 'client.{id}'.format(id=id_))
+
+
+def _scratch_dir(ctx, role, subdir=None):
+    """
+    The directory in which the workunits of a role run.
+    """
+    # subdir so we can remove and recreate this a lot without sudo
+    if subdir is None:
+        return os.path.join(_client_dir(ctx, role), 'tmp')
+    return _client_dir(ctx, role, subdir)
+
+
+def _matching_workunits(workunits, spec):
+    """
+    The workunits named by a spec: the one with that name, or all those
+    in the directory of that name.
+    """
+    prefix = '{spec}/'.format(spec=spec)
+    to_run = [w for w in workunits if w == spec or w.startswith(prefix)]
+    if not to_run:
+        raise RuntimeError('Spec did not match any workunits: {spec!r}'.format(spec=spec))
+    return to_run
+
+
+def _run_workunit(ctx, remote, role, refspec, srcdir, workunit, scratch_tmp,
+                  env, timeout):
+    """
+    Run one workunit in scratch_tmp, and remove scratch_tmp afterwards.
+    See _run_tests() for the parameters.
+
+    :returns: how long the workunit took, in seconds
+    """
+    testdir = misc.get_testdir(ctx)
+    id_ = role[len(CLIENT_PREFIX):]
+    log.info('Running workunit %s...', workunit)
+    args = [
+        'mkdir', '-p', '--', scratch_tmp,
+        run.Raw('&&'),
+        'cd', '--', scratch_tmp,
+        run.Raw('&&'),
+        run.Raw('CEPH_CLI_TEST_DUP_COMMAND=1'),
+        run.Raw('CEPH_REF={ref}'.format(ref=refspec)),
+        run.Raw('TESTDIR="{tdir}"'.format(tdir=testdir)),
+        run.Raw('CEPH_ID="{id}"'.format(id=id_)),
+    ]
+    if env is not None:
+        for var, val in env.iteritems():
+            quoted_val = pipes.quote(val)
+            env_arg = '{var}={val}'.format(var=var, val=quoted_val)
+            args.append(run.Raw(env_arg))
+    args.extend([
+        'adjust-ulimits',
+        'ceph-coverage',
+        '{tdir}/archive/coverage'.format(tdir=testdir)])
+    if timeout and timeout != '0':
+        args.extend(['timeout', timeout])
+    args.extend([
+        '{srcdir}/{workunit}'.format(
+            srcdir=srcdir,
+            workunit=workunit,
+        ),
+    ])
+    start = time.time()
+    remote.run(
+        logger=log.getChild(role),
+        args=args,
+    )
+    elapsed = time.time() - start
+    log.info('Workunit %s on %s took %.1fs', workunit, role, elapsed)
+    remote.run(
+        logger=log.getChild(role),
+        args=['sudo', 'rm', '-rf', '--', scratch_tmp],
+    )
+    return elapsed